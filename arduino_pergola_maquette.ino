@@ -12,6 +12,9 @@ int servoPositions[] = {90, 90, 90, 90}; // Front, Right, Back, Left
 // Target servo positions for smooth movement
 int targetPositions[] = {90, 90, 90, 90}; // Front, Right, Back, Left
 
+// Milliseconds between LDR samples; commands are read throughout
+const unsigned long LDR_INTERVAL = 500;
+
 // Servo movement speed (degrees per step)
 const int SERVO_SPEED = 8; // Balanced speed for smooth movement
 
@@ -19,6 +22,19 @@ const int SERVO_SPEED = 8; // Balanced speed for smooth movement
 unsigned long lastServoUpdate = 0;
 const int SERVO_UPDATE_INTERVAL = 0; // Update servos every loop for maximum responsiveness
 
+// Binary protocol, negotiated by the Pi with "PROTO:BIN1,<baud>" (ASCII until then)
+// Frame: SYNC | TYPE | fixed-width payload | CRC-8 (poly 0x07) over TYPE + payload
+const byte FRAME_SYNC = 0xA5;
+const byte FRAME_LDR = 0x01;          // 4 x 10-bit readings packed into 5 bytes
+const byte FRAME_SERVO_POS = 0x02;    // 4 x uint8
+const byte FRAME_SERVO_TARGET = 0x03; // 4 x uint8
+const byte FRAME_SERVOS = 0x11;       // 4 x uint8 (from Pi)
+bool binaryMode = false;
+
+// Incoming binary frame: TYPE + 4 payload bytes + CRC
+byte rxFrame[6];
+int rxCount = -1; // -1 = waiting for SYNC
+
 void setup() {
   Serial.begin(9600);
   
@@ -53,6 +69,8 @@ void setup() {
 }
 
 void loop() {
+  unsigned long loopStart = millis();
+  
   // Update servos smoothly
   updateServosSmooth();
   
@@ -63,22 +81,37 @@ void loop() {
   int ldrLeft = analogRead(A3);   // Left LDR
   
   // Always send sensor data (Pi will filter duplicates)
-  Serial.print("LDR:");
-  Serial.print(ldrFront); Serial.print(",");
-  Serial.print(ldrRight); Serial.print(",");
-  Serial.print(ldrBack); Serial.print(",");
-  Serial.println(ldrLeft);
+  if (binaryMode) {
+    sendLdrFrame(ldrFront, ldrRight, ldrBack, ldrLeft);
+  } else {
+    Serial.print("LDR:");
+    Serial.print(ldrFront); Serial.print(",");
+    Serial.print(ldrRight); Serial.print(",");
+    Serial.print(ldrBack); Serial.print(",");
+    Serial.println(ldrLeft);
+  }
+  
+  // Keep reading commands until the next sample is due: a joystick drag would
+  // overflow the 64-byte RX buffer if it were only drained once per loop
+  do {
+    readCommands();
+  } while (millis() - loopStart < LDR_INTERVAL);
+}
+
+void readCommands() {
+  if (binaryMode) {
+    readBinaryCommands();
+    return;
+  }
   
   // Process any incoming commands
-  while (Serial.available()) {
+  while (Serial.available() && !binaryMode) {
     String command = Serial.readStringUntil('\n');
     command.trim();
     if (command.length() > 0) {
       processCommand(command);
     }
   }
-  
-  delay(500); // Send data every 500ms for more reliable communication
 }
 
 void processCommand(String cmd) {
@@ -90,6 +123,86 @@ void processCommand(String cmd) {
     if (mode == "off") {
       setAllServos(90, 90, 90, 90); // Flat position
     }
+  } else if (cmd.startsWith("PROTO:BIN1,")) {
+    // Format: PROTO:BIN1,115200 - acknowledge, then switch baud rate and framing
+    long baud = cmd.substring(11).toInt();
+    if (baud > 0) {
+      Serial.print("PROTO_OK:BIN1,");
+      Serial.println(baud);
+      Serial.flush(); // Ack must leave at the old baud rate
+      Serial.end();
+      Serial.begin(baud);
+      binaryMode = true;
+      rxCount = -1;
+    }
+  }
+}
+
+byte crc8(const byte *data, int len) {
+  byte crc = 0;
+  for (int i = 0; i < len; i++) {
+    crc ^= data[i];
+    for (int bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x80) ? (byte)((crc << 1) ^ 0x07) : (byte)(crc << 1);
+    }
+  }
+  return crc;
+}
+
+void sendFrame(byte type, const byte *payload, int len) {
+  byte frame[6];
+  frame[0] = type;
+  for (int i = 0; i < len; i++) {
+    frame[i + 1] = payload[i];
+  }
+  Serial.write(FRAME_SYNC);
+  Serial.write(frame, len + 1);
+  Serial.write(crc8(frame, len + 1));
+}
+
+void sendLdrFrame(int front, int right, int back, int left) {
+  // Pack 4 x 10 bits little-endian: front | right << 10 | back << 20 | left << 30
+  byte payload[5];
+  payload[0] = (byte)(front & 0xFF);
+  payload[1] = (byte)((front >> 8) | ((right & 0x3F) << 2));
+  payload[2] = (byte)((right >> 6) | ((back & 0x0F) << 4));
+  payload[3] = (byte)((back >> 4) | ((left & 0x03) << 6));
+  payload[4] = (byte)(left >> 2);
+  sendFrame(FRAME_LDR, payload, 5);
+}
+
+void sendServoFrame(byte type, const int *positions) {
+  byte payload[4];
+  for (int i = 0; i < 4; i++) {
+    payload[i] = (byte)positions[i];
+  }
+  sendFrame(type, payload, 4);
+}
+
+void readBinaryCommands() {
+  while (Serial.available()) {
+    byte c = Serial.read();
+    
+    if (rxCount < 0) {
+      if (c == FRAME_SYNC) {
+        rxCount = 0;
+      }
+      continue;
+    }
+    
+    rxFrame[rxCount++] = c;
+    if (rxCount == 1 && c != FRAME_SERVOS) {
+      // Unknown type: resynchronise
+      rxCount = (c == FRAME_SYNC) ? 0 : -1;
+      continue;
+    }
+    
+    if (rxCount == 6) {
+      if (crc8(rxFrame, 5) == rxFrame[5]) {
+        setAllServos(rxFrame[1], rxFrame[2], rxFrame[3], rxFrame[4]);
+      }
+      rxCount = -1;
+    }
   }
 }
 
@@ -127,6 +240,10 @@ void setAllServos(int front, int right, int back, int left) {
   targetPositions[3] = left;
   
   // Always confirm target positions
+  if (binaryMode) {
+    sendServoFrame(FRAME_SERVO_TARGET, targetPositions);
+    return;
+  }
   Serial.print("SERVO_TARGET:");
   Serial.print(targetPositions[0]); Serial.print(",");
   Serial.print(targetPositions[1]); Serial.print(",");
@@ -164,6 +281,10 @@ void updateServosSmooth() {
       servoLeft.write(servoPositions[3]);
       
       // Send current positions
+      if (binaryMode) {
+        sendServoFrame(FRAME_SERVO_POS, servoPositions);
+        return;
+      }
       Serial.print("SERVO_POS:");
       Serial.print(servoPositions[0]); Serial.print(",");
       Serial.print(servoPositions[1]); Serial.print(",");
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+End-to-end latency benchmark: PergolaServer against a pty fake Arduino and scripted WebSocket clients
+
+Paths measured (all in one process, on one event loop, like the Pi):
+
+    command     SET_ANGLES sent by a client -> SERVOS bytes arriving at the fake Arduino
+    telemetry   LDR reading queued by the fake Arduino -> status frame received by one client
+    broadcast   the same, received by every one of --clients clients
+    commandThroughput    SET_ANGLES requests/s accepted, and servo commands/s emitted
+    telemetryThroughput  LDR samples/s processed from an unpaced flood
+
+Telemetry latencies include the serial wire time (the fake paces its output at the
+link baud rate, --no-pacing to leave it out) and the broadcast rate cap.
+
+Usage:
+    python benchmarks/bench_latency.py --output bench.json
+    python benchmarks/bench_latency.py --baseline bench.json --tolerance 0.25
+
+With --baseline the run exits with status 1 when a p99 latency or a throughput
+is worse than the baseline by more than the tolerance.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import websockets
+
+from fake_arduino import FakeArduino
+from pergola_logging import setup_logging
+from pergola_server_complete import LdrFilter, PergolaServer, angles_to_servo_positions
+
+RESULTS_VERSION = 1
+
+# (path, metric, direction): +1 when higher is worse, -1 when lower is worse
+REGRESSION_METRICS = [
+    ("command", "p99Ms", 1),
+    ("telemetry", "p99Ms", 1),
+    ("broadcast", "p99Ms", 1),
+    ("commandThroughput", "requestsPerSec", -1),
+    ("telemetryThroughput", "samplesPerSec", -1),
+]
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarize(latencies):
+    """p50/p90/p99/max/mean in milliseconds for a list of latencies in seconds"""
+    values = sorted(latencies)
+    if not values:
+        return {"count": 0}
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        "count": len(values),
+        "p50Ms": ms(percentile(values, 0.50)),
+        "p90Ms": ms(percentile(values, 0.90)),
+        "p99Ms": ms(percentile(values, 0.99)),
+        "maxMs": ms(values[-1]),
+        "meanMs": ms(sum(values) / len(values))
+    }
+
+def metadata():
+    """Where and on what the numbers were taken"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count()
+    }
+
+class BenchClient:
+    """Scripted WebSocket client that timestamps frames as they arrive"""
+
+    def __init__(self, url):
+        self.url = url
+        self.websocket = None
+        self.task = None
+        self.watch = None  # (predicate, future): resolved with the arrival time of the first match
+        self.frames = 0
+
+    async def connect(self):
+        self.websocket = await websockets.connect(self.url, max_size=None)
+        self.task = asyncio.create_task(self.reader())
+
+    async def reader(self):
+        async for message in self.websocket:
+            now = time.perf_counter()
+            self.frames += 1
+            if self.watch:
+                predicate, future = self.watch
+                if not future.done() and predicate(json.loads(message)):
+                    future.set_result(now)
+
+    def expect(self, predicate):
+        """Future resolved with the arrival time of the next frame matching predicate"""
+        future = asyncio.get_running_loop().create_future()
+        self.watch = (predicate, future)
+        return future
+
+    async def send(self, message):
+        await self.websocket.send(json.dumps(message))
+
+    async def close(self):
+        await self.websocket.close()
+        self.task.cancel()
+
+async def start_bench_server(fake, host="127.0.0.1"):
+    """Run PergolaServer on a free port against the fake Arduino; returns (server, ws_server, url)"""
+    server = PergolaServer(port=fake.port)
+    # Pass-through filter so every scripted LDR value reaches the status frame unchanged
+    server.ldr_filter = LdrFilter(median_window=1, alpha=1.0, outlier_threshold=None, min_change=1)
+    ws_server = await websockets.serve(server.handle_client, host, 0)
+    url = f"ws://{host}:{ws_server.sockets[0].getsockname()[1]}"
+
+    await server.start_device()
+    await fake.start()
+    deadline = time.monotonic() + 10.0
+    while server.link_state != "connected":
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"fake Arduino on {fake.port} never connected")
+        await asyncio.sleep(0.05)
+    # Let the protocol handshake and the first SERVO_POS settle
+    await asyncio.sleep(0.3)
+    return server, ws_server, url
+
+async def set_mode(server, client, mode):
+    await client.send({"cmd": "MODE", "mode": mode})
+    while server.current_mode != mode:
+        await asyncio.sleep(0.01)
+
+def angle_sequence(index):
+    """Manual angles whose servo vectors differ from the previous one by more than the deadband"""
+    horizontal = ((index % 17) - 8) * 4.0
+    vertical = ((index * 7 % 13) - 6) * 5.0
+    return horizontal, vertical
+
+async def bench_command(server, fake, client, samples, interval, timeout):
+    """SET_ANGLES -> SERVOS at the fake Arduino, one command at a time"""
+    latencies = []
+    missed = 0
+    for index in range(samples):
+        horizontal, vertical = angle_sequence(index)
+        expected = tuple(angles_to_servo_positions(horizontal, vertical))
+        arrived = asyncio.get_running_loop().create_future()
+        fake.on_command = lambda when, vector: (vector == expected and not arrived.done()
+                                                and arrived.set_result(when))
+        start = time.perf_counter()
+        await client.send({"cmd": "SET_ANGLES", "horiz": horizontal, "vert": vertical})
+        try:
+            latencies.append(await asyncio.wait_for(arrived, timeout) - start)
+        except asyncio.TimeoutError:
+            missed += 1
+        await asyncio.sleep(interval)
+    fake.on_command = None
+    return {**summarize(latencies), "missed": missed}
+
+async def bench_command_throughput(server, fake, client, duration):
+    """Joystick burst: SET_ANGLES as fast as the socket takes them"""
+    commands_before = len(fake.commands)
+    requests = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        horizontal, vertical = angle_sequence(requests)
+        await client.send({"cmd": "SET_ANGLES", "horiz": horizontal, "vert": vertical})
+        requests += 1
+        # Let the server run between messages, as it would with the app on another host
+        await asyncio.sleep(0)
+    # Everything sent is in the server's hands once a GET_STATUS round trip completes
+    reply = client.expect(lambda message: "mode" in message)
+    await client.send({"cmd": "GET_STATUS"})
+    await asyncio.wait_for(reply, 10.0)
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(server.angle_scheduler.tick * 2)
+    commands = len(fake.commands) - commands_before
+    return {
+        "durationS": round(elapsed, 3),
+        "requests": requests,
+        "requestsPerSec": round(requests / elapsed, 1),
+        "servoCommands": commands,
+        "servoCommandsPerSec": round(commands / elapsed, 1)
+    }
+
+async def bench_telemetry(server, fake, clients, samples, interval, timeout):
+    """LDR reading at the fake Arduino -> status frame at every client"""
+    latencies = []
+    spreads = []
+    missed = 0
+    for index in range(samples):
+        value = 400 + (index % 200) * 2
+        matches = lambda message, value=value: message.get("data", {}).get("ldrReadings", [None])[0] == value
+        arrivals = [client.expect(matches) for client in clients]
+        start = time.perf_counter()
+        fake.send_ldr([value, 500, 500, 500])
+        try:
+            times = await asyncio.wait_for(asyncio.gather(*arrivals), timeout)
+        except asyncio.TimeoutError:
+            missed += 1
+            continue
+        latencies.extend(t - start for t in times)
+        spreads.append(max(times) - min(times))
+        await asyncio.sleep(interval)
+    result = {**summarize(latencies), "missed": missed, "clients": len(clients)}
+    if len(clients) > 1:
+        result["spread"] = summarize(spreads)
+    return result
+
+async def bench_telemetry_throughput(server, fake, client, count, timeout):
+    """Unpaced LDR flood: how many samples per second the server ingests"""
+    samples_before = server.ldr_filter.samples
+    frames_before = client.frames
+    fake.pacing = False
+    start = time.perf_counter()
+    fake.flood([(300 + index % 500, 500, 500, 500) for index in range(count)])
+    deadline = start + timeout
+    while server.ldr_filter.samples - samples_before < count and time.perf_counter() < deadline:
+        await asyncio.sleep(0.005)
+    elapsed = time.perf_counter() - start
+    fake.pacing = True
+    processed = server.ldr_filter.samples - samples_before
+    await asyncio.sleep(1.0 / server.broadcast_max_rate * 2)
+    return {
+        "durationS": round(elapsed, 3),
+        "samples": processed,
+        "samplesPerSec": round(processed / elapsed, 1),
+        "statusFrames": client.frames - frames_before
+    }
+
+async def run(args):
+    fake = FakeArduino(ldr_interval=0.5, pacing=not args.no_pacing, binary=args.protocol == "binary")
+    server, ws_server, url = await start_bench_server(fake)
+    clients = [BenchClient(url) for _ in range(max(1, args.clients))]
+    for client in clients:
+        await client.connect()
+    await asyncio.sleep(0.2)
+
+    # Manual mode: no auto tracking moving servos (and pushing status) behind our back
+    await set_mode(server, clients[0], "manual")
+    results = {}
+    results["command"] = await bench_command(server, fake, clients[0], args.samples, args.interval, args.timeout)
+    results["commandThroughput"] = await bench_command_throughput(server, fake, clients[0], args.duration)
+    await asyncio.sleep(0.5)
+    results["telemetry"] = await bench_telemetry(server, fake, clients[:1], args.samples, args.interval,
+                                                 args.timeout)
+    results["broadcast"] = await bench_telemetry(server, fake, clients, args.samples, args.interval,
+                                                 args.timeout)
+    results["telemetryThroughput"] = await bench_telemetry_throughput(server, fake, clients[0],
+                                                                      args.flood, args.timeout * 10)
+
+    config = {
+        "protocol": "binary" if server.binary_mode else "ascii",
+        "baudrate": fake.baudrate,
+        "pacing": not args.no_pacing,
+        "samples": args.samples,
+        "intervalS": args.interval,
+        "clients": len(clients),
+        "throughputDurationS": args.duration,
+        "floodSamples": args.flood,
+        "angleTickMs": round(server.angle_scheduler.tick * 1000, 1),
+        "broadcastMaxRate": server.broadcast_max_rate
+    }
+
+    for client in clients:
+        await client.close()
+    ws_server.close()
+    fake.stop()
+    return {"benchmark": "latency", "version": RESULTS_VERSION, **metadata(), "config": config,
+            "results": results}
+
+def compare(current, baseline, tolerance, slack_ms):
+    """Regressions of current against baseline as readable strings"""
+    regressions = []
+    for path, metric, direction in REGRESSION_METRICS:
+        new = current["results"].get(path, {}).get(metric)
+        old = baseline.get("results", {}).get(path, {}).get(metric)
+        if new is None or old is None:
+            continue
+        if direction > 0 and new > old * (1 + tolerance) + slack_ms:
+            regressions.append(f"{path}.{metric}: {old} -> {new} ms")
+        elif direction < 0 and new < old * (1 - tolerance):
+            regressions.append(f"{path}.{metric}: {old} -> {new}/s")
+    return regressions
+
+def print_summary(report, stream):
+    results = report["results"]
+    config = report["config"]
+    print(f"⏱️ Latency benchmark ({config['protocol']} @ {config['baudrate']} baud, "
+          f"commit {report['commit']})", file=stream)
+    for path in ("command", "telemetry", "broadcast"):
+        stats = results[path]
+        if stats["count"]:
+            print(f"   {path:<10} p50 {stats['p50Ms']:7.2f} ms   p99 {stats['p99Ms']:7.2f} ms   "
+                  f"max {stats['maxMs']:7.2f} ms   ({stats['count']} samples, {stats['missed']} missed)",
+                  file=stream)
+        else:
+            print(f"   {path:<10} no samples ({stats['missed']} missed)", file=stream)
+    throughput = results["commandThroughput"]
+    print(f"   commands   {throughput['requestsPerSec']:.0f} SET_ANGLES/s -> "
+          f"{throughput['servoCommandsPerSec']:.0f} SERVOS/s", file=stream)
+    print(f"   samples    {results['telemetryThroughput']['samplesPerSec']:.0f} LDR samples/s", file=stream)
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency benchmark against a pty fake Arduino")
+    parser.add_argument("--samples", type=int, default=200, help="Measurements per latency path")
+    parser.add_argument("--interval", type=float, default=0.15,
+                        help="Seconds between measurements (above the broadcast rate cap)")
+    parser.add_argument("--clients", type=int, default=10, help="WebSocket clients for the broadcast path")
+    parser.add_argument("--duration", type=float, default=3.0, help="Seconds of SET_ANGLES burst")
+    parser.add_argument("--flood", type=int, default=20000, help="LDR samples in the throughput flood")
+    parser.add_argument("--timeout", type=float, default=2.0, help="Seconds before a measurement is missed")
+    parser.add_argument("--protocol", choices=["binary", "ascii"], default="binary",
+                        help="ascii: the fake ignores the binary handshake like an older sketch")
+    parser.add_argument("--no-pacing", action="store_true", help="Leave serial wire time out of telemetry")
+    parser.add_argument("--output", help="Write the JSON results here (default: stdout)")
+    parser.add_argument("--baseline", help="Earlier JSON results to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression")
+    parser.add_argument("--slack-ms", type=float, default=1.0, help="Allowed absolute latency regression")
+    parser.add_argument("--verbose", action="store_true", help="Server debug logs on stderr")
+    args = parser.parse_args()
+
+    # Production logging (info, through the queue) unless the debug lines are wanted
+    if args.verbose:
+        setup_logging("debug", rate_limit=0, stream=sys.stderr)
+    else:
+        setup_logging("info", path=os.devnull)
+    report = asyncio.run(run(args))
+
+    print_summary(report, sys.stderr)
+    document = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(document + "\n")
+    else:
+        print(document)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance, args.slack_ms)
+        for regression in regressions:
+            print(f"❌ Regression {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"✅ No regressions against {args.baseline}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
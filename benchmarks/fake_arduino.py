@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Pseudo-terminal stand-in for arduino_pergola_maquette.ino
+
+Speaks the sketch's serial protocol on the slave side of a pty so the real
+server code (probe, parsers, writer, supervisor) runs unchanged:
+
+    banner + SERVO_POS:90,90,90,90 after boot
+    LDR:<f>,<r>,<b>,<l> every ldr_interval seconds (or on demand)
+    SERVOS:a,b,c,d -> SERVO_TARGET echo, then SERVO_POS every step of SERVO_SPEED degrees
+    PROTO:BIN1,<baud> -> PROTO_OK and binary frames from then on
+
+Outgoing bytes are paced at the link's baud rate (10 bits per byte) unless
+pacing is disabled, so telemetry latencies include realistic wire time.
+"""
+
+import asyncio
+import os
+import pty
+import sys
+import time
+import tty
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pergola_protocol import (FRAME_SERVO_POS, FRAME_SERVO_TARGET, FRAME_SERVOS, FrameDecoder,
+                              encode_ldr, encode_servos)
+
+BANNER = "Pergola Maquette Ready - 4 LDRs + 4 Servos (Front/Right/Back/Left)"
+SERVO_SPEED = 8  # Degrees per step, as in the sketch
+
+class FakeArduino:
+    """Simulated pergola maquette behind a pty; port is the path the server opens"""
+
+    def __init__(self, ldr_interval=0.5, boot_delay=0.3, step_interval=0.002, baudrate=9600,
+                 pacing=True, binary=True):
+        self.ldr_interval = ldr_interval  # None: LDR lines only via send_ldr()
+        self.boot_delay = boot_delay  # Reset time before the banner
+        self.step_interval = step_interval  # Seconds between servo steps
+        self.baudrate = baudrate
+        self.pacing = pacing
+        self.binary_supported = binary  # False: ignore the handshake like an old sketch
+        self.binary = False
+
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        os.set_blocking(self.master, False)
+
+        self.ldr = [512, 487, 523, 498]
+        self.positions = [90, 90, 90, 90]
+        self.targets = [90, 90, 90, 90]
+        self.rx = bytearray()
+        self.decoder = FrameDecoder()
+        self.outgoing = deque()
+        self.wakeup = asyncio.Event()
+        self.tasks = []
+
+        # (perf_counter, (front, right, back, left)) for every SERVOS command received
+        self.commands = []
+        self.on_command = None  # Optional callback(timestamp, vector)
+        self.chunks_sent = 0
+
+    async def start(self):
+        """Boot (banner after boot_delay), then stream LDR lines and step servos"""
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.master, self.on_readable)
+        self.tasks.append(loop.create_task(self.writer()))
+        self.tasks.append(loop.create_task(self.stepper()))
+        await asyncio.sleep(self.boot_delay)
+        self.write_line(BANNER)
+        self.write_line("SERVO_POS:90,90,90,90")
+        if self.ldr_interval:
+            self.tasks.append(loop.create_task(self.streamer()))
+
+    def stop(self):
+        """Cancel tasks and close the pty"""
+        for task in self.tasks:
+            task.cancel()
+        try:
+            asyncio.get_running_loop().remove_reader(self.master)
+        except Exception:
+            pass
+        os.close(self.master)
+        os.close(self.slave)
+
+    # -- Outgoing --------------------------------------------------------
+
+    def write_line(self, line):
+        self.write_bytes(f"{line}\r\n".encode())
+
+    def write_bytes(self, data):
+        self.outgoing.append(data)
+        self.wakeup.set()
+
+    async def writer(self):
+        """Drain outgoing bytes, each chunk taking its wire time at the current baud rate"""
+        while True:
+            if not self.outgoing:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            data = self.outgoing.popleft()
+            if self.pacing:
+                await asyncio.sleep(len(data) * 10 / self.baudrate)
+            while data:
+                try:
+                    data = data[os.write(self.master, data):]
+                except BlockingIOError:
+                    # The server is behind and the pty buffer is full
+                    await self.writable()
+            self.chunks_sent += 1
+
+    async def writable(self):
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        loop.add_writer(self.master, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            loop.remove_writer(self.master)
+
+    def send_ldr(self, values):
+        """Queue one LDR reading now"""
+        self.ldr = list(values)
+        if self.binary:
+            self.write_bytes(encode_ldr(*values))
+        else:
+            self.write_line("LDR:" + ",".join(str(v) for v in values))
+
+    def flood(self, samples):
+        """Queue many LDR readings as one chunk (throughput runs); samples is a list of 4-tuples"""
+        if self.binary:
+            data = b"".join(encode_ldr(*values) for values in samples)
+        else:
+            data = "".join("LDR:%d,%d,%d,%d\r\n" % tuple(values) for values in samples).encode()
+        self.ldr = list(samples[-1])
+        self.write_bytes(data)
+
+    async def streamer(self):
+        while True:
+            await asyncio.sleep(self.ldr_interval)
+            self.send_ldr(self.ldr)
+
+    def send_servo_state(self, frame_type, prefix, values):
+        if self.binary:
+            self.write_bytes(encode_servos(*values, frame_type=frame_type))
+        else:
+            self.write_line(prefix + ",".join(str(v) for v in values))
+
+    async def stepper(self):
+        """Move each servo SERVO_SPEED degrees per step towards its target, reporting SERVO_POS"""
+        while True:
+            await asyncio.sleep(self.step_interval)
+            # Serial.print blocks once the sketch's TX buffer is full, which slows its loop down
+            if self.positions == self.targets or self.outgoing:
+                continue
+            for i, (position, target) in enumerate(zip(self.positions, self.targets)):
+                if position < target:
+                    self.positions[i] = min(position + SERVO_SPEED, target)
+                elif position > target:
+                    self.positions[i] = max(position - SERVO_SPEED, target)
+            self.send_servo_state(FRAME_SERVO_POS, "SERVO_POS:", self.positions)
+
+    # -- Incoming --------------------------------------------------------
+
+    def on_readable(self):
+        try:
+            data = os.read(self.master, 4096)
+        except OSError:
+            return
+        now = time.perf_counter()
+        if self.binary:
+            for frame_type, values in self.decoder.feed(data):
+                if frame_type == FRAME_SERVOS:
+                    self.set_servos(now, values)
+            return
+        self.rx += data
+        while True:
+            newline = self.rx.find(b"\n")
+            if newline < 0:
+                break
+            line = self.rx[:newline].decode(errors="replace").strip()
+            del self.rx[:newline + 1]
+            self.process_command(now, line)
+            if self.binary:
+                # Anything after the handshake is framed
+                rest = bytes(self.rx)
+                self.rx.clear()
+                for frame_type, values in self.decoder.feed(rest):
+                    if frame_type == FRAME_SERVOS:
+                        self.set_servos(now, values)
+                break
+
+    def process_command(self, now, line):
+        if line.startswith("SERVOS:"):
+            try:
+                values = [int(v) for v in line[7:].split(",")]
+            except ValueError:
+                return
+            if len(values) == 4:
+                self.set_servos(now, values)
+        elif line.startswith("PROTO:BIN1,") and self.binary_supported:
+            baud = int(line[11:] or 0)
+            if baud > 0:
+                self.write_line(f"PROTO_OK:BIN1,{baud}")
+                self.binary = True
+                self.baudrate = baud
+
+    def set_servos(self, now, values):
+        vector = tuple(max(0, min(180, v)) for v in values)
+        self.commands.append((now, vector))
+        if self.on_command:
+            self.on_command(now, vector)
+        self.targets = list(vector)
+        self.send_servo_state(FRAME_SERVO_TARGET, "SERVO_TARGET:", self.targets)
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+WebSocket fan-out load generator: how the server scales with the number of connected dashboards
+
+The server (PergolaServer + pty fake Arduino) runs in a child process so its CPU time,
+memory and event-loop lag are measured apart from the load clients. The fake Arduino
+changes its LDR reading every --ldr-interval seconds; every change must reach every
+client as a status frame, which gives the per-client delivery latency.
+
+For each client count in --steps the clients run a mixed workload for --duration seconds:
+
+    pollers     GET_DASHBOARD_DATA every --poll-interval seconds (phones, wall displays)
+    joysticks   SET_ANGLES at --joystick-rate per second (--joysticks clients)
+    flippers    MODE manual/auto every --flip-interval seconds (--flippers clients)
+
+Usage:
+    python benchmarks/load_clients.py --steps 1,10,50,100,200 --output fanout.json
+
+The marginal CPU cost of each frame added between steps should stay flat as clients are
+added (it rises with O(N^2) fan-out); --max-growth makes the run exit with status 1 when it
+grows more than that factor from the first pair of steps to the last.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(0, ROOT)
+
+import websockets
+
+from bench_latency import metadata, start_bench_server, summarize
+from fake_arduino import FakeArduino
+from pergola_logging import setup_logging
+
+RESULTS_VERSION = 1
+LDR_MIN = 300
+LDR_MAX = 1023  # 10-bit ADC
+
+# -- Server side (child process) ------------------------------------------
+
+async def serve(args):
+    """Run the server, change the LDR reading on a schedule and answer RESET/STATS on stdin"""
+    fake = FakeArduino(ldr_interval=None)
+    server, ws_server, url = await start_bench_server(fake)
+    loop = asyncio.get_running_loop()
+    lags = []
+    sent = {}  # LDR value -> perf_counter when queued at the fake Arduino
+
+    async def lag_monitor():
+        while True:
+            start = loop.time()
+            await asyncio.sleep(0.01)
+            lags.append(loop.time() - start - 0.01)
+
+    async def ldr_changer():
+        value = LDR_MIN
+        while True:
+            await asyncio.sleep(args.ldr_interval)
+            value = value + 1 if value < LDR_MAX else LDR_MIN
+            sent[value] = time.perf_counter()
+            fake.send_ldr([value, 500, 500, 500])
+
+    def reply(message):
+        sys.__stdout__.write(json.dumps(message) + "\n")
+        sys.__stdout__.flush()
+
+    commands = asyncio.Queue()
+    loop.add_reader(sys.stdin.fileno(), lambda: commands.put_nowait(sys.stdin.readline().strip()))
+    loop.create_task(lag_monitor())
+    loop.create_task(ldr_changer())
+    reply({"url": url, "pid": os.getpid()})
+
+    while True:
+        command = await commands.get()
+        if command == "RESET":
+            lags.clear()
+            sent.clear()
+            reply({"ok": True})
+        elif command == "STATS":
+            reply({
+                "lag": summarize(lags),
+                "sent": sent,
+                "clients": len(server.clients),
+                "evicted": server.clients_evicted,
+                "pushes": server.broadcast_pushes,
+                "coalesced": server.broadcast_coalesced
+            })
+        else:
+            break
+    ws_server.close()
+    fake.stop()
+
+# -- Load side ------------------------------------------------------------
+
+class LoadClient:
+    """One dashboard: records when each LDR value first shows up in a frame"""
+
+    def __init__(self, url, role):
+        self.url = url
+        self.role = role
+        self.websocket = None
+        self.reader_task = None
+        self.seen = {}  # LDR value -> perf_counter of the first frame showing it
+        self.frames = 0
+        self.sent = 0
+
+    async def connect(self):
+        self.websocket = await websockets.connect(self.url, max_size=None)
+        self.reader_task = asyncio.create_task(self.reader())
+
+    async def reader(self):
+        try:
+            async for message in self.websocket:
+                now = time.perf_counter()
+                self.frames += 1
+                readings = json.loads(message).get("data", {}).get("ldrReadings")
+                if readings and readings[0] not in self.seen:
+                    self.seen[readings[0]] = now
+        except websockets.ConnectionClosed:
+            pass
+
+    async def send(self, message):
+        await self.websocket.send(json.dumps(message))
+        self.sent += 1
+
+    async def workload(self, args, duration):
+        """Send this client's role's traffic for duration seconds"""
+        end = time.perf_counter() + duration
+        if self.role == "joystick":
+            period = 1.0 / args.joystick_rate
+            index = 0
+            while time.perf_counter() < end:
+                angle = 30.0 * ((index % 40) / 20.0 - 1.0)
+                await self.send({"cmd": "SET_ANGLES", "horiz": angle, "vert": -angle / 2})
+                index += 1
+                await asyncio.sleep(period)
+        elif self.role == "flipper":
+            mode = "manual"
+            while time.perf_counter() < end:
+                await self.send({"cmd": "MODE", "mode": mode})
+                mode = "auto" if mode == "manual" else "manual"
+                await asyncio.sleep(args.flip_interval)
+        else:
+            # Random phase so pollers don't all fire in the same millisecond
+            await asyncio.sleep(random.uniform(0, args.poll_interval))
+            while time.perf_counter() < end:
+                await self.send({"cmd": "GET_DASHBOARD_DATA"})
+                await asyncio.sleep(args.poll_interval)
+
+    async def close(self):
+        with contextlib.suppress(Exception):
+            await self.websocket.close()
+        self.reader_task.cancel()
+
+class ServerProcess:
+    """The child process running the server; talks JSON lines over stdin/stdout"""
+
+    def __init__(self, args):
+        self.args = args
+        self.process = None
+        self.url = None
+        self.pid = None
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), "--serve", "--ldr-interval", str(self.args.ldr_interval),
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE)
+        hello = await self.read()
+        self.url = hello["url"]
+        self.pid = hello["pid"]
+
+    async def read(self):
+        line = await asyncio.wait_for(self.process.stdout.readline(), 30.0)
+        if not line:
+            raise RuntimeError("server process exited")
+        return json.loads(line)
+
+    async def request(self, command):
+        self.process.stdin.write(command.encode() + b"\n")
+        await self.process.stdin.drain()
+        return await self.read()
+
+    async def stop(self):
+        with contextlib.suppress(Exception):
+            self.process.stdin.write(b"QUIT\n")
+            await self.process.stdin.drain()
+            await asyncio.wait_for(self.process.wait(), 5.0)
+        if self.process.returncode is None:
+            self.process.kill()
+
+    def cpu_seconds(self):
+        """User + system CPU time of the server process (Linux /proc), None elsewhere"""
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def rss_kb(self):
+        """Resident set size of the server process in KB (Linux /proc), None elsewhere"""
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1])
+        except (OSError, ValueError):
+            pass
+        return None
+
+def assign_role(index, args):
+    if index < args.joysticks:
+        return "joystick"
+    if index < args.joysticks + args.flippers:
+        return "flipper"
+    return "poller"
+
+async def run_step(server, clients, args):
+    """Run the mixed workload once with the current clients and measure it"""
+    await server.request("RESET")
+    for client in clients:
+        client.seen.clear()
+    frames_before = sum(client.frames for client in clients)
+    cpu_before = server.cpu_seconds()
+    start = time.perf_counter()
+
+    await asyncio.gather(*(client.workload(args, args.duration) for client in clients))
+    # Let the last changes arrive before counting what went missing
+    await asyncio.sleep(max(0.5, args.ldr_interval * 2))
+
+    elapsed = time.perf_counter() - start
+    cpu_after = server.cpu_seconds()
+    stats = await server.request("STATS")
+    frames = sum(client.frames for client in clients) - frames_before
+
+    # Values queued in the last half second may legitimately still be in flight
+    cutoff = time.perf_counter() - 0.5
+    sent = {int(value): at for value, at in stats["sent"].items() if at < cutoff}
+    latencies = []
+    client_p99 = []
+    missed = 0
+    for client in clients:
+        own = [client.seen[value] - at for value, at in sent.items() if value in client.seen]
+        missed += len(sent) - len(own)
+        latencies.extend(own)
+        if own:
+            client_p99.append(summarize(own)["p99Ms"])
+
+    cpu = None if cpu_before is None or cpu_after is None else cpu_after - cpu_before
+    return {
+        "clients": len(clients),
+        "roles": {role: sum(1 for c in clients if c.role == role) for role in ("poller", "joystick", "flipper")},
+        "durationS": round(elapsed, 3),
+        "delivery": summarize(latencies),
+        "worstClientP99Ms": max(client_p99) if client_p99 else None,
+        "missed": missed,
+        "expected": len(sent) * len(clients),
+        "framesDelivered": frames,
+        "framesPerSec": round(frames / elapsed, 1),
+        "requestsSent": sum(client.sent for client in clients),
+        "eventLoopLag": stats["lag"],
+        "cpuSeconds": None if cpu is None else round(cpu, 3),
+        "cpuPercent": None if cpu is None else round(100 * cpu / elapsed, 1),
+        "cpuUsPerFrame": None if cpu is None or not frames else round(cpu * 1e6 / frames, 1),
+        "rssKb": server.rss_kb(),
+        "evicted": stats["evicted"],
+        "broadcastPushes": stats["pushes"]
+    }
+
+async def run(args):
+    server = ServerProcess(args)
+    await server.start()
+    clients = []
+    steps = []
+    try:
+        await asyncio.sleep(1.0)
+        rss_idle = server.rss_kb()
+        for count in args.steps:
+            connect_start = time.perf_counter()
+            while len(clients) < count:
+                client = LoadClient(server.url, assign_role(len(clients), args))
+                await client.connect()
+                clients.append(client)
+            connect_ms = round((time.perf_counter() - connect_start) * 1000, 1)
+            await asyncio.sleep(args.settle)
+
+            step = await run_step(server, clients, args)
+            step["connectMs"] = connect_ms
+            if rss_idle is not None and step["rssKb"] is not None:
+                step["rssPerClientKb"] = round((step["rssKb"] - rss_idle) / count, 1)
+            steps.append(step)
+            print_step(step, sys.stderr)
+            for client in clients:
+                client.sent = 0
+    finally:
+        for client in clients:
+            await client.close()
+        await server.stop()
+
+    # Marginal cost of the frames each step added: flat for O(N) fan-out, rising for O(N^2)
+    costs = []
+    for previous, step in zip(steps, steps[1:]):
+        if step["cpuSeconds"] is None or previous["cpuSeconds"] is None:
+            continue
+        frames = step["framesDelivered"] - previous["framesDelivered"]
+        if frames > 0:
+            costs.append(round(max(0.0, step["cpuSeconds"] - previous["cpuSeconds"]) * 1e6 / frames, 1))
+    growth = round(costs[-1] / costs[0], 2) if len(costs) > 1 and costs[0] > 0 else None
+    config = {
+        "steps": args.steps,
+        "durationS": args.duration,
+        "ldrIntervalS": args.ldr_interval,
+        "pollIntervalS": args.poll_interval,
+        "joysticks": args.joysticks,
+        "joystickRate": args.joystick_rate,
+        "flippers": args.flippers,
+        "flipIntervalS": args.flip_interval
+    }
+    return {"benchmark": "fanout", "version": RESULTS_VERSION, **metadata(), "config": config,
+            "rssIdleKb": rss_idle, "steps": steps, "scaling": {"marginalUsPerFrame": costs, "growth": growth}}
+
+def print_step(step, stream):
+    delivery = step["delivery"]
+    lag = step["eventLoopLag"]
+    latency = (f"p50 {delivery['p50Ms']:7.2f} ms  p99 {delivery['p99Ms']:7.2f} ms"
+               if delivery["count"] else "no deliveries")
+    cpu = f"{step['cpuPercent']:5.1f}% CPU" if step["cpuPercent"] is not None else "CPU n/a"
+    print(f"👥 {step['clients']:4d} clients  {latency}  lag p99 {lag.get('p99Ms', 0):6.2f} ms  {cpu}  "
+          f"RSS {step['rssKb'] or 0} KB ({step.get('rssPerClientKb', 0)} KB/client)  "
+          f"missed {step['missed']}/{step['expected']}", file=stream)
+
+def parse_steps(value):
+    steps = sorted({int(step) for step in value.split(",") if step.strip()})
+    if not steps or steps[0] < 1:
+        raise argparse.ArgumentTypeError("steps must be positive client counts")
+    return steps
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket fan-out load generator")
+    parser.add_argument("--steps", type=parse_steps, default=parse_steps("1,10,25,50,100"),
+                        help="Comma-separated client counts, clients are added between steps")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of workload per step")
+    parser.add_argument("--settle", type=float, default=1.0, help="Seconds between connecting and measuring")
+    parser.add_argument("--ldr-interval", type=float, default=0.2, help="Seconds between LDR changes")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between dashboard polls")
+    parser.add_argument("--joysticks", type=int, default=1, help="Clients streaming SET_ANGLES")
+    parser.add_argument("--joystick-rate", type=float, default=20.0, help="SET_ANGLES per second per joystick")
+    parser.add_argument("--flippers", type=int, default=1, help="Clients flipping MODE")
+    parser.add_argument("--flip-interval", type=float, default=3.0, help="Seconds between MODE flips")
+    parser.add_argument("--output", help="Write the JSON results here (default: stdout)")
+    parser.add_argument("--max-growth", type=float,
+                        help="Fail when the marginal CPU per frame grows more than this factor across the steps")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        # Production logging, kept out of the control channel
+        setup_logging("info", path=os.devnull)
+        asyncio.run(serve(args))
+        return
+
+    # The sent-value map must not wrap around within one step
+    span = (LDR_MAX - LDR_MIN) * args.ldr_interval
+    if args.duration + 1 >= span:
+        parser.error(f"--duration must stay below {span - 1:.0f}s at this --ldr-interval")
+
+    report = asyncio.run(run(args))
+    growth = report["scaling"]["growth"]
+    if growth is not None:
+        print(f"📈 Marginal CPU per delivered frame grew {growth}x from {args.steps[0]} to {args.steps[-1]} clients",
+              file=sys.stderr)
+    document = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(document + "\n")
+    else:
+        print(document)
+
+    if args.max_growth is not None and growth is not None and growth > args.max_growth:
+        print(f"❌ Fan-out cost grew {growth}x (limit {args.max_growth}x)", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+-- UPDATE DATABASE SCHEMA: Per-minute and per-hour telemetry rollups
+-- Run this script AFTER setup-optimized.sql
+-- The Pi uploads one row per minute and per hour instead of every 500 ms sample
+-- pergola_logs now only receives mode and night mode changes: read sensor history from pergola_rollups
+
+-- ==============================================
+-- STEP 1: Create pergola_rollups table
+-- ==============================================
+
+CREATE TABLE IF NOT EXISTS public.pergola_rollups (
+    id BIGSERIAL PRIMARY KEY,
+    user_id UUID REFERENCES public.users(id) ON DELETE CASCADE,
+    device TEXT,
+    period TEXT NOT NULL CHECK (period IN ('minute', 'hour')),
+    period_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    samples INTEGER NOT NULL,
+    lux_min INTEGER,
+    lux_max INTEGER,
+    lux_mean NUMERIC(8,2),
+    auto_seconds NUMERIC(7,2) DEFAULT 0,
+    manual_seconds NUMERIC(7,2) DEFAULT 0,
+    off_seconds NUMERIC(7,2) DEFAULT 0,
+    night_seconds NUMERIC(7,2) DEFAULT 0,
+    servo_travel INTEGER DEFAULT 0
+);
+
+-- Dashboards read one device and period over a time range
+CREATE INDEX IF NOT EXISTS idx_pergola_rollups_range ON public.pergola_rollups(device, period, period_start);
+CREATE INDEX IF NOT EXISTS idx_pergola_rollups_user_id ON public.pergola_rollups(user_id);
+
+-- ==============================================
+-- STEP 2: RLS policies
+-- ==============================================
+
+ALTER TABLE public.pergola_rollups ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "rollups_select_own_optimized" ON public.pergola_rollups;
+CREATE POLICY "rollups_select_own_optimized" ON public.pergola_rollups
+    FOR SELECT USING ((SELECT auth.uid()) = user_id);
+
+GRANT ALL ON public.pergola_rollups TO authenticated;
+
+-- ==============================================
+-- STEP 3: Tiered retention
+-- ==============================================
+
+-- Minute rollups are kept for 30 days, hour rollups indefinitely.
+-- The Pi prunes on its own schedule; this function does the same server side
+-- (e.g. from pg_cron: SELECT cron.schedule('0 3 * * *', 'SELECT public.prune_pergola_rollups()');)
+CREATE OR REPLACE FUNCTION public.prune_pergola_rollups(minute_retention INTERVAL DEFAULT INTERVAL '30 days')
+RETURNS INTEGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    removed INTEGER;
+BEGIN
+    DELETE FROM public.pergola_rollups
+    WHERE period = 'minute' AND period_start < NOW() - minute_retention;
+    GET DIAGNOSTICS removed = ROW_COUNT;
+    RETURN removed;
+END;
+$$;
+
+-- ==============================================
+-- VERIFICATION
+-- ==============================================
+
+SELECT 'pergola_rollups structure:' as info;
+SELECT column_name, data_type, is_nullable 
+FROM information_schema.columns 
+WHERE table_schema = 'public' 
+AND table_name = 'pergola_rollups' 
+ORDER BY ordinal_position;
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Leveled, non-blocking logging for the Pi server
+
+Every subsystem logs through its own logger ("pergola.serial", "pergola.tracking", ...)
+so levels can be set per subsystem. Records go through a bounded queue to a listener
+thread that does the actual writing, so the event loop never waits on stdout, journald
+or the SD card; when the queue is full records are dropped and counted instead.
+
+    pergola.server      startup, mode changes
+    pergola.serial      Arduino link, protocol, commands sent (debug)
+    pergola.serial.raw  every raw line from the Arduino (debug)
+    pergola.sensors     LDR changes and servo echoes (debug, per sample)
+    pergola.tracking    sun path, tracking decisions (debug, per sample)
+    pergola.night       night mode transitions
+    pergola.clients     WebSocket clients, commands received (debug)
+    pergola.storage     log database and spill file
+
+Identical messages repeated within the rate-limit window are suppressed and counted
+on the next one let through. Per-sample debug lines (sensors, tracking) can be sampled
+to one in N.
+
+    setup_logging(level="info", levels={"serial": "debug"}, sample=10)
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from datetime import datetime, timezone
+
+from pergola_metrics import METRICS
+
+# Subsystems whose debug lines fire on every sample
+SAMPLED_SUBSYSTEMS = ("sensors", "tracking")
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# LogRecord attributes that are not user-supplied extra fields
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+class RateLimitFilter(logging.Filter):
+    """Let an identical message through once per interval, counting the repeats in between"""
+
+    def __init__(self, interval=10.0, max_keys=1000):
+        super().__init__()
+        self.interval = interval
+        self.max_keys = max_keys
+        self.seen = {}  # (logger, level, message) -> [last emitted at, suppressed since]
+        self.suppressed = 0
+
+    def filter(self, record):
+        if not self.interval:
+            return True
+        message = record.getMessage()
+        key = (record.name, record.levelno, message)
+        now = time.monotonic()
+        entry = self.seen.get(key)
+        if entry is not None and now - entry[0] < self.interval:
+            entry[1] += 1
+            self.suppressed += 1
+            return False
+
+        if entry is not None and entry[1]:
+            record.msg = f"{message} ({entry[1]} repeats suppressed)"
+            record.args = None
+        if len(self.seen) >= self.max_keys:
+            # Forget everything outside the window
+            self.seen = {k: v for k, v in self.seen.items() if now - v[0] < self.interval}
+        self.seen[key] = [now, 0]
+        return True
+
+class SampleFilter(logging.Filter):
+    """Keep one in every N debug records per message template (higher levels always pass)"""
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = every
+        self.counts = {}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.every <= 1:
+            return True
+        count = self.counts.get(record.msg, 0)
+        self.counts[record.msg] = count + 1
+        return count % self.every == 0
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg and any extra={...} fields"""
+
+    def format(self, record):
+        document = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith("_"):
+                document[key] = value
+        if record.exc_info:
+            document["exc"] = self.formatException(record.exc_info)
+        return json.dumps(document, ensure_ascii=False, default=str)
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+listener = None
+
+def parse_levels(value):
+    """"serial=debug,tracking=info" -> {"serial": "debug", "tracking": "info"}"""
+    levels = {}
+    for item in filter(None, (part.strip() for part in (value or "").split(","))):
+        subsystem, _, level = item.partition("=")
+        levels[subsystem.strip()] = level.strip()
+    return levels
+
+def setup_logging(level="info", levels=None, fmt="text", sample=1, rate_limit=10.0,
+                  path=None, max_queue=10000, stream=None):
+    """Route every pergola.* logger through a bounded queue to one writer thread"""
+    global listener
+    stop_logging()
+
+    # Thread, process and multiprocessing names are never logged, skip looking them up
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    if path:
+        output = logging.handlers.WatchedFileHandler(path, encoding="utf-8")
+    else:
+        output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    handler = DroppingQueueHandler(queue.Queue(max_queue))
+    limiter = RateLimitFilter(rate_limit)
+    handler.addFilter(limiter)
+
+    root = logging.getLogger("pergola")
+    root.handlers[:] = [handler]
+    root.propagate = False
+    root.setLevel(level.upper())
+    for subsystem, subsystem_level in (levels or {}).items():
+        logging.getLogger(f"pergola.{subsystem}").setLevel(subsystem_level.upper())
+    for subsystem in SAMPLED_SUBSYSTEMS:
+        logger = logging.getLogger(f"pergola.{subsystem}")
+        logger.filters[:] = [SampleFilter(sample)] if sample > 1 else []
+
+    listener = logging.handlers.QueueListener(handler.queue, output)
+    listener.start()
+
+    METRICS.counter("pergola_log_records_dropped_total",
+                    "Log records dropped because the log queue was full").labels().track(lambda: handler.dropped)
+    METRICS.counter("pergola_log_records_suppressed_total",
+                    "Repeated log records suppressed by the rate limit").labels().track(lambda: limiter.suppressed)
+    return listener
+
+def stop_logging():
+    """Flush the queue and stop the writer thread"""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+def add_arguments(parser):
+    """Logging options shared by the server and the tools"""
+    parser.add_argument("--log-level", default="info", help="Level for every subsystem (debug, info, warning, error)")
+    parser.add_argument("--log-levels", type=parse_levels, default={},
+                        help="Per-subsystem levels, e.g. serial=debug,tracking=debug")
+    parser.add_argument("--log-format", choices=["text", "json"], default="text", help="Line format")
+    parser.add_argument("--log-file", help="Write here instead of stdout")
+    parser.add_argument("--log-sample", type=int, default=1,
+                        help="Keep one in N per-sample debug lines (sensors, tracking)")
+    parser.add_argument("--log-rate-limit", type=float, default=10.0,
+                        help="Seconds an identical message is suppressed after being logged (0 disables)")
+
+def setup_from_args(args):
+    return setup_logging(args.log_level, args.log_levels, args.log_format, args.log_sample,
+                         args.log_rate_limit, args.log_file)
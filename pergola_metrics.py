@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Low-overhead metrics for the Pi server, served in Prometheus text format
+
+Histograms have fixed bucket bounds: an observation is one bisect and three
+additions, no allocation. Counters and gauges can instead read a value the
+server already keeps (a callback evaluated only when /metrics is scraped), so
+most of them cost nothing on the hot path.
+
+    STAGE = METRICS.histogram("pergola_stage_seconds", "Time per stage", ("stage",))
+
+    @timed(STAGE.labels("check_night_mode"))
+    def check_night_mode(self): ...
+
+    METRICS.gauge("pergola_serial_queue_depth", "...", ("device",)).labels("ttyACM0").track(lambda: len(queue))
+
+    await start_metrics_server("127.0.0.1", 9180)   # GET /metrics, plus the event loop lag monitor
+"""
+
+import asyncio
+import functools
+import math
+import time
+from bisect import bisect_left
+
+# Seconds: 10 µs to 1 s, the range between a parse and a stalled loop
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                   0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+def format_labels(names, values, extra=None):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class Histogram:
+    """Cumulative-on-render histogram over fixed bounds"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labelnames, labelvalues):
+        cumulative = 0
+        for bound, count in zip((*self.bounds, math.inf), self.counts):
+            cumulative += count
+            le = f'le="{format_value(bound)}"'
+            yield f"{name}_bucket{format_labels(labelnames, labelvalues, le)} {cumulative}"
+        labels = format_labels(labelnames, labelvalues)
+        yield f"{name}_sum{labels} {format_value(self.sum)}"
+        yield f"{name}_count{labels} {self.count}"
+
+class Value:
+    """Counter or gauge: set/increment directly, or track() a callback read at scrape time"""
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def track(self, function):
+        self.function = function
+        return self
+
+    def samples(self, name, labelnames, labelvalues):
+        try:
+            value = self.function() if self.function else self.value
+        except Exception:
+            return
+        yield f"{name}{format_labels(labelnames, labelvalues)} {format_value(value)}"
+
+class Family:
+    """One metric name with a child per label combination"""
+
+    def __init__(self, name, help, kind, labelnames, factory):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.factory = factory
+        self.children = {}
+
+    def labels(self, *values):
+        """Child for these label values, created on first use (cache it on hot paths)"""
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.factory()
+        return child
+
+    def remove(self, *values):
+        self.children.pop(tuple(str(value) for value in values), None)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self.children.items()):
+            lines.extend(child.samples(self.name, self.labelnames, values))
+        return lines
+
+class MetricsRegistry:
+    """Every metric family of the process"""
+
+    def __init__(self):
+        self.families = {}
+
+    def register(self, name, help, kind, labelnames, factory):
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = Family(name, help, kind, labelnames, factory)
+        return family
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(name, help, "histogram", labelnames, lambda: Histogram(buckets))
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(name, help, "counter", labelnames, Value)
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(name, help, "gauge", labelnames, Value)
+
+    def render(self):
+        """Prometheus text exposition format 0.0.4"""
+        lines = []
+        for family in list(self.families.values()):
+            if family.children:
+                lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+METRICS = MetricsRegistry()
+
+LOOP_LAG = METRICS.gauge("pergola_event_loop_lag_seconds", "Most recent event loop scheduling delay")
+LOOP_LAG_OBSERVED = METRICS.histogram("pergola_event_loop_lag_observed_seconds",
+                                      "Event loop scheduling delay, sampled every 250 ms").labels()
+
+def timed(histogram):
+    """Decorator recording a method's duration (exceptions included) in histogram"""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+async def monitor_event_loop(interval=0.25):
+    """Measure how late a sleep wakes up: time the loop spent busy with something else"""
+    loop = asyncio.get_running_loop()
+    lag = LOOP_LAG.labels()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        delay = max(0.0, loop.time() - start - interval)
+        lag.set(delay)
+        LOOP_LAG_OBSERVED.observe(delay)
+
+async def handle_metrics_request(reader, writer):
+    """Minimal HTTP/1.0: GET /metrics, anything else is a 404"""
+    try:
+        request = await asyncio.wait_for(reader.readline(), 5.0)
+        # Headers are not needed, read past them
+        while True:
+            line = await asyncio.wait_for(reader.readline(), 5.0)
+            if line in (b"\r\n", b"\n", b""):
+                break
+        parts = request.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] in ("GET", "HEAD") and parts[1].split("?")[0] == "/metrics":
+            body = METRICS.render().encode()
+            status = "200 OK"
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body = b"Not found\n"
+            status = "404 Not Found"
+            content_type = "text/plain"
+        writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode())
+        if parts and parts[0] != "HEAD":
+            writer.write(body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics_server(host="127.0.0.1", port=9180):
+    """Serve /metrics and start the event loop lag monitor"""
+    server = await asyncio.start_server(handle_metrics_request, host, port)
+    asyncio.get_running_loop().create_task(monitor_event_loop())
+    return server
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Binary framing for the Pi <-> Arduino serial link
+
+Frame layout (negotiated with "PROTO:BIN1,<baud>" / "PROTO_OK:BIN1,<baud>"):
+
+    SYNC (0xA5) | TYPE | fixed-width payload | CRC-8 (poly 0x07) over TYPE + payload
+
+Frame types:
+    LDR           Arduino -> Pi   4 x 10-bit readings packed into 5 bytes
+    SERVO_POS     Arduino -> Pi   4 x uint8 current servo positions
+    SERVO_TARGET  Arduino -> Pi   4 x uint8 target servo positions
+    SERVOS        Pi -> Arduino   4 x uint8 servo command
+
+The ASCII protocol ("LDR:512,487,523,498") stays the default until the
+handshake succeeds, so older sketches keep working. LineParser handles it.
+"""
+
+import struct
+
+PROTOCOL_VERSION = 1
+SYNC = 0xA5
+
+FRAME_LDR = 0x01
+FRAME_SERVO_POS = 0x02
+FRAME_SERVO_TARGET = 0x03
+FRAME_SERVOS = 0x11
+
+# Payload sizes by frame type
+PAYLOAD_SIZES = {
+    FRAME_LDR: 5,
+    FRAME_SERVO_POS: 4,
+    FRAME_SERVO_TARGET: 4,
+    FRAME_SERVOS: 4,
+}
+
+# SYNC + TYPE + CRC around the payload
+FRAME_OVERHEAD = 3
+
+SERVO_STRUCT = struct.Struct('<4B')
+LDR_STRUCT = struct.Struct('<IB')  # 40 packed bits: low 32 + high 8
+
+def _crc8_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+CRC8_TABLE = _crc8_table()
+
+def crc8(data, start=0, end=None):
+    """CRC-8 (poly 0x07, init 0) over data[start:end] without copying"""
+    crc = 0
+    table = CRC8_TABLE
+    for i in range(start, len(data) if end is None else end):
+        crc = table[crc ^ data[i]]
+    return crc
+
+def encode_frame(frame_type, payload):
+    """Wrap a payload in SYNC/TYPE/CRC"""
+    frame = bytearray((SYNC, frame_type))
+    frame += payload
+    frame.append(crc8(frame, 1))
+    return bytes(frame)
+
+def encode_servos(front, right, back, left, frame_type=FRAME_SERVOS):
+    """Encode four servo positions (0-180)"""
+    return encode_frame(frame_type, SERVO_STRUCT.pack(front, right, back, left))
+
+def encode_ldr(front, right, back, left):
+    """Encode four 10-bit LDR readings packed into 5 bytes"""
+    packed = (front & 0x3FF) | (right & 0x3FF) << 10 | (back & 0x3FF) << 20 | (left & 0x3FF) << 30
+    return encode_frame(FRAME_LDR, LDR_STRUCT.pack(packed & 0xFFFFFFFF, packed >> 32))
+
+class FrameDecoder:
+    """Incremental frame parser working in place on a reusable read buffer"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.frames = 0
+        self.crc_errors = 0
+        self.skipped_bytes = 0
+
+    def feed(self, data):
+        """Append received bytes and return a list of (frame_type, values) for complete frames"""
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        pos = 0
+        end = len(buffer)
+
+        while True:
+            start = buffer.find(SYNC, pos)
+            if start < 0:
+                self.skipped_bytes += end - pos
+                pos = end
+                break
+            self.skipped_bytes += start - pos
+            pos = start
+
+            if end - pos < 2:
+                break
+            frame_type = buffer[pos + 1]
+            size = PAYLOAD_SIZES.get(frame_type)
+            if size is None:
+                # Not a frame start, resynchronise on the next SYNC byte
+                pos += 1
+                self.skipped_bytes += 1
+                continue
+            if end - pos < size + FRAME_OVERHEAD:
+                break
+
+            crc_at = pos + 2 + size
+            if crc8(buffer, pos + 1, crc_at) != buffer[crc_at]:
+                pos += 1
+                self.skipped_bytes += 1
+                self.crc_errors += 1
+                continue
+
+            if frame_type == FRAME_LDR:
+                low, high = LDR_STRUCT.unpack_from(buffer, pos + 2)
+                packed = low | high << 32
+                values = (packed & 0x3FF, packed >> 10 & 0x3FF, packed >> 20 & 0x3FF, packed >> 30 & 0x3FF)
+            else:
+                values = SERVO_STRUCT.unpack_from(buffer, pos + 2)
+            frames.append((frame_type, values))
+            self.frames += 1
+            pos = crc_at + 1
+
+        # Drop consumed bytes, keeping any partial frame for the next read
+        del buffer[:pos]
+        return frames
+
+    def stats(self):
+        """Frame and error counters for diagnostics"""
+        return {
+            "frames": self.frames,
+            "crcErrors": self.crc_errors,
+            "skippedBytes": self.skipped_bytes
+        }
+
+class LineParser:
+    """Incremental ASCII line splitter that dispatches on prefix without decoding"""
+
+    def __init__(self, handlers, fallback=None, max_line=512):
+        # handlers: {b"PREFIX:": callback(buffer, start, end)}; callbacks see the bytes
+        # after the prefix as buffer[start:end] and return True to discard the rest of the chunk
+        self.handlers = list(handlers.items())
+        self.fallback = fallback
+        self.max_line = max_line
+        self.buffer = bytearray()
+        self.lines = 0
+        self.overflows = 0
+
+    def feed(self, data):
+        """Append received bytes and dispatch every complete line"""
+        buffer = self.buffer
+        buffer += data
+        start = 0
+
+        while True:
+            newline = buffer.find(b'\n', start)
+            if newline < 0:
+                break
+            end = newline - 1 if newline > start and buffer[newline - 1] == 13 else newline
+
+            if end > start:
+                self.lines += 1
+                for prefix, callback in self.handlers:
+                    if buffer.startswith(prefix, start, end):
+                        stop = callback(buffer, start + len(prefix), end)
+                        break
+                else:
+                    stop = self.fallback(buffer, start, end) if self.fallback else False
+                if stop:
+                    buffer.clear()
+                    return
+            start = newline + 1
+
+        # Keep the partial trailing line for the next read
+        del buffer[:start]
+        if len(buffer) > self.max_line:
+            self.overflows += 1
+            buffer.clear()
+
+def parse_ints(buffer, start, end):
+    """Parse comma-separated integers from buffer[start:end] without decoding to str"""
+    return [int(value) for value in buffer[start:end].split(b',')]
@@ -1,31 +1,1018 @@
 #!/usr/bin/env python3
+import argparse
 import asyncio
+import glob
+import logging
 import websockets
 import json
-import serial
+import os
 import time
-import threading
 import math
-from datetime import datetime
-from astral import LocationInfo
-from astral.sun import sun
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pergola_protocol import (PROTOCOL_VERSION, FRAME_LDR, FRAME_SERVO_POS, FRAME_SERVOS, FRAME_OVERHEAD,
+                              PAYLOAD_SIZES, FrameDecoder, LineParser, encode_servos, parse_ints)
+from pergola_metrics import METRICS, start_metrics_server, timed
+from pergola_logging import add_arguments as add_logging_arguments, setup_from_args, stop_logging
+
+# Startup is timed from here; serial, astral and pytz are imported on first use
+PROCESS_START = time.perf_counter()
+
+# First line of the sketch after reset (arduino_pergola_maquette.ino setup())
+READY_BANNER = b"Pergola Maquette Ready"
+DEFAULT_PORTS = ['/dev/ttyACM0', '/dev/ttyACM1', '/dev/ttyUSB0', '/dev/ttyUSB1']
+
+# Per-subsystem loggers (pergola_logging): levels are set per subsystem with --log-levels
+log = logging.getLogger("pergola.server")
+serial_log = logging.getLogger("pergola.serial")
+raw_log = logging.getLogger("pergola.serial.raw")
+sensor_log = logging.getLogger("pergola.sensors")
+tracking_log = logging.getLogger("pergola.tracking")
+night_log = logging.getLogger("pergola.night")
+client_log = logging.getLogger("pergola.clients")
+
+# Hot-path latency histograms, served by --metrics-port (stages include the stages they call)
+STAGE_SECONDS = METRICS.histogram("pergola_stage_seconds", "Time per call in each hot-path stage", ("stage",))
+COMMAND_SECONDS = METRICS.histogram("pergola_command_seconds", "Time to process one WebSocket command", ("cmd",))
+BROADCAST_SECONDS = STAGE_SECONDS.labels("broadcast_status")
+BROADCAST_CLIENT_SECONDS = METRICS.histogram(
+    "pergola_broadcast_client_seconds", "Time to build and queue one client's frame in a broadcast").labels()
+# Commands get their own label, anything else is counted as "other"
+COMMANDS = frozenset(["MODE", "SET_ANGLES", "GET_STATUS", "GET_STATE", "GET_MODE", "GET_DASHBOARD_DATA",
+                      "SUBSCRIBE", "RESYNC", "HISTORY", "GET_DIAGNOSTICS"])
+# Control modes, as allowed by pergola_logs.mode
+MODES = ("auto", "manual", "off")
+
+async def serve_metrics(address, clients):
+    """Serve /metrics and watch event loop lag alongside the WebSocket server"""
+    await start_metrics_server(*address)
+    METRICS.gauge("pergola_clients", "Connected WebSocket clients").labels().track(lambda: len(clients))
+    log.info(f"📈 Metrics at http://{address[0]}:{address[1]}/metrics")
+
+def startup_ms():
+    """Milliseconds since the server module was loaded"""
+    return round((time.perf_counter() - PROCESS_START) * 1000, 1)
+
+async def probe_port(port, baudrate, timeout=5.0):
+    """Open a port and wait for the sketch to announce itself
+
+    Returns (serial, pending_bytes) once the ready banner (or, from a board that
+    did not reset on open, an LDR line) arrives, or None on error or timeout.
+    """
+    import serial
+    loop = asyncio.get_running_loop()
+    try:
+        # Opening toggles DTR and can block briefly, keep it off the loop
+        conn = await loop.run_in_executor(None, lambda: serial.Serial(port, baudrate, timeout=0))
+    except Exception:
+        return None
+    
+    received = bytearray()
+    ready = loop.create_future()
+    
+    def on_readable():
+        try:
+            received.extend(os.read(fd, 4096))
+        except BlockingIOError:
+            return
+        except OSError as e:
+            if not ready.done():
+                ready.set_exception(e)
+            return
+        if ready.done():
+            return
+        banner = received.find(READY_BANNER)
+        if banner >= 0:
+            # Keep whatever followed the banner line for the line parser
+            newline = received.find(b'\n', banner)
+            ready.set_result(len(received) if newline < 0 else newline + 1)
+        elif received.find(b"LDR:") >= 0:
+            ready.set_result(received.rfind(b"LDR:"))
+    
+    fd = conn.fileno()
+    loop.add_reader(fd, on_readable)
+    try:
+        consumed = await asyncio.wait_for(ready, timeout)
+    except (asyncio.TimeoutError, OSError):
+        consumed = None
+    except asyncio.CancelledError:
+        loop.remove_reader(fd)
+        conn.close()
+        raise
+    loop.remove_reader(fd)
+    
+    if consumed is None:
+        conn.close()
+        return None
+    return conn, bytes(received[consumed:])
+
+class SerialWriter:
+    """Single owner of Arduino writes, fed by a bounded command queue"""
+    
+    def __init__(self, max_queue=32):
+        self.port = None
+        self.max_queue = max_queue
+        self.queue = deque()
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.on_error = None  # Called with the exception when a write fails
+        # One worker thread so blocking writes never stall the event loop or interleave
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="serial-writer")
+        
+        # Stats
+        self.sent = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.last_latency_ms = 0.0
+        self.avg_latency_ms = 0.0
+        self.max_latency_ms = 0.0
+    
+    def start(self, port):
+        """Start draining the queue to the given serial port"""
+        self.port = port
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+    
+    def stop(self):
+        """Stop the writer task (pending commands are discarded)"""
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        self.queue.clear()
+    
+    def send(self, command):
+        """Queue an ASCII command line and return immediately"""
+        self.send_raw(f"{command}\n".encode())
+    
+    def send_raw(self, data):
+        """Queue raw bytes and return immediately; the oldest command is dropped when full"""
+        if len(self.queue) >= self.max_queue:
+            self.queue.popleft()
+            self.dropped += 1
+        self.queue.append((data, time.perf_counter()))
+        self.max_depth = max(self.max_depth, len(self.queue))
+        self.wakeup.set()
+    
+    async def run(self):
+        """Write queued commands one at a time, in order"""
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.queue:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            
+            data, queued_at = self.queue.popleft()
+            try:
+                await loop.run_in_executor(self.executor, self.port.write, data)
+            except Exception as e:
+                self.errors += 1
+                serial_log.error(f"❌ Arduino send error: {e}")
+                if self.on_error:
+                    self.on_error(e)
+                continue
+            
+            # Latency from enqueue to bytes handed to the port
+            latency_ms = (time.perf_counter() - queued_at) * 1000
+            self.sent += 1
+            self.last_latency_ms = latency_ms
+            self.avg_latency_ms += (latency_ms - self.avg_latency_ms) * 0.1
+            self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+    
+    def stats(self):
+        """Queue depth and write latency for diagnostics"""
+        return {
+            "queueDepth": len(self.queue),
+            "maxQueueDepth": self.max_depth,
+            "queueLimit": self.max_queue,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "lastLatencyMs": round(self.last_latency_ms, 2),
+            "avgLatencyMs": round(self.avg_latency_ms, 2),
+            "maxLatencyMs": round(self.max_latency_ms, 2)
+        }
+
+class AngleScheduler:
+    """Latest-wins scheduler for joystick angle bursts: at most one servo command per tick"""
+    
+    # Bytes of one SERVOS command: ASCII line, binary frame
+    ASCII_COMMAND_BYTES = 40
+    BINARY_COMMAND_BYTES = FRAME_OVERHEAD + PAYLOAD_SIZES[FRAME_SERVOS]
+    # Shortest interval the sketch takes commands at. An ASCII-only sketch reads serial once per
+    # 500 ms loop into a 64-byte RX buffer; the binary sketch drains it while it waits, and a
+    # servo can't follow more than one target per 20 ms PWM frame anyway.
+    ASCII_MIN_INTERVAL = 0.5
+    BINARY_MIN_INTERVAL = 0.02
+    
+    def __init__(self, server, tick=None, recheck_interval=1.0):
+        self.server = server
+        self.fixed_tick = tick
+        self.set_link(server.baudrate)
+        self.recheck_interval = recheck_interval  # Seconds idle between servo position checks
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.servo_pending = False
+        
+        # Stats
+        self.requested = 0
+        self.emitted = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.rechecks = 0
+    
+    def set_link(self, baudrate, binary=False):
+        """Pace commands to the slower of the wire (10 bits per byte) and the sketch"""
+        if self.fixed_tick is not None:
+            self.tick = self.fixed_tick
+        elif binary:
+            self.tick = max(self.BINARY_COMMAND_BYTES * 10 / baudrate, self.BINARY_MIN_INTERVAL)
+        else:
+            self.tick = max(self.ASCII_COMMAND_BYTES * 10 / baudrate, self.ASCII_MIN_INTERVAL)
+    
+    def start(self):
+        """Start the scheduler task"""
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+    
+    def stop(self):
+        """Stop the scheduler task"""
+        if self.task:
+            self.task.cancel()
+            self.task = None
+    
+    def request(self):
+        """Mark the server's current manual angles as the target to send on the next tick"""
+        self.requested += 1
+        if self.servo_pending:
+            self.coalesced += 1
+        self.servo_pending = True
+        self.wakeup.set()
+    
+    def drop(self):
+        """Count a request that was rejected (not in manual mode, or night mode active)"""
+        self.dropped += 1
+    
+    async def run(self):
+        """Emit the latest target once per tick; re-check the servos while idle"""
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.recheck_interval)
+            except asyncio.TimeoutError:
+                self.recheck()
+                continue
+            self.wakeup.clear()
+            
+            if self.servo_pending:
+                self.servo_pending = False
+                self.server.update_manual_control()
+                self.emitted += 1
+            
+            # Pace the serial link: nothing else goes out until the next tick
+            await asyncio.sleep(self.tick)
+            if self.servo_pending:
+                self.wakeup.set()
+    
+    def recheck(self):
+        """Re-send the manual target when the servos settled somewhere else (a command lost on the link)"""
+        cache = self.server.servo_cache
+        if self.server.current_mode == "manual" and cache.diverged(cache.clock()):
+            self.rechecks += 1
+            self.server.update_manual_control()
+    
+    def stats(self):
+        """Request, emit and coalescing counters for diagnostics"""
+        return {
+            "tickMs": round(self.tick * 1000, 1),
+            "requested": self.requested,
+            "emitted": self.emitted,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "rechecks": self.rechecks
+        }
+
+class ServoCommandCache:
+    """Last commanded servo vector: skips duplicates and moves inside the deadband,
+    and re-sends when the reported SERVO_POS stays away from it"""
+    
+    def __init__(self, deadband=1, settle_time=3.0, clock=time.monotonic):
+        self.deadband = deadband  # Degrees per servo a new target may differ and still be skipped
+        self.settle_time = settle_time  # Seconds the Arduino gets to reach a target before we re-send
+        self.clock = clock
+        self.commanded = None
+        self.commanded_at = 0.0
+        self.reported = None
+        self.reported_at = 0.0
+        
+        # Stats
+        self.sent = 0
+        self.duplicates = 0
+        self.within_deadband = 0
+        self.resent = 0
+    
+    def reset(self):
+        """Forget both vectors (the Arduino reset or was replaced)"""
+        self.commanded = None
+        self.reported = None
+    
+    def report(self, positions):
+        """Record a SERVO_POS report"""
+        self.reported = tuple(positions)
+        self.reported_at = self.clock()
+    
+    def should_send(self, target, force=False):
+        """Decide whether target needs to go out; records it as commanded if so"""
+        now = self.clock()
+        if not force and self.commanded is not None:
+            change = max(abs(a - b) for a, b in zip(target, self.commanded))
+            if change <= self.deadband and not self.diverged(now):
+                if change:
+                    self.within_deadband += 1
+                else:
+                    self.duplicates += 1
+                return False
+            if change <= self.deadband:
+                self.resent += 1
+        self.commanded = target
+        self.commanded_at = now
+        self.sent += 1
+        return True
+    
+    def diverged(self, now):
+        """Arduino settled (no SERVO_POS for settle_time) away from the commanded vector"""
+        if self.reported is None or now - max(self.reported_at, self.commanded_at) < self.settle_time:
+            return False
+        return max(abs(a - b) for a, b in zip(self.reported, self.commanded)) > self.deadband
+    
+    def stats(self):
+        """Command counters for diagnostics"""
+        return {
+            "sent": self.sent,
+            "duplicates": self.duplicates,
+            "withinDeadband": self.within_deadband,
+            "suppressed": self.duplicates + self.within_deadband,
+            "resent": self.resent,
+            "deadband": self.deadband,
+            "commanded": self.commanded,
+            "reported": self.reported
+        }
+
+class ClientSession:
+    """Bounded outbound queue and sender task for one WebSocket client"""
+    
+    def __init__(self, websocket, max_queue=16, max_lag=10.0):
+        self.websocket = websocket
+        self.address = getattr(websocket, 'remote_address', 'unknown')
+        self.max_queue = max_queue
+        self.max_lag = max_lag  # Seconds the oldest pending frame may wait before eviction
+        self.queue = deque()  # (message, is_telemetry, queued_at)
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.sending_since = None
+        self.evicted = False
+        
+        # Delta telemetry state (used once the client opts in): device id -> [seq, last status]
+        self.delta_state = {}
+        self.delta = False
+        
+        # Stats
+        self.sent = 0
+        self.dropped = 0
+        self.max_depth = 0
+    
+    def start(self):
+        """Start the sender task"""
+        self.task = asyncio.get_running_loop().create_task(self.run())
+    
+    def stop(self):
+        """Stop the sender task (pending frames are discarded)"""
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        self.queue.clear()
+    
+    def lag(self):
+        """Seconds the oldest undelivered frame has been waiting"""
+        oldest = self.sending_since
+        if oldest is None and self.queue:
+            oldest = self.queue[0][2]
+        return 0.0 if oldest is None else time.monotonic() - oldest
+    
+    def send_telemetry(self, message):
+        """Queue a telemetry frame, dropping the oldest telemetry when full; False if evicted"""
+        if self.evicted:
+            return False
+        if self.lag() > self.max_lag:
+            self.evict()
+            return False
+        
+        if len(self.queue) >= self.max_queue:
+            for i, item in enumerate(self.queue):
+                if item[1]:
+                    del self.queue[i]
+                    break
+            else:
+                # Only replies pending: drop the new telemetry instead
+                self.dropped += 1
+                return True
+            self.dropped += 1
+        
+        self.enqueue(message, True)
+        return True
+    
+    def send_reply(self, message):
+        """Queue a command reply (never dropped)"""
+        if not self.evicted:
+            self.enqueue(message, False)
+    
+    def enqueue(self, message, telemetry):
+        """Append a frame and wake the sender"""
+        self.queue.append((message, telemetry, time.monotonic()))
+        self.max_depth = max(self.max_depth, len(self.queue))
+        self.wakeup.set()
+    
+    def evict(self):
+        """Disconnect a client that stopped keeping up"""
+        self.evicted = True
+        client_log.warning(f"🐢 Evicting slow client {self.address} (lag {self.lag():.1f}s, {len(self.queue)} frames pending)")
+        self.stop()
+        asyncio.get_running_loop().create_task(self.websocket.close(code=1013, reason="Client too slow"))
+    
+    async def run(self):
+        """Deliver queued frames in order"""
+        try:
+            while True:
+                if not self.queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                
+                message, _, queued_at = self.queue.popleft()
+                self.sending_since = queued_at
+                await self.websocket.send(message)
+                self.sending_since = None
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Connection closed: handle_client cleans up the session
+            self.queue.clear()
+    
+    def stats(self):
+        """Queue depth and drop counters for diagnostics"""
+        return {
+            "address": str(self.address),
+            "queueDepth": len(self.queue),
+            "maxQueueDepth": self.max_depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "lagMs": round(self.lag() * 1000, 1),
+            "delta": self.delta
+        }
+
+class LdrFilter:
+    """Streaming LDR conditioning (outlier rejection, median-of-N, EMA) with constant work per sample"""
+    
+    def __init__(self, channels=4, median_window=3, alpha=0.3, outlier_threshold=150,
+                 outlier_limit=3, min_change=2):
+        self.median_window = median_window  # 1 disables the median stage
+        self.alpha = alpha  # Weight of the newest sample; 1.0 disables smoothing
+        self.outlier_threshold = outlier_threshold  # Counts away from the EMA; None disables rejection
+        self.outlier_limit = outlier_limit  # Consecutive outliers accepted as a real step change
+        self.min_change = min_change  # Output only moves by at least this many counts
+        self.windows = [deque(maxlen=median_window) for _ in range(channels)]
+        self.ema = [None] * channels
+        self.outlier_runs = [0] * channels
+        self.raw = [0] * channels
+        self.output = [0] * channels
+        
+        # Stats
+        self.samples = 0
+        self.rejected = 0
+        self.changes = 0
+        self.suppressed = 0
+    
+    def update(self, raw):
+        """Filter one sample; returns a new list when the output changed, else the previous one"""
+        self.samples += 1
+        raw_changed = raw != self.raw
+        self.raw = raw
+        output = self.output
+        changed = None
+        
+        for i, value in enumerate(raw):
+            ema = self.ema[i]
+            if ema is None:
+                ema = float(value)
+            elif self.outlier_threshold is not None and abs(value - ema) > self.outlier_threshold:
+                self.outlier_runs[i] += 1
+                if self.outlier_runs[i] < self.outlier_limit:
+                    self.rejected += 1
+                    continue
+                # Still there after several samples: a real step (cloud, lamp), restart from it
+                self.windows[i].clear()
+                ema = float(value)
+            self.outlier_runs[i] = 0
+            
+            window = self.windows[i]
+            window.append(value)
+            median = sorted(window)[len(window) // 2] if len(window) > 1 else value
+            ema += self.alpha * (median - ema)
+            self.ema[i] = ema
+            
+            if abs(ema - output[i]) >= self.min_change:
+                if changed is None:
+                    changed = list(output)
+                changed[i] = int(round(ema))
+        
+        if changed is not None:
+            self.output = changed
+            self.changes += 1
+        elif raw_changed:
+            # Raw noise that no longer reaches the consumers
+            self.suppressed += 1
+        return self.output
+    
+    def stats(self):
+        """Raw vs filtered values and suppression counters for diagnostics"""
+        return {
+            "raw": self.raw,
+            "filtered": self.output,
+            "samples": self.samples,
+            "rejected": self.rejected,
+            "changes": self.changes,
+            "suppressed": self.suppressed,
+            "config": {
+                "medianWindow": self.median_window,
+                "alpha": self.alpha,
+                "outlierThreshold": self.outlier_threshold,
+                "outlierLimit": self.outlier_limit,
+                "minChange": self.min_change
+            }
+        }
+
+class HistoryRing:
+    """Preallocated ring of timestamped fixed-width float rows; the oldest row is overwritten first"""
+    
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self.width = width
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array('f', bytes(4 * capacity * width))
+        self.head = 0  # Next slot to write
+        self.count = 0
+    
+    def append(self, timestamp, row):
+        """Store one row (a float array of self.width values)"""
+        slot = self.head
+        self.times[slot] = timestamp
+        self.values[slot * self.width:(slot + 1) * self.width] = row
+        self.head = (slot + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+    
+    def slot(self, index):
+        """Physical slot of logical index (0 = oldest)"""
+        return (self.head - self.count + index) % self.capacity
+    
+    def bisect(self, timestamp):
+        """Logical index of the first row at or after timestamp"""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[self.slot(mid)] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+class TelemetryHistory:
+    """Fixed-memory telemetry history at raw, 10 s and 1 min resolution"""
+    
+    FIELDS = ("lux", "horizontal", "vertical",
+              "ldrFront", "ldrRight", "ldrBack", "ldrLeft",
+              "servoFront", "servoRight", "servoBack", "servoLeft")
+    
+    # Resolution -> (bucket seconds, rows kept): 1 h of 500 ms samples, 24 h, 7 days
+    TIERS = {"raw": (0, 7200), "10s": (10, 8640), "1m": (60, 10080)}
+    SAMPLE_PERIOD = 0.5  # The sketch streams LDR readings every 500 ms
+    
+    def __init__(self, tiers=None, max_points=2000, raw_window=None):
+        self.tiers = dict(tiers or self.TIERS)
+        if raw_window:
+            # Raw samples are only held for this many seconds; rollups cover the long term
+            self.tiers["raw"] = (0, max(1, int(raw_window / self.SAMPLE_PERIOD)))
+        self.max_points = max_points  # Rows per reply; longer ranges are decimated
+        width = len(self.FIELDS)
+        self.rings = {name: HistoryRing(capacity, width) for name, (_, capacity) in self.tiers.items()}
+        # Downsampled tiers average the samples of the bucket being filled
+        self.buckets = {name: [None, 0, array('d', bytes(8 * width))]
+                        for name, (seconds, _) in self.tiers.items() if seconds}
+        self.samples = 0
+    
+    def record(self, timestamp, row):
+        """Add one sample (values in FIELDS order) to every tier"""
+        row = array('f', row)
+        self.samples += 1
+        for name, (seconds, _) in self.tiers.items():
+            if not seconds:
+                self.rings[name].append(timestamp, row)
+                continue
+            bucket = self.buckets[name]
+            start = timestamp - timestamp % seconds
+            if bucket[0] != start:
+                if bucket[1]:
+                    self.rings[name].append(bucket[0], self.bucket_mean(bucket))
+                bucket[0] = start
+                bucket[1] = 0
+                sums = bucket[2]
+                for i in range(len(sums)):
+                    sums[i] = 0.0
+            bucket[1] += 1
+            sums = bucket[2]
+            for i, value in enumerate(row):
+                sums[i] += value
+    
+    @staticmethod
+    def bucket_mean(bucket):
+        """Mean row of a bucket accumulator [start, count, sums]"""
+        count = bucket[1]
+        return array('f', [total / count for total in bucket[2]])
+    
+    def pick_resolution(self, since, until):
+        """Finest resolution that covers the range within max_points rows"""
+        for name, ring in self.rings.items():
+            # Finer tiers hold less time; skip one that has already overwritten the start
+            complete = ring.count < ring.capacity or ring.times[ring.slot(0)] <= since
+            if complete and ring.bisect(until + 1e-6) - ring.bisect(since) <= self.max_points:
+                return name
+        return next(reversed(self.rings))
+    
+    def query(self, since, until, resolution=None):
+        """Rows between since and until as compact columns, downsampled to fit max_points"""
+        if resolution not in self.rings:
+            resolution = self.pick_resolution(since, until)
+        ring = self.rings[resolution]
+        lo = ring.bisect(since)
+        hi = ring.bisect(until + 1e-6)
+        step = max(1, -(-(hi - lo) // self.max_points))
+        
+        width = ring.width
+        times = []
+        columns = [[] for _ in self.FIELDS]
+        for index in range(lo, hi, step):
+            slot = ring.slot(index)
+            times.append(round(ring.times[slot], 1))
+            base = slot * width
+            for column, value in zip(columns, ring.values[base:base + width]):
+                column.append(round(value, 1))
+        
+        # Include the bucket still being filled so the newest point is current
+        bucket = self.buckets.get(resolution)
+        if bucket and bucket[1] and since <= bucket[0] <= until:
+            times.append(round(bucket[0], 1))
+            for column, value in zip(columns, self.bucket_mean(bucket)):
+                column.append(round(value, 1))
+        
+        return {
+            "resolution": resolution,
+            "since": since,
+            "until": until,
+            "t": times,
+            "series": dict(zip(self.FIELDS, columns))
+        }
+    
+    def stats(self):
+        """Fill level per tier for diagnostics"""
+        return {
+            "samples": self.samples,
+            "tiers": {name: {"rows": ring.count, "capacity": ring.capacity}
+                      for name, ring in self.rings.items()}
+        }
+
+class SolarEphemeris:
+    """Sun path for one local day, precomputed at a fixed resolution and interpolated on lookup"""
+    
+    def __init__(self, location, resolution=10):
+        self.location = location
+        self.resolution = resolution  # Seconds between samples
+        self.day_start = 0.0
+        self.day_end = 0.0
+        self.elevations = array('d')
+        self.azimuths = array('d')
+        self.building = None
+    
+    def set_location(self, location):
+        """Change location and invalidate the current table"""
+        self.location = location
+        self.day_start = self.day_end = 0.0
+    
+    @staticmethod
+    def compute_day(location, timestamp, resolution):
+        """Compute the sun path for the local day containing timestamp (blocking)"""
+        from astral.sun import elevation, azimuth
+        import pytz
+        
+        tz = pytz.timezone(location.timezone)
+        day = datetime.fromtimestamp(timestamp, tz).date()
+        # Localize midnights so DST days get their real 23/25 hour length
+        start = tz.localize(datetime.combine(day, datetime.min.time())).timestamp()
+        end = tz.localize(datetime.combine(day + timedelta(days=1), datetime.min.time())).timestamp()
+        
+        observer = location.observer
+        elevations = array('d')
+        azimuths = array('d')
+        steps = int(math.ceil((end - start) / resolution))
+        for i in range(steps + 1):
+            when = datetime.fromtimestamp(start + i * resolution, timezone.utc)
+            elevations.append(elevation(observer, when))
+            azimuths.append(azimuth(observer, when))
+        
+        return location, start, end, elevations, azimuths
+    
+    def install(self, table):
+        """Swap in a computed table (ignored if the location changed meanwhile)"""
+        location, start, end, elevations, azimuths = table
+        if location is not self.location:
+            return
+        self.elevations = elevations
+        self.azimuths = azimuths
+        self.day_start = start
+        self.day_end = end
+        tracking_log.info(f"☀️ Sun path cached for {self.location.name}: {len(elevations)} samples at {self.resolution}s")
+    
+    def refresh(self, timestamp=None):
+        """Build the table for the current day in a worker thread, without blocking the loop"""
+        if self.location is None or (self.building and not self.building.done()):
+            return
+        timestamp = time.time() if timestamp is None else timestamp
+        loop = asyncio.get_running_loop()
+        self.building = loop.run_in_executor(
+            None, self.compute_day, self.location, timestamp, self.resolution)
+        self.building.add_done_callback(self.on_built)
+    
+    def on_built(self, future):
+        """Install a finished table"""
+        try:
+            self.install(future.result())
+        except Exception as e:
+            tracking_log.error(f"❌ Sun path precomputation error: {e}")
+    
+    def position(self, timestamp):
+        """Interpolated (elevation, azimuth) at timestamp, or None if the table doesn't cover it"""
+        if not (self.day_start <= timestamp < self.day_end):
+            return None
+        
+        offset = (timestamp - self.day_start) / self.resolution
+        i = int(offset)
+        frac = offset - i
+        elevations = self.elevations
+        azimuths = self.azimuths
+        
+        sun_elevation = elevations[i] + (elevations[i + 1] - elevations[i]) * frac
+        # Azimuth wraps at 360°, interpolate along the short way round
+        delta = azimuths[i + 1] - azimuths[i]
+        if delta > 180:
+            delta -= 360
+        elif delta < -180:
+            delta += 360
+        sun_azimuth = (azimuths[i] + delta * frac) % 360
+        
+        return sun_elevation, sun_azimuth
+
+def sun_to_panel_angles(sun_elevation, sun_azimuth, limit=40):
+    """Convert sun elevation/azimuth to panel (horizontal, vertical) angles"""
+    # Simplified conversion for maquette
+    horizontal = (sun_azimuth - 180) % 360
+    if horizontal > 180:
+        horizontal -= 360
+    horizontal = max(-limit, min(limit, horizontal / 4.5))  # Scale to ±40°
+    
+    vertical = max(-limit, min(limit, sun_elevation - 45))  # Offset and scale
+    return horizontal, vertical
+
+def angles_to_servo_positions(horizontal, vertical):
+    """Convert horizontal/vertical panel angles to [front, right, back, left] servo positions"""
+    # Panel center stays fixed, edges move to create tilt
+    # horizontal: -40° (tilt left) to +40° (tilt right)
+    # vertical: -40° (tilt back) to +40° (tilt front)
+    
+    # Base position (flat)
+    base_pos = 90
+    
+    # Scale angles: 40° input angle = 90° servo movement from base
+    # This gives full servo range utilization
+    servo_scale = 90.0 / 40.0  # 2.25 degrees servo per degree input
+    
+    # Calculate servo positions for each side
+    # Front servo controls front edge height
+    servo_front = base_pos - (vertical * servo_scale)  # Front edge: lower for backward tilt, higher for forward tilt
+    
+    # Right servo controls right edge height  
+    servo_right = base_pos + (horizontal * servo_scale)  # Right edge: higher for rightward tilt, lower for leftward tilt
+    
+    # Back servo controls back edge height
+    servo_back = base_pos + (vertical * servo_scale)  # Back edge: higher for backward tilt, lower for forward tilt
+    
+    # Left servo controls left edge height
+    servo_left = base_pos - (horizontal * servo_scale)  # Left edge: higher for leftward tilt, lower for rightward tilt
+    
+    # Constrain to servo limits
+    servo_front = max(0, min(180, int(servo_front)))
+    servo_right = max(0, min(180, int(servo_right)))
+    servo_back = max(0, min(180, int(servo_back)))
+    servo_left = max(0, min(180, int(servo_left)))
+    
+    return servo_front, servo_right, servo_back, servo_left
+
+def compute_sun_path(timestamps, locations, limit=40):
+    """Vectorized sun path and panel angles for many timestamps and sites.
+    
+    timestamps: array of Unix timestamps (seconds) or numpy datetime64 values
+    locations:  one LocationInfo or a sequence of them
+    limit:      panel angle limit in degrees (±)
+    
+    Returns a dict of NumPy arrays shaped (sites, times): elevation, azimuth,
+    horizontal, vertical, plus servos shaped (sites, times, 4). Results match
+    astral's elevation()/azimuth() and the scalar tracking path.
+    """
+    import numpy as np
+    
+    if not isinstance(locations, (list, tuple)):
+        locations = [locations]
+    
+    ts = np.asarray(timestamps)
+    if np.issubdtype(ts.dtype, np.datetime64):
+        ts = ts.astype('datetime64[s]').astype(np.int64)
+    # astral works to whole seconds
+    ts = np.floor(ts.astype(np.float64))
+    
+    # Julian century (UTC) and time of day in minutes
+    t = (ts / 86400.0 + 2440587.5 - 2451545.0) / 36525.0
+    day_minutes = (ts % 86400.0) / 60.0
+    
+    # NOAA solar position terms (same formulas as astral.sun)
+    l0 = (280.46646 + t * (36000.76983 + 0.0003032 * t)) % 360.0
+    m = 357.52911 + t * (35999.05029 - 0.0001537 * t)
+    e = 0.016708634 - t * (0.000042037 + 0.0000001267 * t)
+    mrad = np.radians(m)
+    c = (np.sin(mrad) * (1.914602 - t * (0.004817 + 0.000014 * t))
+         + np.sin(2 * mrad) * (0.019993 - 0.000101 * t)
+         + np.sin(3 * mrad) * 0.000289)
+    omega = np.radians(125.04 - 1934.136 * t)
+    apparent_long = np.radians(l0 + c - 0.00569 - 0.00478 * np.sin(omega))
+    seconds = 21.448 - t * (46.815 + t * (0.00059 - t * 0.001813))
+    obliquity = np.radians(23.0 + (26.0 + seconds / 60.0) / 60.0 + 0.00256 * np.cos(omega))
+    declination = np.arcsin(np.sin(obliquity) * np.sin(apparent_long))
+    
+    y = np.tan(obliquity / 2.0) ** 2
+    l0rad = np.radians(l0)
+    sinm = np.sin(mrad)
+    eqtime = np.degrees(
+        y * np.sin(2.0 * l0rad)
+        - 2.0 * e * sinm
+        + 4.0 * e * y * sinm * np.cos(2.0 * l0rad)
+        - 0.5 * y * y * np.sin(4.0 * l0rad)
+        - 1.25 * e * e * np.sin(2.0 * mrad)
+    ) * 4.0
+    
+    sd = np.sin(declination)
+    cd = np.cos(declination)
+    
+    elevations = []
+    azimuths = []
+    for location in locations:
+        latitude = max(-89.8, min(89.8, location.latitude))
+        cl = math.cos(math.radians(latitude))
+        sl = math.sin(math.radians(latitude))
+        
+        true_solar_time = day_minutes + eqtime + 4.0 * location.longitude
+        true_solar_time = np.where(true_solar_time > 1440, true_solar_time - 1440, true_solar_time)
+        hourangle = true_solar_time / 4.0 - 180.0
+        hourangle = np.where(hourangle < -180, hourangle + 360.0, hourangle)
+        
+        csz = np.clip(cl * cd * np.cos(np.radians(hourangle)) + sl * sd, -1.0, 1.0)
+        zenith = np.degrees(np.arccos(csz))
+        
+        az_denom = cl * np.sin(np.radians(zenith))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            az_rad = np.clip(((sl * np.cos(np.radians(zenith))) - sd) / az_denom, -1.0, 1.0)
+        azimuth = 180.0 - np.degrees(np.arccos(az_rad))
+        azimuth = np.where(hourangle > 0.0, -azimuth, azimuth)
+        azimuth = np.where(np.abs(az_denom) > 0.001, azimuth, 180.0 if latitude > 0.0 else 0.0)
+        azimuth = np.where(azimuth < 0.0, azimuth + 360.0, azimuth)
+        
+        # Atmospheric refraction (astral.refraction_at_zenith)
+        elevation = 90.0 - zenith
+        with np.errstate(divide='ignore', invalid='ignore'):
+            te = np.tan(np.radians(elevation))
+            refraction = np.where(
+                elevation > 5.0,
+                58.1 / te - 0.07 / te ** 3 + 0.000086 / te ** 5,
+                np.where(
+                    elevation > -0.575,
+                    1735.0 + elevation * (-518.2 + elevation * (103.4 + elevation * (-12.79 + elevation * 0.711))),
+                    -20.774 / te))
+        refraction = np.where(elevation >= 85.0, 0.0, refraction / 3600.0)
+        
+        elevations.append(elevation + refraction)
+        azimuths.append(azimuth)
+    
+    elevation = np.array(elevations)
+    azimuth = np.array(azimuths)
+    
+    # Panel angles, as in sun_to_panel_angles()
+    horizontal = (azimuth - 180) % 360
+    horizontal = np.where(horizontal > 180, horizontal - 360, horizontal)
+    horizontal = np.clip(horizontal / 4.5, -limit, limit)
+    vertical = np.clip(elevation - 45, -limit, limit)
+    
+    # Servo vectors, as in angles_to_servo_positions()
+    servo_scale = 90.0 / 40.0
+    servos = np.stack([
+        90 - vertical * servo_scale,
+        90 + horizontal * servo_scale,
+        90 + vertical * servo_scale,
+        90 - horizontal * servo_scale
+    ], axis=-1)
+    servos = np.clip(np.trunc(servos), 0, 180).astype(np.int16)
+    
+    return {
+        "elevation": elevation,
+        "azimuth": azimuth,
+        "horizontal": horizontal,
+        "vertical": vertical,
+        "servos": servos
+    }
 
 class PergolaServer:
-    def __init__(self):
+    def __init__(self, device_id=None, port=None, raw_window=3600):
+        # Fleet mode runs one PergolaServer per device; device_id tags its frames
+        self.device_id = device_id
+        self.port = port
+        self.port_pinned = port is not None  # Otherwise reconnects probe every default port
+        self.clock = time.time  # Timestamps and sun position; the simulator injects a virtual clock
         self.arduino = None
-        self.clients = set()
+        self.baudrate = 9600
+        self.serial_writer = SerialWriter()
+        self.serial_writer.on_error = lambda e: self.detach_arduino(f"write failed: {e}")
+        self.angle_scheduler = AngleScheduler(self)
+        self.clients = {}  # websocket -> ClientSession
+        self.client_queue_size = 16  # Outbound frames buffered per client
+        self.client_max_lag = 10.0  # Seconds before a slow client is evicted
+        self.clients_evicted = 0
         self.current_mode = "auto"  # auto, manual, off
         
         # Servo positions (0-180 degrees, 90 = flat)
         self.servo_positions = [90, 90, 90, 90]  # [front, right, back, left]
+        self.servo_cache = ServoCommandCache()
         
         # Manual control angles (-40 to +40 degrees)
         self.horizontal_angle = 0.0
         self.vertical_angle = 0.0
         
-        # LDR readings (4 sensors)
+        # LDR readings (4 sensors), filtered before anything else sees them
         self.ldr_readings = [0, 0, 0, 0]
         self.light_sensor_lux = 0
+        self.ldr_filter = LdrFilter()
+        
+        # Telemetry history served by the HISTORY command (raw samples kept for raw_window seconds)
+        self.history = TelemetryHistory(raw_window=raw_window)
+        
+        # Write-behind persistence (pergola_storage.LogWriter, set up by --db): mode and night
+        # mode changes go to pergola_logs, samples only as per-minute/per-hour rollups
+        self.log_writer = None
+        self.rollups = None
+        
+        # Serial input: one reusable read buffer, lines dispatched on prefix
+        self.read_chunk = bytearray(4096)
+        self.line_parser = LineParser({
+            b"LDR:": self.on_ldr_line,
+            b"SERVO_POS:": self.on_servo_pos_line,
+            b"PROTO_OK:": self.on_protocol_line
+        }, self.on_other_line)
+        
+        # Binary framing (negotiated at connect, ASCII lines are the fallback)
+        self.binary_mode = False
+        self.binary_baudrate = 115200
+        self.frame_decoder = FrameDecoder()
+        self.protocol_ack = None
+        
+        # Link supervision: reconnect with backoff when the port errors or goes quiet
+        self.link_state = "disconnected"  # connected, connecting, disconnected
+        self.link_timeout = 2.5  # Seconds without a valid sample (LDR samples arrive every 500 ms)
+        self.link_garbage_limit = 128  # Undecodable bytes in a row before a binary link counts as lost
+        self.reconnect_min_delay = 0.5
+        self.reconnect_max_delay = 30.0
+        self.link_lost = asyncio.Event()
+        self.last_rx = 0.0  # When the last valid sample arrived, not just any byte
+        self.rx_garbage = 0
+        self.link_losses = 0
+        self.link_reconnects = 0
+        self.last_servos = None  # Last commanded servo target, replayed after a reconnect
         
         # Night mode and auto-tracking
         self.night_mode_active = False
@@ -33,86 +1020,321 @@ class PergolaServer:
         self.previous_mode = "auto"  # Store mode before night mode
         self.previous_angles = [0.0, 0.0]  # Store manual angles before night mode
         
-        # Location for sun tracking (Beirut, Lebanon)
-        self.location = LocationInfo("Beirut", "Lebanon", "Asia/Beirut", 33.8938, 35.5018)
+        # Location for sun tracking (Beirut, Lebanon), created by load_location()
+        self.location_config = ("Beirut", "Lebanon", "Asia/Beirut", 33.8938, 35.5018)
+        self.location = None
+        
+        # Precomputed sun path (refreshed when the day or location changes)
+        self.sun_ephemeris = SolarEphemeris(None)
         
         # Sun tracking parameters
         self.ldr_threshold = 200  # Threshold for switching between LDR and astronomical tracking
         self.tracking_mode = "astronomical"  # "ldr" or "astronomical"
         
-    def connect_arduino(self):
-        """Connect to Arduino via serial"""
+        # Versioned status snapshot, serialized once per state change
+        self.state_version = 0
+        self.state_changed_at = self.clock()
+        self.status_doc_version = -1
+        self.status_doc = None
+        self.status_cache_version = -1
+        self.status_cache = None
+        
+        # Change-driven broadcasting: push on change, capped rate, heartbeat when idle
+        self.state_changed = asyncio.Event()
+        self.broadcast_max_rate = 10.0  # Pushes per second at most
+        self.heartbeat_interval = 10.0  # Seconds between pushes when nothing changes
+        self.broadcast_pushes = 0
+        self.broadcast_heartbeats = 0
+        self.broadcast_coalesced = 0
+        
+        # Startup milestones in ms since module load
+        self.startup = {"listeningMs": None, "arduinoReadyMs": None, "firstStatusMs": None}
+        
+        # Prometheus endpoint (host, port), set by --metrics-port
+        self.metrics_address = None
+    
+    async def connect_arduino(self, probe_timeout=5.0):
+        """Probe candidate ports in parallel; the first one to report ready is kept"""
         try:
-            ports = ['/dev/ttyACM0', '/dev/ttyACM1', '/dev/ttyUSB0', '/dev/ttyUSB1']
+            ports = [self.port] if self.port_pinned else DEFAULT_PORTS
+            probes = {asyncio.ensure_future(probe_port(port, self.baudrate, probe_timeout)): port
+                      for port in ports}
             
-            for port in ports:
-                try:
-                    self.arduino = serial.Serial(port, 9600, timeout=1)
-                    time.sleep(2)
-                    print(f"✅ Connected to Arduino on {port}")
-                    return True
-                except:
-                    continue
-                    
-            print("❌ Could not connect to Arduino")
-            return False
+            found = None
+            while probes and found is None:
+                done, _ = await asyncio.wait(probes, return_when=asyncio.FIRST_COMPLETED)
+                for probe in done:
+                    port = probes.pop(probe)
+                    result = probe.result()
+                    if result is None:
+                        continue
+                    if found is None:
+                        found = result
+                        self.port = port
+                    else:
+                        result[0].close()
+            # Still-waiting probes close their ports when cancelled
+            for probe in probes:
+                probe.cancel()
+            
+            if found is None:
+                serial_log.warning("❌ Could not connect to Arduino")
+                return None
+            serial_log.info(f"✅ Connected to Arduino on {self.port} ({startup_ms():.0f} ms after start)")
+            return found
         except Exception as e:
-            print(f"❌ Arduino connection error: {e}")
-            return False
+            serial_log.error(f"❌ Arduino connection error: {e}")
+            return None
+    
+    async def attach_arduino(self, probed):
+        """Start serial I/O on a probed port, then negotiate the binary protocol"""
+        self.arduino, pending = probed
+        if self.startup["arduinoReadyMs"] is None:
+            self.startup["arduinoReadyMs"] = startup_ms()
+        self.last_rx = time.monotonic()
+        self.rx_garbage = 0
+        self.serial_writer.start(self.arduino)
+        self.start_serial_reader()
+        # Lines that arrived together with the banner
+        if pending:
+            self.line_parser.feed(pending)
+        serial_log.info("🔄 Event-driven sensor reading and auto-tracking started")
+        self.set_link_state("connected")
+        await self.negotiate_protocol()
+        
+        # A reset Arduino comes back at its home position
+        if self.last_servos is not None and self.arduino:
+            serial_log.info(f"🔁 Replaying last servo target {list(self.last_servos)}")
+            self.send_servos(*self.last_servos, force=True)
+    
+    def detach_arduino(self, reason):
+        """Drop a failed serial link; the supervisor reconnects"""
+        if self.arduino is None:
+            return
+        serial_log.warning(f"🔌 Arduino link lost: {reason}")
+        self.stop_serial_reader()
+        self.serial_writer.stop()
+        try:
+            self.arduino.close()
+        except Exception:
+            pass
+        self.arduino = None
+        # A reconnected sketch starts over in ASCII at the default baud rate
+        self.binary_mode = False
+        self.angle_scheduler.set_link(self.baudrate)
+        self.frame_decoder.buffer.clear()
+        self.line_parser.buffer.clear()
+        self.servo_cache.reset()
+        self.link_losses += 1
+        self.set_link_state("disconnected")
+        self.link_lost.set()
+    
+    def set_link_state(self, state):
+        """Record a link state transition and push it to clients"""
+        if state != self.link_state:
+            self.link_state = state
+            self.touch_state()
+    
+    async def serial_supervisor(self):
+        """Keep the Arduino link up: detect loss, reconnect with backoff"""
+        delay = self.reconnect_min_delay
+        while True:
+            if self.arduino is None:
+                self.set_link_state("connecting")
+                probed = await self.connect_arduino()
+                if probed is None:
+                    self.set_link_state("disconnected")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.reconnect_max_delay)
+                    continue
+                delay = self.reconnect_min_delay
+                if self.link_losses:
+                    self.link_reconnects += 1
+                await self.attach_arduino(probed)
+                continue
+            
+            # Connected: wake early on an I/O error, otherwise check for silence
+            self.link_lost.clear()
+            try:
+                await asyncio.wait_for(self.link_lost.wait(), self.link_timeout / 2)
+            except asyncio.TimeoutError:
+                silent = time.monotonic() - self.last_rx
+                if silent > self.link_timeout:
+                    self.detach_arduino(f"no data for {silent:.1f}s")
+    
+    def start_serial_reader(self):
+        """Register the Arduino port with the event loop so lines are handled as they arrive"""
+        loop = asyncio.get_running_loop()
+        # Non-blocking reads: the event loop only calls us when bytes are waiting
+        self.arduino.timeout = 0
+        loop.add_reader(self.arduino.fileno(), self.read_sensors)
     
+    def stop_serial_reader(self):
+        """Unregister the Arduino port from the event loop"""
+        try:
+            asyncio.get_running_loop().remove_reader(self.arduino.fileno())
+        except Exception:
+            pass
+    
+    @timed(STAGE_SECONDS.labels("serial_read"))
     def read_sensors(self):
-        """Read 4 LDR sensors from Arduino"""
+        """Read everything pending from Arduino in one call and dispatch it"""
         try:
-            # Read all available data to ensure we get the latest
-            while self.arduino and self.arduino.in_waiting:
-                line = self.arduino.readline().decode('utf-8').strip()
+            # One syscall straight into the reusable buffer
+            count = os.readv(self.arduino.fileno(), [self.read_chunk])
+            if count == 0:
+                raise OSError("serial port closed")
+        except BlockingIOError:
+            return
+        except Exception as e:
+            serial_log.error(f"❌ Sensor reading error: {e}")
+            # Stop the loop from spinning on a dead file descriptor
+            self.detach_arduino(str(e))
+            return
+        
+        data = memoryview(self.read_chunk)[:count]
+        if self.binary_mode:
+            skipped = self.frame_decoder.skipped_bytes
+            frames = self.frame_decoder.feed(data)
+            for frame_type, values in frames:
+                if frame_type == FRAME_LDR:
+                    self.on_ldr_sample(list(values))
+                elif frame_type == FRAME_SERVO_POS:
+                    self.on_servo_positions(list(values))
+            # A reset sketch talks ASCII at its default baud rate: bytes keep coming, frames don't
+            if frames:
+                self.rx_garbage = 0
+            else:
+                self.rx_garbage += self.frame_decoder.skipped_bytes - skipped
+                if self.rx_garbage > self.link_garbage_limit:
+                    self.detach_arduino(f"{self.rx_garbage} bytes without a valid frame")
+        else:
+            self.line_parser.feed(data)
+    
+    def on_ldr_line(self, buffer, start, end):
+        """LDR data: "LDR:512,487,523,498" """
+        if raw_log.isEnabledFor(logging.DEBUG):
+            raw_log.debug("🔍 Arduino says: LDR:%s", buffer[start:end].decode(errors='replace'))
+        try:
+            new_readings = parse_ints(buffer, start, end)
+        except ValueError as e:
+            serial_log.warning(f"❌ Invalid LDR values: {buffer[start:end]} - {e}")
+            return
+        if len(new_readings) == 4:
+            self.on_ldr_sample(new_readings)
+    
+    def on_servo_pos_line(self, buffer, start, end):
+        """Servo positions: "SERVO_POS:90,45,135,90" """
+        if raw_log.isEnabledFor(logging.DEBUG):
+            raw_log.debug("🔍 Arduino says: SERVO_POS:%s", buffer[start:end].decode(errors='replace'))
+        try:
+            new_positions = parse_ints(buffer, start, end)
+        except ValueError as e:
+            serial_log.warning(f"❌ Invalid servo values: {buffer[start:end]} - {e}")
+            return
+        if len(new_positions) == 4:
+            self.on_servo_positions(new_positions)
+    
+    def on_protocol_line(self, buffer, start, end):
+        """Binary protocol accepted: "PROTO_OK:BIN1,115200" """
+        self.on_protocol_ack(buffer[start:end].decode(errors='replace'))
+        # Anything after the ack was sent at the new baud rate
+        return self.binary_mode
+    
+    def on_other_line(self, buffer, start, end):
+        """Lines we don't act on (banner, SERVO_TARGET echoes) are only decoded for debugging"""
+        if raw_log.isEnabledFor(logging.DEBUG):
+            raw_log.debug("🔍 Arduino says: %s", buffer[start:end].decode(errors='replace'))
+    
+    def on_ldr_sample(self, new_readings):
+        """Handle one LDR sample [front, right, back, left]"""
+        # Only valid samples count as the link being alive
+        self.last_rx = time.monotonic()
+        try:
+            # ADC noise stops here: the filtered values only change on real light changes
+            new_readings = self.ldr_filter.update(new_readings)
+            
+            # Only update if values actually changed
+            if new_readings != self.ldr_readings:
+                self.ldr_readings = new_readings
+                
+                # Calculate average lux
+                avg_reading = sum(self.ldr_readings) / 4
+                self.light_sensor_lux = int(avg_reading * 10)
                 
-                # Debug: print all received lines
-                if line:
-                    print(f"🔍 Arduino says: {line}")
+                self.touch_state()
+                sensor_log.debug("📊 LDRs: %s → %s lux", self.ldr_readings, self.light_sensor_lux)
                 
-                # Parse LDR data: "LDR:512,487,523,498"
-                if line.startswith("LDR:"):
-                    values = line[4:].split(',')
-                    if len(values) == 4:
-                        try:
-                            new_readings = [int(v) for v in values]
-                            # Only update if values actually changed
-                            if new_readings != self.ldr_readings:
-                                self.ldr_readings = new_readings
-                                
-                                # Calculate average lux
-                                avg_reading = sum(self.ldr_readings) / 4
-                                self.light_sensor_lux = int(avg_reading * 10)
-                                
-                                print(f"📊 LDRs: {self.ldr_readings} → {self.light_sensor_lux} lux")
-                                
-                                # Check for night mode activation/deactivation
-                                self.check_night_mode()
-                        except ValueError as e:
-                            print(f"❌ Invalid LDR values: {values} - {e}")
-                        
-                # Parse servo positions: "SERVO_POS:90,45,135,90"
-                elif line.startswith("SERVO_POS:"):
-                    values = line[10:].split(',')
-                    if len(values) == 4:
-                        try:
-                            new_positions = [int(v) for v in values]
-                            if new_positions != self.servo_positions:
-                                self.servo_positions = new_positions
-                                print(f"🔧 Servos: {self.servo_positions}")
-                        except ValueError as e:
-                            print(f"❌ Invalid servo values: {values} - {e}")
-                        
+                # Check for night mode activation/deactivation
+                self.check_night_mode()
+            
+            # Track on every sample (the sun moves even when the LDRs don't)
+            if self.current_mode == "auto" and not self.night_mode_active:
+                self.run_auto_tracking()
+            
+            self.record_history()
+            if self.rollups:
+                self.rollups.add(self.clock(), self.light_sensor_lux, self.current_mode,
+                                 self.night_mode_active, self.servo_positions)
         except Exception as e:
-            print(f"❌ Sensor reading error: {e}")
+            sensor_log.error(f"❌ Sensor reading error: {e}")
+    
+    def record_history(self):
+        """Append the current telemetry to the history (fields in TelemetryHistory.FIELDS order)"""
+        self.history.record(self.clock(), [
+            self.light_sensor_lux, self.horizontal_angle, self.vertical_angle,
+            *self.ldr_readings, *self.servo_positions
+        ])
+    
+    def log_state(self):
+        """Queue a pergola_logs row for the current state (never blocks)"""
+        self.log_writer.log(self.current_mode, self.horizontal_angle, self.vertical_angle,
+                            self.light_sensor_lux, self.night_mode_active)
+    
+    def on_rollup(self, period, rollup):
+        """A minute or hour closed: queue its pergola_rollups row"""
+        self.log_writer.log_rollup(period, rollup, self.device_id)
+    
+    def on_servo_positions(self, new_positions):
+        """Handle reported servo positions [front, right, back, left]"""
+        self.last_rx = time.monotonic()
+        self.servo_cache.report(new_positions)
+        if new_positions != self.servo_positions:
+            self.servo_positions = new_positions
+            self.touch_state()
+            sensor_log.debug("🔧 Servos: %s", self.servo_positions)
+    
+    async def negotiate_protocol(self, timeout=2.0):
+        """Ask the sketch to switch to binary frames at a higher baud rate, else stay on ASCII"""
+        self.protocol_ack = asyncio.get_running_loop().create_future()
+        self.send_to_arduino(f"PROTO:BIN{PROTOCOL_VERSION},{self.binary_baudrate}")
+        try:
+            await asyncio.wait_for(self.protocol_ack, timeout)
+            serial_log.info(f"⚡ Binary protocol v{PROTOCOL_VERSION} active at {self.arduino.baudrate} baud")
+        except asyncio.TimeoutError:
+            serial_log.info("📝 Arduino did not acknowledge binary protocol, staying on ASCII")
+        finally:
+            self.protocol_ack = None
+    
+    def on_protocol_ack(self, args):
+        """Switch to binary frames after the sketch acknowledged the handshake"""
+        version, _, baud = args.partition(',')
+        if version != f"BIN{PROTOCOL_VERSION}" or not baud.isdigit():
+            serial_log.warning(f"❌ Unexpected protocol ack: {args}")
+            return
+        self.arduino.baudrate = int(baud)
+        self.binary_mode = True
+        self.angle_scheduler.set_link(self.arduino.baudrate, binary=True)
+        if self.protocol_ack and not self.protocol_ack.done():
+            self.protocol_ack.set_result(True)
     
+    @timed(STAGE_SECONDS.labels("check_night_mode"))
     def check_night_mode(self):
         """Check if night mode should be activated/deactivated"""
         # Night mode can activate regardless of current mode
         if self.light_sensor_lux < self.night_threshold and not self.night_mode_active:
             # Activate night mode
-            print(f"🌙 Night mode activated (lux: {self.light_sensor_lux})")
+            night_log.info(f"🌙 Night mode activated (lux: {self.light_sensor_lux})")
             self.previous_mode = self.current_mode
             if self.current_mode == "manual":
                 self.previous_angles = [self.horizontal_angle, self.vertical_angle]
@@ -121,12 +1343,18 @@ class PergolaServer:
             # Reset angles to 0 for dashboard display during night mode
             self.horizontal_angle = 0.0
             self.vertical_angle = 0.0
-            self.send_to_arduino("SERVOS:90,90,90,90")  # Flatten panels
+            self.touch_state()
+            self.send_servos(90, 90, 90, 90)  # Flatten panels
+            if self.log_writer:
+                self.log_state()
             
         elif self.light_sensor_lux >= self.night_threshold and self.night_mode_active:
             # Deactivate night mode
-            print(f"☀️ Night mode deactivated (lux: {self.light_sensor_lux})")
+            night_log.info(f"☀️ Night mode deactivated (lux: {self.light_sensor_lux})")
             self.night_mode_active = False
+            self.touch_state()
+            if self.log_writer:
+                self.log_state()
             
             # Only restore previous mode behavior if not currently in off mode
             if self.current_mode != "off":
@@ -137,32 +1365,68 @@ class PergolaServer:
                     self.run_auto_tracking()
             # If currently in off mode, stay in off mode (panels remain flat)
     
+    @timed(STAGE_SECONDS.labels("send_to_arduino"))
     def send_to_arduino(self, command):
-        """Send command to Arduino"""
-        try:
-            if self.arduino:
-                self.arduino.write(f"{command}\n".encode())
-                print(f"📤 Sent to Arduino: {command}")
-        except Exception as e:
-            print(f"❌ Arduino send error: {e}")
+        """Queue command for the serial writer (never blocks the event loop)"""
+        if self.arduino:
+            self.serial_writer.send(command)
+            serial_log.debug("📤 Sent to Arduino: %s", command)
+    
+    @timed(STAGE_SECONDS.labels("send_servos"))
+    def send_servos(self, front, right, back, left, force=False):
+        """Send a servo command in the active protocol unless the Arduino already has it"""
+        self.last_servos = (front, right, back, left)
+        if not self.arduino or not self.servo_cache.should_send(self.last_servos, force):
+            return False
+        if not self.binary_mode:
+            self.send_to_arduino(f"SERVOS:{front},{right},{back},{left}")
+        else:
+            self.serial_writer.send_raw(encode_servos(front, right, back, left))
+            serial_log.debug("📤 Sent to Arduino: SERVOS %s,%s,%s,%s (binary)", front, right, back, left)
+        return True
+    
+    def load_location(self):
+        """Create the tracking location on first use (importing astral is slow on a Pi)"""
+        if self.location is None:
+            from astral import LocationInfo
+            self.location = LocationInfo(*self.location_config)
+            if self.sun_ephemeris.location is None:
+                self.sun_ephemeris.set_location(self.location)
+        return self.location
+    
+    def set_location(self, location):
+        """Change the tracking location and recompute the cached sun path"""
+        self.location = location
+        # New table rather than set_location(): fleet devices may share the old one
+        self.sun_ephemeris = SolarEphemeris(location, self.sun_ephemeris.resolution)
+        self.sun_ephemeris.refresh(self.clock())
+    
+    def set_clock(self, clock, monotonic):
+        """Run on another clock (wall time in seconds, plus a monotonic one for servo settling)"""
+        self.clock = clock
+        self.servo_cache.clock = monotonic
     
     def get_sun_position(self):
-        """Get current sun position using astronomical calculations"""
+        """Get current sun position from the precomputed sun path"""
         try:
-            from astral.sun import elevation, azimuth
-            import pytz
+            now = self.clock()
+            position = self.sun_ephemeris.position(now)
+            if position is not None:
+                return position
             
-            # Get timezone-aware current time
-            beirut_tz = pytz.timezone('Asia/Beirut')
-            current_time = datetime.now(beirut_tz)
+            # New day (or table still building): compute directly this once
+            location = self.load_location()
+            self.sun_ephemeris.refresh(now)
+            from astral.sun import elevation, azimuth
+            current_time = datetime.fromtimestamp(now, timezone.utc)
             
             # Calculate sun elevation and azimuth
-            sun_elevation = elevation(self.location.observer, current_time)
-            sun_azimuth = azimuth(self.location.observer, current_time)
+            sun_elevation = elevation(location.observer, current_time)
+            sun_azimuth = azimuth(location.observer, current_time)
             
             return sun_elevation, sun_azimuth
         except Exception as e:
-            print(f"❌ Sun position calculation error: {e}")
+            tracking_log.error(f"❌ Sun position calculation error: {e}")
             return None, None
     
     def calculate_ldr_sun_position(self):
@@ -179,15 +1443,18 @@ class PergolaServer:
             
             return horizontal_bias * 40, vertical_bias * 40  # Convert to angles
         except Exception as e:
-            print(f"❌ LDR sun position calculation error: {e}")
+            tracking_log.error(f"❌ LDR sun position calculation error: {e}")
             return 0, 0
     
+    @timed(STAGE_SECONDS.labels("run_auto_tracking"))
     def run_auto_tracking(self):
         """Run automatic sun tracking algorithm"""
         if self.night_mode_active or self.current_mode != "auto":
             return
         
         try:
+            previous_tracking_mode = self.tracking_mode
+            
             # Get sun position from both methods
             sun_elevation, sun_azimuth = self.get_sun_position()
             ldr_horizontal, ldr_vertical = self.calculate_ldr_sun_position()
@@ -195,13 +1462,7 @@ class PergolaServer:
             # Determine which method to use
             if sun_elevation is not None:
                 # Convert astronomical coordinates to panel angles
-                # Simplified conversion for maquette
-                astro_horizontal = (sun_azimuth - 180) % 360
-                if astro_horizontal > 180:
-                    astro_horizontal -= 360
-                astro_horizontal = max(-40, min(40, astro_horizontal / 4.5))  # Scale to ±40°
-                
-                astro_vertical = max(-40, min(40, sun_elevation - 45))  # Offset and scale
+                astro_horizontal, astro_vertical = sun_to_panel_angles(sun_elevation, sun_azimuth)
                 
                 # Check if LDR and astronomical readings are close
                 h_diff = abs(ldr_horizontal - astro_horizontal)
@@ -211,67 +1472,42 @@ class PergolaServer:
                     # Use LDR readings
                     self.tracking_mode = "ldr"
                     target_h, target_v = ldr_horizontal, ldr_vertical
-                    print(f"🔍 Using LDR tracking: H={target_h:.1f}°, V={target_v:.1f}°")
+                    tracking_log.debug("🔍 Using LDR tracking: H=%.1f°, V=%.1f°", target_h, target_v)
                 else:
                     # Use astronomical calculations
                     self.tracking_mode = "astronomical"
                     target_h, target_v = astro_horizontal, astro_vertical
-                    print(f"🌍 Using astronomical tracking: H={target_h:.1f}°, V={target_v:.1f}°")
+                    tracking_log.debug("🌍 Using astronomical tracking: H=%.1f°, V=%.1f°", target_h, target_v)
             else:
                 # Fallback to LDR only
                 self.tracking_mode = "ldr"
                 target_h, target_v = ldr_horizontal, ldr_vertical
-                print(f"🔍 Using LDR fallback: H={target_h:.1f}°, V={target_v:.1f}°")
+                tracking_log.debug("🔍 Using LDR fallback: H=%.1f°, V=%.1f°", target_h, target_v)
             
             # Convert angles to servo positions and send to Arduino
-            self.horizontal_angle = target_h
-            self.vertical_angle = target_v
+            if (target_h != self.horizontal_angle or target_v != self.vertical_angle
+                    or self.tracking_mode != previous_tracking_mode):
+                self.horizontal_angle = target_h
+                self.vertical_angle = target_v
+                self.touch_state()
             self.angles_to_servos(target_h, target_v)
             
         except Exception as e:
-            print(f"❌ Auto tracking error: {e}")
+            tracking_log.error(f"❌ Auto tracking error: {e}")
     
+    @timed(STAGE_SECONDS.labels("angles_to_servos"))
     def angles_to_servos(self, horizontal, vertical):
         """Convert horizontal/vertical angles to servo positions"""
         try:
-            # Panel center stays fixed, edges move to create tilt
-            # horizontal: -40° (tilt left) to +40° (tilt right)
-            # vertical: -40° (tilt back) to +40° (tilt front)
-            
-            # Base position (flat)
-            base_pos = 90
-            
-            # Scale angles: 40° input angle = 90° servo movement from base
-            # This gives full servo range utilization
-            servo_scale = 90.0 / 40.0  # 2.25 degrees servo per degree input
-            
-            # Calculate servo positions for each side
-            # Front servo controls front edge height
-            servo_front = base_pos - (vertical * servo_scale)  # Front edge: lower for backward tilt, higher for forward tilt
-            
-            # Right servo controls right edge height  
-            servo_right = base_pos + (horizontal * servo_scale)  # Right edge: higher for rightward tilt, lower for leftward tilt
+            servo_front, servo_right, servo_back, servo_left = angles_to_servo_positions(horizontal, vertical)
             
-            # Back servo controls back edge height
-            servo_back = base_pos + (vertical * servo_scale)  # Back edge: higher for backward tilt, lower for forward tilt
-            
-            # Left servo controls left edge height
-            servo_left = base_pos - (horizontal * servo_scale)  # Left edge: higher for leftward tilt, lower for rightward tilt
-            
-            # Constrain to servo limits
-            servo_front = max(0, min(180, int(servo_front)))
-            servo_right = max(0, min(180, int(servo_right)))
-            servo_back = max(0, min(180, int(servo_back)))
-            servo_left = max(0, min(180, int(servo_left)))
-            
-            # Send to Arduino
-            command = f"SERVOS:{servo_front},{servo_right},{servo_back},{servo_left}"
-            self.send_to_arduino(command)
-            
-            print(f"🎯 Angles H={horizontal:.1f}°, V={vertical:.1f}° → Servos: F{servo_front},R{servo_right},B{servo_back},L{servo_left}")
+            # Send to Arduino (skipped when it already has this vector)
+            if self.send_servos(servo_front, servo_right, servo_back, servo_left):
+                tracking_log.debug("🎯 Angles H=%.1f°, V=%.1f° → Servos: F%s,R%s,B%s,L%s",
+                                   horizontal, vertical, servo_front, servo_right, servo_back, servo_left)
             
         except Exception as e:
-            print(f"❌ Angle to servo conversion error: {e}")
+            tracking_log.error(f"❌ Angle to servo conversion error: {e}")
     
     def update_manual_control(self):
         """Update servo positions based on manual control angles"""
@@ -280,9 +1516,11 @@ class PergolaServer:
     
     async def handle_client(self, websocket):
         """Handle WebSocket client connections"""
-        self.clients.add(websocket)
-        client_addr = getattr(websocket, 'remote_address', 'unknown')
-        print(f"📱 Client connected from {client_addr}. Total clients: {len(self.clients)}")
+        session = ClientSession(websocket, self.client_queue_size, self.client_max_lag)
+        session.start()
+        self.clients[websocket] = session
+        client_addr = session.address
+        client_log.info(f"📱 Client connected from {client_addr}. Total clients: {len(self.clients)}")
         
         try:
             await self.send_status(websocket)
@@ -291,60 +1529,153 @@ class PergolaServer:
                 await self.process_message(websocket, message)
                 
         except websockets.exceptions.ConnectionClosed:
-            print(f"📱 Client {client_addr} disconnected normally")
+            client_log.info(f"📱 Client {client_addr} disconnected normally")
         except Exception as e:
-            print(f"❌ Client error: {e}")
+            client_log.error(f"❌ Client error: {e}")
         finally:
-            self.clients.discard(websocket)
-            print(f"📱 Client removed. Total clients: {len(self.clients)}")
+            session.stop()
+            self.clients.pop(websocket, None)
+            client_log.info(f"📱 Client removed. Total clients: {len(self.clients)}")
     
     async def process_message(self, websocket, message):
         """Process incoming WebSocket messages"""
+        started = time.perf_counter()
+        cmd = None
         try:
             data = json.loads(message)
             cmd = data.get('cmd')
             
-            print(f"📨 Received command: {cmd} - {data}")
+            client_log.debug("📨 Received command: %s - %s", cmd, data)
             
             if cmd == "MODE":
                 mode = data.get('mode', 'auto')
-                if mode != self.current_mode:
+                if mode not in MODES:
+                    client_log.warning(f"❌ Unknown mode {mode!r} ignored")
+                    await self.send_status(websocket)
+                elif mode != self.current_mode:
                     self.current_mode = mode
+                    self.touch_state()
                     
                     if mode == "auto":
-                        print("🤖 Switching to Automatic Tracker mode")
+                        log.info("🤖 Switching to Automatic Tracker mode")
                         self.run_auto_tracking()
                     elif mode == "manual":
-                        print("🕹️ Switching to Manual Control mode")
+                        log.info("🕹️ Switching to Manual Control mode")
                         self.update_manual_control()
                     elif mode == "off":
-                        print("⏹️ Switching to Off mode")
+                        log.info("⏹️ Switching to Off mode")
                         if self.night_mode_active:
-                            print("🌙 Night mode remains active in Off mode")
+                            night_log.info("🌙 Night mode remains active in Off mode")
                         # Reset angles to 0 for dashboard display
                         self.horizontal_angle = 0.0
                         self.vertical_angle = 0.0
-                        self.send_to_arduino("SERVOS:90,90,90,90")  # Flatten panels
+                        self.send_servos(90, 90, 90, 90)  # Flatten panels
                     
-                    await self.broadcast_status()
+                    if self.log_writer:
+                        self.log_state()
                 
             elif cmd == "SET_ANGLES":
                 if self.current_mode == "manual" and not self.night_mode_active:
                     self.horizontal_angle = max(-40, min(40, data.get('horiz', 0)))
                     self.vertical_angle = max(-40, min(40, data.get('vert', 0)))
-                    self.update_manual_control()
-                    await self.broadcast_status()
+                    self.touch_state()
+                    # Coalesced: only the latest target is sent on the next tick
+                    self.angle_scheduler.request()
+                else:
+                    self.angle_scheduler.drop()
                 
             elif cmd in ["GET_STATUS", "GET_STATE", "GET_MODE", "GET_DASHBOARD_DATA"]:
                 await self.send_status(websocket)
                 
+            elif cmd == "SUBSCRIBE":
+                # Opt in/out of delta frames: a snapshot now, then only changed fields
+                session = self.clients.get(websocket)
+                if session:
+                    session.delta = bool(data.get('delta'))
+                    if session.delta:
+                        client_log.info(f"📉 Client {session.address} subscribed to delta frames")
+                await self.send_status(websocket)
+                
+            elif cmd == "RESYNC":
+                # Client saw a sequence gap: send a fresh snapshot
+                await self.send_status(websocket)
+                
+            elif cmd == "HISTORY":
+                # Range query: {"seconds": 3600} or {"since": t0, "until": t1}, optional "resolution"
+                try:
+                    until = self.clock() if data.get('until') is None else float(data['until'])
+                    if data.get('since') is None:
+                        since = until - float(data.get('seconds', 3600))
+                    else:
+                        since = float(data['since'])
+                    if not (math.isfinite(since) and math.isfinite(until)):
+                        raise ValueError("not finite")
+                except (TypeError, ValueError):
+                    client_log.warning(f"❌ Invalid HISTORY range: {data}")
+                    await self.send_reply(websocket, json.dumps({
+                        "type": "error",
+                        "device": self.device_id,
+                        "cmd": cmd,
+                        "error": "since, until and seconds must be numbers"
+                    }))
+                else:
+                    reply = {"type": "history", **self.history.query(since, until, data.get('resolution'))}
+                    if self.device_id is not None:
+                        reply["device"] = self.device_id
+                    await self.send_reply(websocket, json.dumps(reply, separators=(',', ':')))
+                
+            elif cmd == "GET_DIAGNOSTICS":
+                await self.send_reply(websocket, json.dumps({
+                    "type": "diagnostics",
+                    "device": self.device_id,
+                    "diagnostics": self.get_diagnostics()
+                }))
+                
         except json.JSONDecodeError:
-            print(f"❌ Invalid JSON received: {message}")
+            client_log.warning(f"❌ Invalid JSON received: {message}")
         except Exception as e:
-            print(f"❌ Message processing error: {e}")
+            client_log.error(f"❌ Message processing error: {e}")
+        finally:
+            COMMAND_SECONDS.labels(cmd if cmd in COMMANDS else "other").observe(time.perf_counter() - started)
     
-    async def send_status(self, websocket):
-        """Send current status to a specific client"""
+    def get_diagnostics(self):
+        """Collect internal subsystem stats"""
+        return {
+            "serialWriter": self.serial_writer.stats(),
+            "protocol": dict(self.frame_decoder.stats(), binary=self.binary_mode,
+                             lines=self.line_parser.lines, lineOverflows=self.line_parser.overflows),
+            "angleScheduler": self.angle_scheduler.stats(),
+            "clients": [session.stats() for session in self.clients.values()],
+            "clientsEvicted": self.clients_evicted,
+            "broadcast": {
+                "pushes": self.broadcast_pushes,
+                "heartbeats": self.broadcast_heartbeats,
+                "coalesced": self.broadcast_coalesced
+            },
+            "startup": self.startup,
+            "history": self.history.stats(),
+            "ldrFilter": self.ldr_filter.stats(),
+            "servoCommands": self.servo_cache.stats(),
+            "logWriter": self.log_writer.stats() if self.log_writer else None,
+            "rollups": self.rollups.stats() if self.rollups else None,
+            "link": {
+                "state": self.link_state,
+                "port": self.port,
+                "losses": self.link_losses,
+                "reconnects": self.link_reconnects
+            }
+        }
+    
+    def touch_state(self):
+        """Record a status change so the next send re-serializes the snapshot"""
+        self.state_version += 1
+        self.state_changed_at = self.clock()
+        if self.state_changed.is_set():
+            self.broadcast_coalesced += 1
+        self.state_changed.set()
+    
+    def build_status(self):
+        """Build the status document for the current state"""
         # Use display angles (0,0 for off mode and night mode)
         display_horizontal = 0.0 if (self.current_mode == "off" or self.night_mode_active) else self.horizontal_angle
         display_vertical = 0.0 if (self.current_mode == "off" or self.night_mode_active) else self.vertical_angle
@@ -361,97 +1692,460 @@ class PergolaServer:
                 "trackingMode": self.tracking_mode
             },
             "night_mode": {"active": self.night_mode_active},
-            "timestamp": datetime.now().isoformat()
+            "arduino": {"link": self.link_state, "port": self.port},
+            "version": self.state_version,
+            "changedAt": datetime.fromtimestamp(self.state_changed_at).isoformat()
         }
-        
+        if self.device_id is not None:
+            status["device"] = self.device_id
+        return status
+    
+    def status_document(self):
+        """Status document for the current state version (shared, do not modify)"""
+        if self.status_doc_version != self.state_version:
+            self.status_doc = self.build_status()
+            self.status_doc_version = self.state_version
+        return self.status_doc
+    
+    def status_message(self):
+        """Serialized status snapshot stamped with the send time; re-serialized only when the state version changes"""
+        if self.status_cache_version != self.state_version:
+            # Without the closing brace, so the send time can be appended
+            self.status_cache = json.dumps(self.status_document())[:-1]
+            self.status_cache_version = self.state_version
+        return f'{self.status_cache}, "timestamp": "{self.send_timestamp()}"}}'
+    
+    def send_timestamp(self):
+        """ISO time a frame is sent at (status "timestamp"; "changedAt" is when the state last changed)"""
+        return datetime.fromtimestamp(self.clock()).isoformat()
+    
+    @staticmethod
+    def status_changes(previous, current):
+        """Fields of current that differ from previous, one level into nested objects"""
+        changes = {}
+        for key, value in current.items():
+            if key in ("version", "changedAt", "timestamp"):
+                continue
+            old = previous.get(key)
+            if value == old:
+                continue
+            if isinstance(value, dict) and isinstance(old, dict):
+                changes[key] = {k: v for k, v in value.items() if old.get(k) != v}
+            else:
+                changes[key] = value
+        return changes
+    
+    def snapshot_frame(self, session):
+        """Full status for a delta client, starting a new baseline"""
+        current = self.status_document()
+        stream = session.delta_state.setdefault(self.device_id, [0, None])
+        stream[0] += 1
+        stream[1] = current
+        return json.dumps({"type": "snapshot", "seq": stream[0], **current, "timestamp": self.send_timestamp()})
+    
+    def delta_frame(self, session):
+        """Changed fields since the last frame sent to a delta client, or None if nothing changed"""
+        current = self.status_document()
+        stream = session.delta_state.setdefault(self.device_id, [0, None])
+        if stream[1] is current:
+            return None
+        changes = self.status_changes(stream[1] or {}, current)
+        stream[1] = current
+        if not changes:
+            return None
+        stream[0] += 1
+        frame = {
+            "type": "delta",
+            "seq": stream[0],
+            "version": current["version"],
+            "changedAt": current["changedAt"],
+            "changes": changes
+        }
+        if self.device_id is not None:
+            frame["device"] = self.device_id
+        return json.dumps(frame, separators=(',', ':'))
+    
+    async def send_reply(self, websocket, message):
+        """Queue a reply for one client (replies are never dropped)"""
+        session = self.clients.get(websocket)
+        if session:
+            session.send_reply(message)
+        else:
+            await websocket.send(message)
+    
+    async def send_status(self, websocket):
+        """Send current status to a specific client"""
         try:
-            await websocket.send(json.dumps(status))
+            session = self.clients.get(websocket)
+            if session and session.delta:
+                await self.send_reply(websocket, self.snapshot_frame(session))
+            else:
+                await self.send_reply(websocket, self.status_message())
+            if self.startup["firstStatusMs"] is None:
+                self.startup["firstStatusMs"] = startup_ms()
+                log.info(f"⏱️ First status frame sent {self.startup['firstStatusMs']:.0f} ms after start")
         except Exception as e:
-            print(f"❌ Failed to send status: {e}")
+            client_log.error(f"❌ Failed to send status: {e}")
     
-    async def broadcast_status(self):
-        """Broadcast status to all connected clients"""
+    async def broadcast_status(self, heartbeat=False):
+        """Queue status for every connected client; each client's sender delivers concurrently"""
+        started = time.perf_counter()
         if self.clients:
-            # Use display angles (0,0 for off mode and night mode)
-            display_horizontal = 0.0 if (self.current_mode == "off" or self.night_mode_active) else self.horizontal_angle
-            display_vertical = 0.0 if (self.current_mode == "off" or self.night_mode_active) else self.vertical_angle
-            
-            status = {
-                "status": "connected",
-                "mode": self.current_mode,
-                "data": {
-                    "horizontalAngle": display_horizontal,
-                    "verticalAngle": display_vertical,
-                    "lightSensorReading": self.light_sensor_lux,
-                    "servoPositions": self.servo_positions,
-                    "ldrReadings": self.ldr_readings,
-                    "trackingMode": self.tracking_mode
-                },
-                "night_mode": {"active": self.night_mode_active},
-                "timestamp": datetime.now().isoformat()
-            }
-            
             # Debug logging for night mode status
             if self.night_mode_active:
-                print(f"📤 Broadcasting night mode active status in {self.current_mode} mode")
-            
-            message = json.dumps(status)
-            disconnected = set()
+                night_log.debug("📤 Broadcasting night mode active status in %s mode", self.current_mode)
             
-            for client in self.clients.copy():
-                try:
-                    await client.send(message)
-                except Exception as e:
-                    disconnected.add(client)
+            message = self.status_message()
             
-            self.clients -= disconnected
+            for websocket, session in list(self.clients.items()):
+                client_started = time.perf_counter()
+                frame = self.delta_frame(session) if session.delta else message
+                if frame is None and heartbeat:
+                    frame = json.dumps({"type": "heartbeat", "device": self.device_id, "version": self.state_version})
+                if frame is not None and not session.send_telemetry(frame):
+                    # Evicted for lagging too far behind
+                    self.clients.pop(websocket, None)
+                    self.clients_evicted += 1
+                BROADCAST_CLIENT_SECONDS.observe(time.perf_counter() - client_started)
+        BROADCAST_SECONDS.observe(time.perf_counter() - started)
     
-    def sensor_monitor_thread(self):
-        """Background thread to continuously read sensors"""
+    async def broadcast_engine(self):
+        """Push status as soon as state changes, at a capped rate, with a heartbeat when idle"""
+        loop = asyncio.get_running_loop()
+        last_push = 0.0
         while True:
-            self.read_sensors()
+            try:
+                await asyncio.wait_for(self.state_changed.wait(), timeout=self.heartbeat_interval)
+                heartbeat = False
+            except asyncio.TimeoutError:
+                heartbeat = True
             
-            # Run auto tracking if in auto mode
-            if self.current_mode == "auto" and not self.night_mode_active:
-                self.run_auto_tracking()
+            # Rate cap: changes arriving meanwhile are folded into this push
+            delay = last_push + 1.0 / self.broadcast_max_rate - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
             
-            time.sleep(1)
+            self.state_changed.clear()
+            last_push = loop.time()
+            if not self.clients:
+                continue
+            
+            await self.broadcast_status(heartbeat=heartbeat)
+            if heartbeat:
+                self.broadcast_heartbeats += 1
+            else:
+                self.broadcast_pushes += 1
     
-    async def periodic_broadcast(self):
-        """Periodically broadcast status to clients"""
-        while True:
-            if self.clients:
-                await self.broadcast_status()
-            await asyncio.sleep(2)
+    def register_metrics(self):
+        """Expose this device's queue depth, link state and counters (read only when scraped)"""
+        device = self.device_id or "pergola"
+        METRICS.gauge("pergola_serial_queue_depth", "Commands waiting for the serial writer",
+                      ("device",)).labels(device).track(lambda: len(self.serial_writer.queue))
+        METRICS.gauge("pergola_link_up", "1 while the Arduino link is connected",
+                      ("device",)).labels(device).track(lambda: int(self.link_state == "connected"))
+        METRICS.counter("pergola_ldr_samples_total", "LDR samples received",
+                        ("device",)).labels(device).track(lambda: self.ldr_filter.samples)
+        METRICS.counter("pergola_servo_commands_total", "Servo commands sent to the Arduino",
+                        ("device",)).labels(device).track(lambda: self.servo_cache.sent)
+        METRICS.counter("pergola_serial_dropped_total", "Commands dropped from a full serial queue",
+                        ("device",)).labels(device).track(lambda: self.serial_writer.dropped)
+        METRICS.counter("pergola_broadcast_pushes_total", "Status pushes to all clients",
+                        ("device",)).labels(device).track(lambda: self.broadcast_pushes)
+        METRICS.counter("pergola_clients_evicted_total", "Clients dropped for lagging behind",
+                        ("device",)).labels(device).track(lambda: self.clients_evicted)
+        METRICS.counter("pergola_link_losses_total", "Arduino link losses",
+                        ("device",)).labels(device).track(lambda: self.link_losses)
+    
+    async def start_device(self, probed=None, broadcast=True):
+        """Start tracking (and broadcasting, unless the fleet does it) for this device, then attach its Arduino"""
+        self.register_metrics()
+        self.load_location()
+        self.sun_ephemeris.refresh(self.clock())
+        
+        self.angle_scheduler.start()
+        log.info(f"🕹️ Joystick command scheduler started ({self.angle_scheduler.tick * 1000:.0f} ms tick)")
+        
+        if self.log_writer:
+            from pergola_storage import RollupAggregator
+            self.rollups = RollupAggregator(self.on_rollup)
+            self.log_writer.start()
+        
+        if broadcast:
+            asyncio.create_task(self.broadcast_engine())
+            log.info(f"📡 Change-driven broadcast started (max {self.broadcast_max_rate:.0f}/s, heartbeat {self.heartbeat_interval:.0f}s)")
+        
+        # Clients already get status while the Arduino boots
+        if probed:
+            await self.attach_arduino(probed)
+        # Connects (and later reconnects) whenever the link is down
+        asyncio.create_task(self.serial_supervisor())
+        log.info(f"🛡️ Serial supervisor started (link timeout {self.link_timeout:.1f}s)")
     
     async def start_server(self):
         """Start the WebSocket server"""
-        print("🚀 Starting Advanced Pergola Control Server...")
-        print(f"📍 Location: {self.location.name}, {self.location.region}")
+        log.info("🚀 Starting Advanced Pergola Control Server...")
+        log.info(f"📍 Location: {self.location_config[0]}, {self.location_config[1]}")
         
-        if self.connect_arduino():
-            sensor_thread = threading.Thread(target=self.sensor_monitor_thread, daemon=True)
-            sensor_thread.start()
-            print("🔄 Sensor monitoring and auto-tracking started")
+        # Bind first so the app can connect while the Arduino is still booting
+        log.info("🌐 WebSocket server starting on port 8080...")
+        await websockets.serve(self.handle_client, "0.0.0.0", 8080)
+        self.startup["listeningMs"] = startup_ms()
+        log.info(f"🌐 Listening on port 8080 ({self.startup['listeningMs']:.0f} ms after start)")
         
-        asyncio.create_task(self.periodic_broadcast())
-        print("📡 Periodic broadcast task started")
+        if self.metrics_address:
+            await serve_metrics(self.metrics_address, self.clients)
         
-        print("🌐 WebSocket server starting on port 8080...")
-        start_server = websockets.serve(self.handle_client, "0.0.0.0", 8080)
+        await self.start_device()
+        log.info("✅ Advanced Pergola server is running!")
+        log.info("📱 Ready for mobile app connections")
+        log.info("🌞 Sun tracking algorithm active")
+        
+        await asyncio.Future()
+
+class PergolaFleet:
+    """Fleet mode: one server process driving every attached pergola"""
+    
+    PORT_PATTERNS = ['/dev/ttyACM*', '/dev/ttyUSB*']
+    
+    def __init__(self, raw_window=3600):
+        self.devices = {}  # device id -> PergolaServer
+        self.clients = {}  # websocket -> ClientSession, shared by all devices
+        self.client_queue_size = 16
+        self.client_max_lag = 10.0
+        self.log_writer = None  # Shared by all devices
+        self.raw_window = raw_window
+        self.metrics_address = None
         
-        await start_server
-        print("✅ Advanced Pergola server is running!")
-        print("📱 Ready for mobile app connections")
-        print("🌞 Sun tracking algorithm active")
+        # Ports that are not devices yet are probed again: hot-plugged pergolas, missed banners
+        self.rescan_interval = 10.0
+        self.rescan_max_delay = 300.0  # Ports that never answer (other USB serial devices) back off to this
+        self.failed_ports = {}  # port -> (monotonic time of next probe, current delay)
         
+        # One broadcaster for the fleet: every device sets the same event, and a push or
+        # heartbeat covers all devices, so the client rate doesn't grow with the device count
+        self.state_changed = asyncio.Event()
+        self.broadcast_max_rate = 10.0
+        self.heartbeat_interval = 10.0
+        self.broadcast_pushes = 0
+        self.broadcast_heartbeats = 0
+        self.broadcast_versions = {}  # device id -> state version last pushed
+        self.clients_evicted = 0
+    
+    @classmethod
+    def discover_ports(cls):
+        """Every serial port that could be an Arduino"""
+        ports = []
+        for pattern in cls.PORT_PATTERNS:
+            ports.extend(sorted(glob.glob(pattern)))
+        return ports
+    
+    def add_device(self, port):
+        """Create the per-device server for a port"""
+        device_id = os.path.basename(port)
+        device = PergolaServer(device_id=device_id, port=port, raw_window=self.raw_window)
+        device.clients = self.clients
+        device.state_changed = self.state_changed
+        self.broadcast_versions[device_id] = device.state_version
+        device.log_writer = self.log_writer
+        # Devices at the same site share one precomputed sun path
+        if self.devices:
+            device.sun_ephemeris = next(iter(self.devices.values())).sun_ephemeris
+        self.devices[device_id] = device
+        return device
+    
+    def targets(self, data):
+        """Devices a command applies to: the named one, or all of them"""
+        device_id = data.get('device')
+        if device_id is None:
+            return list(self.devices.values())
+        device = self.devices.get(device_id)
+        return [device] if device else []
+    
+    async def handle_client(self, websocket):
+        """Handle a WebSocket client for the whole fleet"""
+        session = ClientSession(websocket, self.client_queue_size, self.client_max_lag)
+        session.start()
+        self.clients[websocket] = session
+        client_addr = session.address
+        client_log.info(f"📱 Client connected from {client_addr}. Total clients: {len(self.clients)}")
+        
+        try:
+            for device in self.devices.values():
+                await device.send_status(websocket)
+            
+            async for message in websocket:
+                await self.process_message(websocket, message)
+                
+        except websockets.exceptions.ConnectionClosed:
+            client_log.info(f"📱 Client {client_addr} disconnected normally")
+        except Exception as e:
+            client_log.error(f"❌ Client error: {e}")
+        finally:
+            session.stop()
+            self.clients.pop(websocket, None)
+            client_log.info(f"📱 Client removed. Total clients: {len(self.clients)}")
+    
+    async def process_message(self, websocket, message):
+        """Route a command to the device it names (or every device)"""
+        try:
+            data = json.loads(message)
+        except json.JSONDecodeError:
+            client_log.warning(f"❌ Invalid JSON received: {message}")
+            return
+        
+        if data.get('cmd') == "LIST_DEVICES":
+            session = self.clients.get(websocket)
+            reply = json.dumps({
+                "type": "devices",
+                "devices": [
+                    {"device": device_id, "port": device.port, "connected": device.arduino is not None,
+                     "link": device.link_state}
+                    for device_id, device in self.devices.items()
+                ]
+            })
+            if session:
+                session.send_reply(reply)
+            return
+        
+        targets = self.targets(data)
+        if not targets:
+            client_log.warning(f"❌ Unknown device: {data.get('device')}")
+            return
+        for device in targets:
+            await device.process_message(websocket, message)
+    
+    def broadcast_heartbeat(self):
+        """One heartbeat per client carrying every device's state version"""
+        frame = json.dumps({
+            "type": "heartbeat",
+            "devices": {device_id: device.state_version for device_id, device in self.devices.items()}
+        }, separators=(',', ':'))
+        for websocket, session in list(self.clients.items()):
+            if not session.send_telemetry(frame):
+                self.clients.pop(websocket, None)
+                self.clients_evicted += 1
+    
+    async def broadcast_engine(self):
+        """Push the devices whose state changed, at a capped rate for the whole fleet, with one heartbeat when idle"""
+        loop = asyncio.get_running_loop()
+        last_push = 0.0
+        while True:
+            try:
+                await asyncio.wait_for(self.state_changed.wait(), timeout=self.heartbeat_interval)
+                heartbeat = False
+            except asyncio.TimeoutError:
+                heartbeat = True
+            
+            # Rate cap: changes on any device arriving meanwhile are folded into this push
+            delay = last_push + 1.0 / self.broadcast_max_rate - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            
+            self.state_changed.clear()
+            last_push = loop.time()
+            changed = [device for device_id, device in list(self.devices.items())
+                       if self.broadcast_versions.get(device_id) != device.state_version]
+            for device in changed:
+                self.broadcast_versions[device.device_id] = device.state_version
+            if not self.clients:
+                continue
+            
+            if heartbeat and not changed:
+                self.broadcast_heartbeat()
+                self.broadcast_heartbeats += 1
+                continue
+            for device in changed:
+                await device.broadcast_status()
+                device.broadcast_pushes += 1
+            self.broadcast_pushes += 1
+    
+    async def start_server(self):
+        """Serve on one WebSocket port, then probe every port in parallel and attach the devices found"""
+        log.info("🚀 Starting Pergola Fleet Server...")
+        
+        log.info("🌐 WebSocket server starting on port 8080...")
+        await websockets.serve(self.handle_client, "0.0.0.0", 8080)
+        log.info(f"🌐 Listening on port 8080 ({startup_ms():.0f} ms after start)")
+        
+        if self.metrics_address:
+            await serve_metrics(self.metrics_address, self.clients)
+        
+        asyncio.create_task(self.broadcast_engine())
+        log.info(f"📡 Fleet broadcast started (max {self.broadcast_max_rate:.0f}/s, heartbeat {self.heartbeat_interval:.0f}s)")
+        
+        await self.probe_new_ports()
+        log.info(f"✅ Fleet server is running with {len(self.devices)} device(s) ({startup_ms():.0f} ms after start)")
+        
+        asyncio.create_task(self.rescan_ports())
         await asyncio.Future()
+    
+    async def probe_new_ports(self):
+        """Probe every port that is not a device yet, in parallel, and start the ones that answer"""
+        now = time.monotonic()
+        discovered = self.discover_ports()
+        known = {device.port for device in self.devices.values()}
+        # Forget ports that went away; they start over if they come back
+        self.failed_ports = {port: retry for port, retry in self.failed_ports.items() if port in discovered}
+        ports = [port for port in discovered
+                 if port not in known and self.failed_ports.get(port, (now, 0))[0] <= now]
+        if not ports:
+            return 0
+        log.info(f"🔌 Probing {len(ports)} candidate port(s): {', '.join(ports)}")
+        results = await asyncio.gather(*(probe_port(port, 9600) for port in ports))
+        
+        # Only ports whose sketch announced itself become devices
+        starts = []
+        for port, probed in zip(ports, results):
+            if probed is None:
+                delay = self.failed_ports.get(port, (0, self.rescan_interval / 2))[1]
+                delay = min(delay * 2, self.rescan_max_delay)
+                self.failed_ports[port] = (time.monotonic() + delay, delay)
+            else:
+                self.failed_ports.pop(port, None)
+                starts.append(self.add_device(port).start_device(probed, broadcast=False))
+        await asyncio.gather(*starts)
+        return len(starts)
+    
+    async def rescan_ports(self):
+        """Pick up pergolas plugged in after startup (existing devices reconnect on their own)"""
+        while True:
+            await asyncio.sleep(self.rescan_interval)
+            try:
+                added = await self.probe_new_ports()
+            except Exception as e:
+                log.error(f"❌ Port rescan error: {e}")
+                continue
+            if added:
+                log.info(f"✅ {added} new device(s), {len(self.devices)} in total")
 
 if __name__ == "__main__":
-    server = PergolaServer()
+    parser = argparse.ArgumentParser(description="Pergola control server")
+    parser.add_argument("--fleet", action="store_true", help="Drive every attached Arduino from one process")
+    parser.add_argument("--db", default=os.environ.get("PERGOLA_DB_URL"),
+                        help="Persist logs and rollups to postgresql://... or sqlite:///path (default: $PERGOLA_DB_URL)")
+    parser.add_argument("--spill", default="pergola_spill.db", help="Local buffer while the database is unreachable")
+    parser.add_argument("--raw-window", type=float, default=3600,
+                        help="Seconds of raw 500 ms samples kept in memory (rollups are kept long-term)")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="Address for the Prometheus endpoint")
+    parser.add_argument("--metrics-port", type=int, default=9180,
+                        help="Port for the Prometheus endpoint at /metrics (0 disables it)")
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_from_args(args)
+    
+    server = PergolaFleet(args.raw_window) if args.fleet else PergolaServer(raw_window=args.raw_window)
+    if args.db:
+        from pergola_storage import LogWriter, open_sink
+        server.log_writer = LogWriter(open_sink(args.db), spill_path=args.spill,
+                                      user_id=os.environ.get("PERGOLA_USER_ID"))
+        log.info(f"🗄️ Logging to {args.db.split('@')[-1]} (write-behind, spill: {args.spill})")
+    if args.metrics_port:
+        server.metrics_address = (args.metrics_host, args.metrics_port)
     try:
         asyncio.run(server.start_server())
     except KeyboardInterrupt:
-        print("\n🛑 Server stopped by user")
+        log.info("🛑 Server stopped by user")
     except Exception as e:
-        print(f"❌ Server error: {e}")
+        log.error(f"❌ Server error: {e}")
+    finally:
+        stop_logging()
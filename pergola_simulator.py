@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Time-accelerated replay of the tracking engine
+
+Runs a real PergolaServer on a virtual clock: LDR samples from a recorded or
+synthetic trace go through read_sensors() exactly as serial data would, and
+every servo command, mode transition (including night mode) and tracking-mode
+switch is recorded with its virtual timestamp. Servo commands are echoed back
+as SERVO_POS lines, as if the servos moved instantly.
+
+Traces:
+    synthetic   clear or cloudy day derived from the sun path (--date, --clouds, --seed)
+    CSV         timestamp,front,right,back,left (epoch seconds or ISO 8601)
+    JSON        a HISTORY reply ({"t": [...], "series": {"ldrFront": [...], ...}})
+
+Usage:
+    python pergola_simulator.py --date 2025-06-21 --clouds 6
+    python pergola_simulator.py --trace ldr_day.csv --night-threshold 250 --output run.json
+    python pergola_simulator.py --date 2025-12-21 --expect-digest 3f2a...
+
+The same trace and settings always produce the same events and digest, so a
+digest pinned in a regression test catches any change in control decisions.
+"""
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from pergola_logging import setup_logging
+from pergola_server_complete import PergolaServer, SolarEphemeris, sun_to_panel_angles
+
+SAMPLE_PERIOD = 0.5  # The sketch sends LDR data every 500 ms
+
+class VirtualClock:
+    """Wall and monotonic time that only move when the simulation advances them"""
+
+    def __init__(self, start):
+        self.now = start
+        self.start = start
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now - self.start
+
+    def advance_to(self, timestamp):
+        self.now = max(self.now, timestamp)
+
+class SimulatedPort:
+    """Pipe standing in for the serial port: read_sensors() reads what feed() writes"""
+
+    baudrate = 9600
+
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+
+    def fileno(self):
+        return self.read_fd
+
+    def feed(self, line):
+        os.write(self.write_fd, line.encode() + b"\r\n")
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+class CommandRecorder:
+    """Serial writer stand-in that keeps every command with its virtual timestamp"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.commands = []  # (timestamp, command)
+        self.on_error = None
+
+    def start(self, port):
+        pass
+
+    def stop(self):
+        pass
+
+    def send(self, command):
+        self.commands.append((self.clock.time(), command))
+
+    def send_raw(self, data):
+        self.commands.append((self.clock.time(), data.hex()))
+
+    def stats(self):
+        return {"commands": len(self.commands)}
+
+def synthetic_trace(location, day, period=SAMPLE_PERIOD, clouds=0, seed=0, noise=4.0):
+    """LDR samples for one local day: diffuse light plus a direct beam whose sensor
+    bias matches the astronomical panel angles, dimmed and flattened by passing clouds"""
+    rng = random.Random(seed)
+    table = SolarEphemeris.compute_day(location, local_midnight(location, day) + 43200, 60)
+    _, day_start, day_end, _, _ = table
+    ephemeris = SolarEphemeris(location, 60)
+    ephemeris.install(table)
+
+    # Each cloud: (start, duration, depth 0-1)
+    passages = []
+    for _ in range(clouds):
+        begin = rng.uniform(day_start, day_end)
+        passages.append((begin, rng.uniform(120, 1800), rng.uniform(0.4, 0.9)))
+
+    samples = []
+    count = int((day_end - day_start) / period)
+    for i in range(count):
+        timestamp = day_start + i * period
+        elevation, azimuth = ephemeris.position(timestamp)
+        shade = max([depth for begin, length, depth in passages if begin <= timestamp < begin + length],
+                    default=0.0)
+
+        if elevation <= -6:
+            mean = 3.0
+            beam = 0.0
+        elif elevation <= 0:
+            # Civil twilight: diffuse light only
+            mean = 3.0 + 40.0 * (elevation + 6) / 6
+            beam = 0.0
+        else:
+            beam = 1.0 - shade
+            mean = 40.0 + 660.0 * math.sqrt(math.sin(math.radians(elevation))) * (0.3 + 0.7 * beam)
+
+        horizontal, vertical = sun_to_panel_angles(elevation, azimuth)
+        # Calibrated so the LDR estimate equals the sun angles under a clear sky
+        bias_h = horizontal / 40 * 1024 * beam
+        bias_v = vertical / 40 * 1024 * beam
+        values = [mean + bias_v / 2, mean + bias_h / 2, mean - bias_v / 2, mean - bias_h / 2]
+        samples.append((timestamp, [max(0, min(1023, int(round(v + rng.gauss(0, noise))))) for v in values]))
+    return samples
+
+def local_midnight(location, day):
+    """Timestamp of midnight starting day at the location"""
+    import pytz
+    tz = pytz.timezone(location.timezone)
+    return tz.localize(datetime.combine(day, datetime.min.time())).timestamp()
+
+def parse_timestamp(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def load_trace(path):
+    """Samples [(timestamp, [front, right, back, left])] from a CSV file or a HISTORY reply"""
+    if path.endswith(".json"):
+        with open(path) as f:
+            history = json.load(f)
+        series = history["series"]
+        columns = [series[name] for name in ("ldrFront", "ldrRight", "ldrBack", "ldrLeft")]
+        return [(t, [int(round(column[i])) for column in columns]) for i, t in enumerate(history["t"])
+                if all(column[i] is not None for column in columns)]
+
+    samples = []
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith("#"):
+                continue
+            try:
+                samples.append((parse_timestamp(row[0]), [int(v) for v in row[1:5]]))
+            except ValueError:
+                continue  # Header line
+    samples.sort(key=lambda sample: sample[0])
+    return samples
+
+def load_events(path):
+    """Scripted client commands: [{"at": "HH:MM" or timestamp, "cmd": ..., ...}]"""
+    with open(path) as f:
+        return json.load(f)
+
+class Simulation:
+    """Drive one PergolaServer through a trace on a virtual clock and record its decisions"""
+
+    def __init__(self, samples, mode="auto", night_threshold=None, scripted=None, speed=0.0):
+        self.samples = samples
+        self.clock = VirtualClock(samples[0][0])
+        self.speed = speed  # Virtual seconds per real second, 0 for as fast as possible
+
+        self.server = PergolaServer()
+        self.server.set_clock(self.clock.time, self.clock.monotonic)
+        self.server.load_location()
+        self.server.current_mode = mode
+        if night_threshold is not None:
+            self.server.night_threshold = night_threshold
+        self.port = SimulatedPort()
+        self.recorder = CommandRecorder(self.clock)
+        self.server.arduino = self.port
+        self.server.serial_writer = self.recorder
+
+        self.scripted = sorted(self.resolve_events(scripted or []), key=lambda event: event[0])
+        self.events = []
+        self.seconds = {"auto": 0.0, "manual": 0.0, "off": 0.0, "night": 0.0, "ldr": 0.0, "astronomical": 0.0}
+        self.servo_travel = 0
+
+    def resolve_events(self, scripted):
+        """Scripted events with "at" as local HH:MM on the first day of the trace or a timestamp"""
+        import pytz
+        first = datetime.fromtimestamp(self.samples[0][0], pytz.timezone(self.server.location.timezone))
+        midnight = local_midnight(self.server.location, first.date())
+        for event in scripted:
+            at = event.get("at")
+            if isinstance(at, str) and ":" in at and len(at) <= 8:
+                hours, minutes = at.split(":")[:2]
+                at = midnight + int(hours) * 3600 + int(minutes) * 60
+            else:
+                at = parse_timestamp(str(at))
+            yield at, {key: value for key, value in event.items() if key != "at"}
+
+    def record(self, kind, **fields):
+        self.events.append({"t": round(self.clock.time(), 3), "type": kind, **fields})
+
+    def ensure_sun_path(self, timestamp):
+        """Install the sun path for the day of timestamp synchronously (no worker thread here)"""
+        ephemeris = self.server.sun_ephemeris
+        if ephemeris.position(timestamp) is None:
+            ephemeris.install(SolarEphemeris.compute_day(self.server.location, timestamp, ephemeris.resolution))
+
+    def echo_servos(self, handled):
+        """Report new servo commands back as SERVO_POS, as if the servos moved instantly"""
+        for timestamp, command in self.recorder.commands[handled:]:
+            if not command.startswith("SERVOS:"):
+                continue
+            vector = [int(v) for v in command[7:].split(",")]
+            previous = self.server.servo_positions
+            self.servo_travel += sum(abs(a - b) for a, b in zip(vector, previous))
+            self.record("servo", servos=vector)
+            self.port.feed("SERVO_POS:" + ",".join(str(v) for v in vector))
+        return len(self.recorder.commands)
+
+    async def apply(self, command):
+        """Run a scripted client command through process_message"""
+        self.record("command", **command)
+        await self.server.process_message(None, json.dumps(command))
+        # Stand in for the angle scheduler's next tick
+        if self.server.angle_scheduler.servo_pending:
+            self.server.angle_scheduler.servo_pending = False
+            self.server.update_manual_control()
+
+    async def run(self):
+        server = self.server
+        handled = 0
+        state = (server.current_mode, server.night_mode_active)
+        tracking = server.tracking_mode
+        scripted = list(self.scripted)
+        previous_time = self.samples[0][0]
+        real_start = time.perf_counter()
+
+        for timestamp, values in self.samples:
+            # Time in each mode and tracking mode, attributed to the state before this sample
+            elapsed = timestamp - previous_time
+            self.seconds["night" if server.night_mode_active else server.current_mode] += elapsed
+            if server.current_mode == "auto" and not server.night_mode_active:
+                self.seconds[server.tracking_mode] += elapsed
+            previous_time = timestamp
+
+            self.clock.advance_to(timestamp)
+            self.ensure_sun_path(timestamp)
+            while scripted and scripted[0][0] <= timestamp:
+                await self.apply(scripted.pop(0)[1])
+
+            self.port.feed("LDR:" + ",".join(str(v) for v in values))
+            server.read_sensors()
+            if len(self.recorder.commands) > handled:
+                handled = self.echo_servos(handled)
+                server.read_sensors()
+
+            if (server.current_mode, server.night_mode_active) != state:
+                state = (server.current_mode, server.night_mode_active)
+                self.record("mode", mode=server.current_mode, night=server.night_mode_active,
+                            lux=server.light_sensor_lux)
+            if server.tracking_mode != tracking:
+                tracking = server.tracking_mode
+                self.record("tracking", trackingMode=tracking)
+
+            if self.speed:
+                ahead = (timestamp - self.samples[0][0]) / self.speed - (time.perf_counter() - real_start)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+
+        self.port.close()
+        return time.perf_counter() - real_start
+
+    def summary(self, wall_seconds):
+        events = self.events
+        simulated = self.samples[-1][0] - self.samples[0][0]
+        digest = hashlib.sha256(json.dumps(events, sort_keys=True).encode()).hexdigest()
+        import pytz
+        tz = pytz.timezone(self.server.location.timezone)
+        return {
+            "start": datetime.fromtimestamp(self.samples[0][0], tz).isoformat(),
+            "end": datetime.fromtimestamp(self.samples[-1][0], tz).isoformat(),
+            "samples": len(self.samples),
+            "simulatedSeconds": round(simulated, 1),
+            "wallSeconds": round(wall_seconds, 3),
+            "speedup": round(simulated / wall_seconds) if wall_seconds else None,
+            "servoCommands": sum(1 for e in events if e["type"] == "servo"),
+            "servoTravel": self.servo_travel,
+            "nightActivations": sum(1 for e in events if e["type"] == "mode" and e["night"]),
+            "modeChanges": sum(1 for e in events if e["type"] == "mode"),
+            "trackingSwitches": sum(1 for e in events if e["type"] == "tracking"),
+            "secondsByMode": {key: round(value, 1) for key, value in self.seconds.items()},
+            "ldrFilter": {key: value for key, value in self.server.ldr_filter.stats().items()
+                          if key in ("samples", "changes", "rejected", "suppressed")},
+            "servoCache": {key: value for key, value in self.server.servo_cache.stats().items()
+                           if key in ("sent", "duplicates", "withinDeadband", "resent")},
+            "digest": digest
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Time-accelerated replay of the tracking engine")
+    parser.add_argument("--trace", help="CSV (timestamp,front,right,back,left) or HISTORY JSON; default synthetic")
+    parser.add_argument("--date", type=date.fromisoformat, default=date.today(),
+                        help="Day for the synthetic trace (YYYY-MM-DD)")
+    parser.add_argument("--days", type=int, default=1, help="Consecutive synthetic days")
+    parser.add_argument("--clouds", type=int, default=0, help="Cloud passages per synthetic day")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for synthetic clouds and noise")
+    parser.add_argument("--period", type=float, default=SAMPLE_PERIOD, help="Seconds between synthetic samples")
+    parser.add_argument("--mode", choices=["auto", "manual", "off"], default="auto", help="Starting mode")
+    parser.add_argument("--night-threshold", type=int, help="Override the night mode lux threshold")
+    parser.add_argument("--events", help="JSON list of scripted client commands with an \"at\" time")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="Virtual seconds per real second (e.g. 1000); 0 runs as fast as possible")
+    parser.add_argument("--output", help="Write the summary and every event as JSON here")
+    parser.add_argument("--expect-digest", help="Exit with status 1 unless the event digest matches")
+    parser.add_argument("--verbose", action="store_true", help="Print every server log line (debug)")
+    args = parser.parse_args()
+
+    if args.verbose:
+        setup_logging("debug", rate_limit=0)
+    if args.trace:
+        samples = load_trace(args.trace)
+    else:
+        location = PergolaServer().load_location()
+        samples = []
+        for offset in range(args.days):
+            samples += synthetic_trace(location, args.date + timedelta(days=offset), args.period,
+                                       args.clouds, args.seed + offset)
+    if not samples:
+        parser.error("the trace has no samples")
+
+    simulation = Simulation(samples, args.mode, args.night_threshold,
+                            load_events(args.events) if args.events else None, args.speed)
+    wall_seconds = asyncio.run(simulation.run())
+
+    summary = simulation.summary(wall_seconds)
+    print(f"🌞 Simulated {summary['start']} → {summary['end']} ({summary['samples']} samples) "
+          f"in {summary['wallSeconds']:.1f}s ({summary['speedup']}× real time)")
+    print(f"   {summary['servoCommands']} servo commands, {summary['servoTravel']}° travel, "
+          f"{summary['nightActivations']} night activations, {summary['trackingSwitches']} tracking switches")
+    print("   Time by mode: " + ", ".join(f"{key} {value / 3600:.1f}h"
+                                           for key, value in summary["secondsByMode"].items() if value))
+    print(f"   Digest {summary['digest']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "events": simulation.events}, f, indent=1)
+    if args.expect_digest and args.expect_digest != summary["digest"]:
+        print(f"❌ Control decisions changed: expected digest {args.expect_digest}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
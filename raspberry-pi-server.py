@@ -12,7 +12,8 @@ from datetime import datetime
 from typing import Dict, Optional
 
 import websockets
-from pymodbus.client.sync import ModbusSerialClient as ModbusClient
+from pymodbus import FramerType
+from pymodbus.client import AsyncModbusSerialClient
 
 # Configure logging
 logging.basicConfig(
@@ -21,6 +22,20 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Holding register map (adjust addresses based on your Arduino code)
+SENSOR_REGISTER = 0    # 0: H angle x100, 1: V angle x100, 2: light sensor
+COMMAND_REGISTER = 10  # 10: H command x100, 11: V command x100, 12: mode
+MODE_MAP = {'off': 0, 'manual': 1, 'auto': 2}
+DEVICE_ID = 1
+
+def to_register(value: float) -> int:
+    """Scale an angle by 100 into a 16-bit two's complement register"""
+    return int(value * 100) & 0xFFFF
+
+def from_register(raw: int) -> float:
+    """Inverse of to_register"""
+    return (raw - 0x10000 if raw & 0x8000 else raw) / 100.0
+
 class PergolaController:
     def __init__(self, serial_port='/dev/ttyUSB0', baudrate=9600):
         self.serial_port = serial_port
@@ -36,12 +51,27 @@ class PergolaController:
         }
         self.connected_clients = set()
         
+        # Single owner of the RTU line: commands are coalesced, reads are shared
+        self.io_wakeup = asyncio.Event()
+        self.io_task = None
+        self.commanded = {'horizontal': 0.0, 'vertical': 0.0}
+        self.pending_write = False
+        self.write_waiters = []
+        self.read_waiters = []
+        self.sensor_poll_interval = 0.5  # Seconds between sensor reads when nobody asks for one
+        
+        # Change-driven broadcasting
+        self.state_changed = asyncio.Event()
+        self.broadcast_max_rate = 5.0  # Pushes per second at most
+        self.heartbeat_interval = 10.0  # Seconds between pushes when nothing changes
+        
     async def initialize_modbus(self):
         """Initialize Modbus-RTU connection to Arduino"""
+        self.io_task = asyncio.create_task(self.modbus_io_loop())
         try:
-            self.modbus_client = ModbusClient(
-                method='rtu',
+            self.modbus_client = AsyncModbusSerialClient(
                 port=self.serial_port,
+                framer=FramerType.RTU,
                 baudrate=self.baudrate,
                 timeout=1,
                 parity='N',
@@ -49,7 +79,7 @@ class PergolaController:
                 bytesize=8
             )
             
-            if self.modbus_client.connect():
+            if await self.modbus_client.connect():
                 logger.info(f"Modbus connected on {self.serial_port}")
                 return True
             else:
@@ -59,30 +89,70 @@ class PergolaController:
             logger.error(f"Modbus initialization error: {e}")
             return False
     
-    def read_sensors(self) -> Dict:
-        """Read sensor data from Arduino via Modbus"""
-        if not self.modbus_client or not self.modbus_client.is_socket_open():
+    def modbus_connected(self) -> bool:
+        """True when the async Modbus client has an open serial line"""
+        return bool(self.modbus_client and self.modbus_client.connected)
+    
+    async def modbus_io_loop(self):
+        """Run every Modbus transaction: pending command block first, then one read for all waiters
+
+        Sensors are also polled every sensor_poll_interval, so the broadcast engine
+        sees manual and light changes as they happen rather than on the next request.
+        """
+        loop = asyncio.get_running_loop()
+        next_poll = loop.time()
+        while True:
+            poll_due = self.modbus_connected() and loop.time() >= next_poll
+            if not self.pending_write and not self.read_waiters and not poll_due:
+                self.io_wakeup.clear()
+                # Disconnected: only look again after a full interval
+                timeout = max(0.0, next_poll - loop.time()) if self.modbus_connected() else self.sensor_poll_interval
+                try:
+                    await asyncio.wait_for(self.io_wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            if self.pending_write:
+                # Latest command wins: one transaction carries H, V and mode
+                self.pending_write = False
+                waiters, self.write_waiters = self.write_waiters, []
+                success = await self._write_command_block()
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(success)
+            
+            if self.read_waiters or poll_due:
+                waiters, self.read_waiters = self.read_waiters, []
+                state = await self._read_sensor_block()
+                next_poll = loop.time() + self.sensor_poll_interval
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(state)
+    
+    async def _read_sensor_block(self) -> Dict:
+        """Read registers 0-2 in one transaction (I/O loop only)"""
+        if not self.modbus_connected():
             return self.current_state
         
         try:
-            # Read holding registers (adjust addresses based on your Arduino code)
-            # Register 0: Horizontal angle (scaled by 100)
-            # Register 1: Vertical angle (scaled by 100)  
-            # Register 2: Light sensor reading
-            result = self.modbus_client.read_holding_registers(0, 3, unit=1)
+            result = await self.modbus_client.read_holding_registers(
+                SENSOR_REGISTER, count=3, device_id=DEVICE_ID)
             
             if result.isError():
                 logger.error("Modbus read error")
                 return self.current_state
             
             # Update current state
-            self.current_state.update({
-                'horizontal_angle': result.registers[0] / 100.0,
-                'vertical_angle': result.registers[1] / 100.0,
+            new_values = {
+                'horizontal_angle': from_register(result.registers[0]),
+                'vertical_angle': from_register(result.registers[1]),
                 'light_sensor': result.registers[2],
                 'night_mode': result.registers[2] < 50,  # Night if light < 50
-                'timestamp': datetime.now().isoformat()
-            })
+            }
+            if any(self.current_state[key] != value for key, value in new_values.items()):
+                self.state_changed.set()
+            self.current_state.update(new_values, timestamp=datetime.now().isoformat())
             
             return self.current_state
             
@@ -90,53 +160,73 @@ class PergolaController:
             logger.error(f"Sensor read error: {e}")
             return self.current_state
     
-    def write_actuator_commands(self, horizontal: float, vertical: float) -> bool:
-        """Send actuator commands to Arduino via Modbus"""
-        if not self.modbus_client or not self.modbus_client.is_socket_open():
+    async def _write_command_block(self) -> bool:
+        """Write H, V and mode to registers 10-12 in one transaction (I/O loop only)"""
+        if not self.modbus_connected():
             logger.error("Modbus not connected")
             return False
         
+        horizontal = self.commanded['horizontal']
+        vertical = self.commanded['vertical']
         try:
-            # Convert to integer values (scaled by 100)
-            h_scaled = int(horizontal * 100)
-            v_scaled = int(vertical * 100)
-            
-            # Write to holding registers (adjust addresses based on your Arduino code)
-            # Register 10: Horizontal command
-            # Register 11: Vertical command
-            result1 = self.modbus_client.write_register(10, h_scaled, unit=1)
-            result2 = self.modbus_client.write_register(11, v_scaled, unit=1)
+            result = await self.modbus_client.write_registers(
+                COMMAND_REGISTER,
+                [to_register(horizontal), to_register(vertical), MODE_MAP[self.current_mode]],
+                device_id=DEVICE_ID)
             
-            if result1.isError() or result2.isError():
+            if result.isError():
                 logger.error("Modbus write error")
                 return False
             
-            logger.info(f"Commands sent: H={horizontal}°, V={vertical}°")
+            logger.info(f"Commands sent: H={horizontal}°, V={vertical}°, mode={self.current_mode}")
             return True
             
         except Exception as e:
             logger.error(f"Actuator command error: {e}")
             return False
     
-    def set_mode(self, mode: str) -> bool:
+    async def _queue_write(self) -> bool:
+        """Ask the I/O loop to write the command block and wait for the result"""
+        if self.io_task is None:
+            logger.error("Modbus not connected")
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self.write_waiters.append(waiter)
+        self.pending_write = True
+        self.io_wakeup.set()
+        return await waiter
+    
+    async def read_sensors(self) -> Dict:
+        """Read sensor data from Arduino via Modbus (concurrent callers share one read)"""
+        if not self.modbus_connected() or self.io_task is None:
+            return self.current_state
+        
+        waiter = asyncio.get_running_loop().create_future()
+        self.read_waiters.append(waiter)
+        self.io_wakeup.set()
+        return await waiter
+    
+    async def write_actuator_commands(self, horizontal: float, vertical: float) -> bool:
+        """Send actuator commands to Arduino via Modbus"""
+        self.commanded['horizontal'] = horizontal
+        self.commanded['vertical'] = vertical
+        return await self._queue_write()
+    
+    async def set_mode(self, mode: str) -> bool:
         """Set pergola control mode"""
-        if mode not in ['auto', 'manual', 'off']:
+        if mode not in MODE_MAP:
             logger.error(f"Invalid mode: {mode}")
             return False
         
+        if mode != self.current_mode:
+            self.state_changed.set()
         self.current_mode = mode
         logger.info(f"Mode changed to: {mode}")
         
-        # Send mode to Arduino via Modbus
-        mode_map = {'off': 0, 'manual': 1, 'auto': 2}
-        if self.modbus_client and self.modbus_client.is_socket_open():
-            try:
-                result = self.modbus_client.write_register(20, mode_map[mode], unit=1)
-                if result.isError():
-                    logger.error("Failed to write mode to Arduino")
-                    return False
-            except Exception as e:
-                logger.error(f"Mode write error: {e}")
+        # Send mode to Arduino via Modbus (with the last commanded angles)
+        if self.modbus_connected():
+            if not await self._queue_write():
+                logger.error("Failed to write mode to Arduino")
                 return False
         
         return True
@@ -146,7 +236,7 @@ class PergolaController:
         while self.current_mode == 'auto':
             try:
                 # Read current sensor data
-                state = self.read_sensors()
+                state = await self.read_sensors()
                 light_reading = state['light_sensor']
                 
                 # Simple sun tracking algorithm (replace with your logic)
@@ -162,9 +252,9 @@ class PergolaController:
                     horizontal = max(-40, min(40, hour_angle / 3))  # Scale to -40/+40 range
                     vertical = max(-40, min(40, elevation / 3))  # Scale to -40/+40 range
                     
-                    self.write_actuator_commands(horizontal, vertical)
+                    await self.write_actuator_commands(horizontal, vertical)
                 else:  # Night mode - flat horizontal position
-                    self.write_actuator_commands(0, 0)
+                    await self.write_actuator_commands(0, 0)
                 
                 # Broadcast state to connected clients
                 await self.broadcast_state()
@@ -203,6 +293,24 @@ class PergolaController:
         for client in disconnected:
             self.connected_clients.discard(client)
     
+    async def broadcast_engine(self):
+        """Broadcast when state changes, at a capped rate, with a heartbeat when idle"""
+        loop = asyncio.get_running_loop()
+        last_push = 0.0
+        while True:
+            try:
+                await asyncio.wait_for(self.state_changed.wait(), timeout=self.heartbeat_interval)
+            except asyncio.TimeoutError:
+                pass  # Heartbeat
+            
+            delay = last_push + 1.0 / self.broadcast_max_rate - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            
+            self.state_changed.clear()
+            last_push = loop.time()
+            await self.broadcast_state()
+    
     async def handle_websocket_message(self, websocket, message_str: str):
         """Handle incoming WebSocket messages from mobile app"""
         try:
@@ -211,7 +319,7 @@ class PergolaController:
             
             if cmd == 'MODE':
                 mode = message.get('mode')
-                success = self.set_mode(mode)
+                success = await self.set_mode(mode)
                 
                 # Start/stop auto tracking
                 if mode == 'auto' and success:
@@ -227,7 +335,7 @@ class PergolaController:
                 horizontal = message.get('horiz', 0)
                 vertical = message.get('vert', 0)
                 
-                success = self.write_actuator_commands(horizontal, vertical)
+                success = await self.write_actuator_commands(horizontal, vertical)
                 response = {
                     'type': 'COMMAND_RESPONSE',
                     'success': success,
@@ -239,14 +347,14 @@ class PergolaController:
                 horizontal = message.get('horiz', 0)
                 vertical = message.get('vert', 0)
                 
-                success = self.write_actuator_commands(horizontal, vertical)
+                success = await self.write_actuator_commands(horizontal, vertical)
                 response = {
                     'type': 'STATE_RESPONSE',
                     'success': success
                 }
                 
             elif cmd == 'GET_STATE':
-                state = self.read_sensors()
+                state = await self.read_sensors()
                 response = {
                     'type': 'STATE_UPDATE',
                     'mode': self.current_mode,
@@ -287,7 +395,7 @@ class PergolaController:
             initial_state = {
                 'type': 'CONNECTED',
                 'mode': self.current_mode,
-                **self.read_sensors()
+                **(await self.read_sensors())
             }
             await websocket.send(json.dumps(initial_state))
             
@@ -322,13 +430,8 @@ async def main():
         server_port
     )
     
-    # Start periodic state broadcasting
-    async def periodic_broadcast():
-        while True:
-            await controller.broadcast_state()
-            await asyncio.sleep(1)  # Broadcast every second
-    
-    asyncio.create_task(periodic_broadcast())
+    # Broadcast state changes as they happen (heartbeat when idle)
+    asyncio.create_task(controller.broadcast_engine())
     
     # Keep server running
     await server.wait_closed()
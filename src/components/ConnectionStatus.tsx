@@ -2,13 +2,21 @@ import React from 'react';
 import { View, Text, StyleSheet, TouchableOpacity } from 'react-native';
 import { getConnectionStatusColor } from '../utils';
 import { webSocketService } from '../services/websocket';
+import { ArduinoLinkState } from '../types';
 
 interface ConnectionStatusProps {
   status: 'connected' | 'connecting' | 'disconnected';
+  arduinoLink?: ArduinoLinkState | null;
 }
 
-const ConnectionStatus: React.FC<ConnectionStatusProps> = ({ status }) => {
+const ConnectionStatus: React.FC<ConnectionStatusProps> = ({ status, arduinoLink }) => {
+  // Connected to the Pi but not to the pergola: show the Arduino link instead
+  const arduinoDown = status === 'connected' && !!arduinoLink && arduinoLink !== 'connected';
+
   const getStatusText = () => {
+    if (arduinoDown) {
+      return arduinoLink === 'connecting' ? 'Pergola reconnecting...' : 'Pergola offline';
+    }
     switch (status) {
       case 'connected':
         return 'Connected';
@@ -21,7 +29,7 @@ const ConnectionStatus: React.FC<ConnectionStatusProps> = ({ status }) => {
     }
   };
 
-  const statusColor = getConnectionStatusColor(status);
+  const statusColor = getConnectionStatusColor(arduinoDown ? arduinoLink! : status);
 
   const handlePress = () => {
     console.log('Connection status pressed - manual refresh triggered');
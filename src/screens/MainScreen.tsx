@@ -25,7 +25,7 @@ const MainScreen: React.FC = () => {
   const insets = useSafeAreaInsets();
   const signOutDialogShowing = useRef(false);
   const { user } = useAppSelector((state) => state.auth);
-  const { currentMode, nightMode, connectionStatus, userHasToggledMode } = useAppSelector(
+  const { currentMode, nightMode, connectionStatus, arduinoLink, userHasToggledMode } = useAppSelector(
     (state) => state.pergola
   );
 
@@ -94,7 +94,7 @@ const MainScreen: React.FC = () => {
           <Text style={styles.subtitle}>Welcome, {user?.email}</Text>
         </View>
         <View style={styles.headerRight}>
-          <ConnectionStatus status={connectionStatus} />
+          <ConnectionStatus status={connectionStatus} arduinoLink={arduinoLink} />
           <TouchableOpacity style={styles.signOutButton} onPress={handleSignOut}>
             <Text style={styles.signOutText}>Sign Out</Text>
           </TouchableOpacity>
@@ -10,6 +10,7 @@ import {
   updateState, 
   setNightMode, 
   setConnectionStatus, 
+  setArduinoLink,
   setError as setPergolaError,
   setMode,
   setModeFromPi,
@@ -327,6 +328,11 @@ class WebSocketService {
       store.dispatch(setNightMode(response.night_mode));
     }
 
+    // Pi reachable but its Arduino may not be (unplugged, resetting)
+    if (response.arduino) {
+      store.dispatch(setArduinoLink(response.arduino.link));
+    }
+
     if (response.status === 'mode_changed') {
       store.dispatch(setPergolaError(null)); // Clear any previous errors
     }
@@ -1,11 +1,12 @@
 import { createSlice, PayloadAction } from '@reduxjs/toolkit';
-import { PergolaState, PergolaMode, NightModeStatus } from '../../types';
+import { PergolaState, PergolaMode, NightModeStatus, ArduinoLinkState } from '../../types';
 
 interface PergolaSliceState {
   currentMode: PergolaMode;
   state: PergolaState;
   nightMode: NightModeStatus;
   connectionStatus: 'connected' | 'connecting' | 'disconnected';
+  arduinoLink: ArduinoLinkState | null; // Pi <-> Arduino link, null until the Pi reports it
   error: string | null;
   isLoading: boolean;
   angleHistory: Array<{
@@ -35,6 +36,7 @@ const initialState: PergolaSliceState = {
     active: false,
   },
   connectionStatus: 'disconnected',
+  arduinoLink: null,
   error: null,
   isLoading: false,
   angleHistory: [],
@@ -80,6 +82,9 @@ const pergolaSlice = createSlice({
     setConnectionStatus: (state: PergolaSliceState, action: PayloadAction<'connected' | 'connecting' | 'disconnected'>) => {
       state.connectionStatus = action.payload;
     },
+    setArduinoLink: (state: PergolaSliceState, action: PayloadAction<ArduinoLinkState | null>) => {
+      state.arduinoLink = action.payload;
+    },
     setError: (state: PergolaSliceState, action: PayloadAction<string | null>) => {
       state.error = action.payload;
     },
@@ -138,6 +143,9 @@ const pergolaSlice = createSlice({
         // Keep userHasToggledMode as false - no mode has been explicitly chosen by user
       }
       
+      // Link state is unknown until the Pi reports it again
+      state.arduinoLink = null;
+      
       // Clear any errors
       state.error = null;
     },
@@ -172,6 +180,7 @@ export const {
   updateState,
   setNightMode,
   setConnectionStatus,
+  setArduinoLink,
   setError,
   setLoading,
   clearAngleHistory,
@@ -12,6 +12,9 @@ export interface NightModeStatus {
 
 export type PergolaMode = 'auto' | 'manual' | 'off';
 
+// Serial link between the Pi and the Arduino, as reported by the Pi
+export type ArduinoLinkState = 'connected' | 'connecting' | 'disconnected';
+
 export interface WebSocketMessage {
   cmd: 'MODE' | 'SET_ANGLES' | 'SET_STATE' | 'GET_STATE' | 'GET_MODE' | 'GET_DASHBOARD_DATA';
   mode?: PergolaMode;
@@ -24,6 +27,10 @@ export interface WebSocketResponse {
   data?: PergolaState;
   mode?: PergolaMode;
   night_mode?: NightModeStatus;
+  arduino?: {
+    link: ArduinoLinkState;
+    port?: string | null;
+  };
   error?: string;
 }
 
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Unit tests for pergola_logging: rate limiting, sampling, JSON lines and the
+non-blocking queue
+
+    python -m pytest -q test_pergola_logging.py
+"""
+
+import io
+import json
+import logging
+import queue
+
+import pytest
+
+import pergola_logging
+from pergola_logging import (DroppingQueueHandler, JsonFormatter, RateLimitFilter, SampleFilter, parse_levels,
+                             setup_logging, stop_logging)
+
+def make_record(msg, *args, level=logging.DEBUG, name="pergola.sensors", **extra):
+    record = logging.LogRecord(name, level, __file__, 1, msg, args or None, None)
+    record.__dict__.update(extra)
+    return record
+
+def test_rate_limit_counts_repeats(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(pergola_logging.time, "monotonic", lambda: now[0])
+    limiter = RateLimitFilter(interval=10.0)
+    assert limiter.filter(make_record("link lost: %s", "timeout"))
+    for _ in range(3):
+        now[0] += 1.0
+        assert not limiter.filter(make_record("link lost: %s", "timeout"))
+    # Another message or another logger is not a repeat
+    assert limiter.filter(make_record("link lost: %s", "EOF"))
+    assert limiter.filter(make_record("link lost: %s", "timeout", name="pergola.serial"))
+    now[0] += 10.0
+    record = make_record("link lost: %s", "timeout")
+    assert limiter.filter(record)
+    assert record.getMessage() == "link lost: timeout (3 repeats suppressed)"
+    assert limiter.suppressed == 3
+
+def test_rate_limit_forgets_old_keys(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(pergola_logging.time, "monotonic", lambda: now[0])
+    limiter = RateLimitFilter(interval=1.0, max_keys=2)
+    for i in range(2):
+        limiter.filter(make_record(f"message {i}"))
+    now[0] += 5.0
+    limiter.filter(make_record("message 2"))
+    assert list(limiter.seen) == [("pergola.sensors", logging.DEBUG, "message 2")]
+    assert RateLimitFilter(interval=0).filter(make_record("x")) and RateLimitFilter(interval=0).seen == {}
+
+def test_sample_keeps_one_in_n_debug_records():
+    sampler = SampleFilter(3)
+    kept = [sampler.filter(make_record("LDRs: %s", i)) for i in range(7)]
+    assert kept == [True, False, False, True, False, False, True]
+    # Other templates are counted separately; higher levels always pass
+    assert sampler.filter(make_record("servos: %s", 1))
+    assert all(sampler.filter(make_record("LDRs: %s", i, level=logging.INFO)) for i in range(3))
+
+def test_json_formatter_includes_extra_fields():
+    record = make_record("mode %s", "auto", level=logging.INFO, name="pergola.server", device="ttyACM0")
+    record.created = 0.25
+    document = json.loads(JsonFormatter().format(record))
+    assert document == {"ts": "1970-01-01T00:00:00.250+00:00", "level": "info", "logger": "pergola.server",
+                        "msg": "mode auto", "device": "ttyACM0"}
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = DroppingQueueHandler(queue.Queue(2))
+    for i in range(5):
+        handler.handle(make_record("sample %s", i, level=logging.INFO))
+    assert handler.queue.qsize() == 2 and handler.dropped == 3
+
+def test_parse_levels():
+    assert parse_levels(" serial=debug, tracking=info,,") == {"serial": "debug", "tracking": "info"}
+    assert parse_levels(None) == {}
+
+@pytest.fixture
+def pergola_logger():
+    root = logging.getLogger("pergola")
+    yield root
+    stop_logging()
+    root.handlers[:] = []
+    root.propagate = True
+    root.setLevel(logging.NOTSET)
+    for subsystem in ("serial", "sensors", "tracking"):
+        logger = logging.getLogger(f"pergola.{subsystem}")
+        logger.setLevel(logging.NOTSET)
+        logger.filters[:] = []
+
+def test_setup_routes_through_writer_thread(pergola_logger):
+    stream = io.StringIO()
+    setup_logging("warning", {"serial": "debug"}, fmt="json", sample=2, stream=stream)
+    logging.getLogger("pergola.serial").debug("sent %s", "SERVOS")
+    logging.getLogger("pergola.tracking").info("below the default level")
+    for i in range(4):
+        logging.getLogger("pergola.sensors").warning("LDR %s", i)
+    stop_logging()
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [(line["logger"], line["msg"]) for line in lines] == [
+        ("pergola.serial", "sent SERVOS"),
+        *[("pergola.sensors", f"LDR {i}") for i in range(4)]]
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Unit tests for pergola_metrics: histogram buckets, text rendering, timed()
+and the /metrics endpoint
+
+    python -m pytest -q test_pergola_metrics.py
+"""
+
+import asyncio
+
+import pytest
+
+from pergola_metrics import METRICS, MetricsRegistry, handle_metrics_request, timed
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    family = registry.histogram("stage_seconds", "Time per stage", ("stage",), buckets=(0.001, 0.01, 0.1))
+    child = family.labels("parse")
+    for value in (0.0005, 0.001, 0.005, 0.05, 3.0):
+        child.observe(value)
+    lines = family.render()
+    assert lines[:2] == ["# HELP stage_seconds Time per stage", "# TYPE stage_seconds histogram"]
+    # Bounds are inclusive: 0.001 falls in le="0.001"
+    assert lines[2:6] == ['stage_seconds_bucket{stage="parse",le="0.001"} 2',
+                          'stage_seconds_bucket{stage="parse",le="0.01"} 3',
+                          'stage_seconds_bucket{stage="parse",le="0.1"} 4',
+                          'stage_seconds_bucket{stage="parse",le="+Inf"} 5']
+    assert lines[6] == f'stage_seconds_sum{{stage="parse"}} {0.0005 + 0.001 + 0.005 + 0.05 + 3.0!r}'
+    assert lines[7] == 'stage_seconds_count{stage="parse"} 5'
+
+def test_render_values_and_tracked_callbacks():
+    registry = MetricsRegistry()
+    registry.counter("sent_total", "Sent").labels().inc(3)
+    queue = [1, 2]
+    registry.gauge("depth", "Queue depth", ("device",)).labels("tty\"ACM0").track(lambda: len(queue))
+    registry.gauge("broken", "Raises when read").labels().track(lambda: 1 / 0)
+    # Families without children are left out
+    registry.counter("unused_total", "Never labelled")
+    queue.append(3)
+    text = registry.render()
+    assert "sent_total 3\n" in text
+    assert 'depth{device="tty\\"ACM0"} 3\n' in text
+    # A failing callback only drops its own sample
+    assert text.endswith("# TYPE broken gauge\n")
+    assert "unused_total" not in text
+
+def test_registering_twice_returns_the_same_family():
+    registry = MetricsRegistry()
+    family = registry.counter("events_total", "Events", ("kind",))
+    assert registry.counter("events_total", "Events", ("kind",)) is family
+    assert family.labels("a") is family.labels("a")
+    family.remove("a")
+    assert family.children == {}
+
+def test_timed_records_exceptions_too():
+    histogram = MetricsRegistry().histogram("call_seconds", "Calls").labels()
+
+    @timed(histogram)
+    def fail():
+        raise ValueError("boom")
+
+    @timed(histogram)
+    def succeed(value):
+        return value * 2
+
+    assert succeed(21) == 42
+    with pytest.raises(ValueError):
+        fail()
+    assert histogram.count == 2 and succeed.__name__ == "succeed"
+
+def http_request(request):
+    async def scenario():
+        server = await asyncio.start_server(handle_metrics_request, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(request)
+        response = await reader.read()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return response
+    return asyncio.run(scenario())
+
+def test_endpoint_serves_metrics_and_404s():
+    METRICS.counter("pergola_test_requests_total", "Test counter").labels().inc()
+    response = http_request(b"GET /metrics?x=1 HTTP/1.1\r\nHost: pi\r\n\r\n")
+    head, _, body = response.partition(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.0 200 OK") and b"version=0.0.4" in head
+    assert b"pergola_test_requests_total 1\n" in body
+    assert f"Content-Length: {len(body)}".encode() in head
+
+    assert http_request(b"GET / HTTP/1.1\r\n\r\n").startswith(b"HTTP/1.0 404 Not Found")
+    # HEAD gets the headers only
+    assert http_request(b"HEAD /metrics HTTP/1.1\r\n\r\n").endswith(b"\r\n\r\n")
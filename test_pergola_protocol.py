@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Unit tests for pergola_protocol: binary frames and ASCII line parsing
+
+    python -m pytest -q test_pergola_protocol.py
+"""
+
+import pytest
+
+from pergola_protocol import (FRAME_LDR, FRAME_SERVO_POS, FRAME_SERVOS, FrameDecoder, LineParser, crc8,
+                              encode_frame, encode_ldr, encode_servos, parse_ints)
+
+# Binary frames
+
+def test_frame_layout():
+    frame = encode_servos(90, 45, 135, 0)
+    assert frame[:2] == bytes((0xA5, FRAME_SERVOS)) and frame[2:6] == bytes((90, 45, 135, 0))
+    assert frame[6] == crc8(frame, 1, 6)
+    assert len(encode_ldr(1, 2, 3, 4)) == 8
+    # CRC-8/SMBUS check value
+    assert crc8(b"123456789") == 0xF4
+    assert encode_frame(FRAME_SERVOS, b"\x00\x00\x00\x00")[-1] == crc8(bytes((FRAME_SERVOS, 0, 0, 0, 0)))
+
+def test_frames_round_trip():
+    decoder = FrameDecoder()
+    data = encode_ldr(0, 1023, 512, 7) + encode_servos(90, 0, 180, 45, FRAME_SERVO_POS)
+    assert decoder.feed(data) == [(FRAME_LDR, (0, 1023, 512, 7)), (FRAME_SERVO_POS, (90, 0, 180, 45))]
+    assert decoder.stats() == {"frames": 2, "crcErrors": 0, "skippedBytes": 0}
+    assert not decoder.buffer
+
+def test_frames_split_across_reads():
+    decoder = FrameDecoder()
+    frames = []
+    for byte in encode_ldr(100, 200, 300, 400):
+        frames += decoder.feed(bytes([byte]))
+    assert frames == [(FRAME_LDR, (100, 200, 300, 400))]
+
+def test_frames_resync_after_crc_error():
+    decoder = FrameDecoder()
+    corrupted = bytearray(encode_servos(1, 2, 3, 4, FRAME_SERVO_POS))
+    corrupted[-1] ^= 0xFF
+    frames = decoder.feed(b"noise" + bytes(corrupted) + encode_servos(5, 6, 7, 8, FRAME_SERVO_POS))
+    assert frames == [(FRAME_SERVO_POS, (5, 6, 7, 8))]
+    assert decoder.crc_errors == 1
+    assert decoder.skipped_bytes == len(b"noise") + len(corrupted)
+
+def test_frames_ignore_unknown_type():
+    decoder = FrameDecoder()
+    assert decoder.feed(bytes([0xA5, 0x7F]) + encode_servos(1, 2, 3, 4)) == [(FRAME_SERVOS, (1, 2, 3, 4))]
+    assert decoder.skipped_bytes == 2
+
+# ASCII lines
+
+def make_parser(**kwargs):
+    lines = []
+    parser = LineParser({b"LDR:": lambda buffer, start, end: lines.append(("ldr", bytes(buffer[start:end])))},
+                        lambda buffer, start, end: lines.append(("other", bytes(buffer[start:end]))), **kwargs)
+    return parser, lines
+
+def test_lines_dispatch_on_prefix():
+    parser, lines = make_parser()
+    parser.feed(b"LDR:1,2,3,4\r\nREADY\n\n")
+    assert lines == [("ldr", b"1,2,3,4"), ("other", b"READY")]
+    assert parser.lines == 2
+
+def test_lines_keep_partial_line():
+    parser, lines = make_parser()
+    parser.feed(b"LDR:51")
+    assert lines == []
+    parser.feed(b"2,487\r")
+    parser.feed(b"\nLDR:")
+    assert lines == [("ldr", b"512,487")]
+    assert parser.buffer == b"LDR:"
+
+def test_lines_overflow_is_dropped():
+    parser, lines = make_parser(max_line=16)
+    parser.feed(b"x" * 40)
+    assert parser.overflows == 1
+    assert not parser.buffer
+    parser.feed(b"LDR:1,2,3,4\n")
+    assert lines == [("ldr", b"1,2,3,4")]
+
+def test_lines_stop_discards_rest_of_chunk():
+    parser = LineParser({b"PROTO_OK:": lambda buffer, start, end: True})
+    parser.feed(b"PROTO_OK:BIN1,115200\n\xa5\x01binary")
+    assert not parser.buffer
+
+def test_parse_ints():
+    assert parse_ints(bytearray(b"LDR:512,487,-3"), 4, 14) == [512, 487, -3]
+    with pytest.raises(ValueError):
+        parse_ints(b"1,x", 0, 3)
@@ -0,0 +1,870 @@
+#!/usr/bin/env python3
+"""
+Unit tests for pergola_server_complete: serial writer, scheduling, telemetry
+fan-out and link handling, driven without hardware
+
+    python -m pytest -q test_pergola_server.py
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+import pergola_server_complete
+from pergola_server_complete import (AngleScheduler, ClientSession, LdrFilter, PergolaFleet, PergolaServer,
+                                      SerialWriter, ServoCommandCache, SolarEphemeris, TelemetryHistory,
+                                      angles_to_servo_positions, compute_sun_path, probe_port,
+                                      sun_to_panel_angles)
+from pergola_protocol import FRAME_SERVO_POS, encode_ldr, encode_servos
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class FakePort:
+    """Serial port stand-in recording what is written"""
+
+    def __init__(self, fail=False):
+        self.written = []
+        self.fail = fail
+
+    def write(self, data):
+        if self.fail:
+            raise OSError("write failed")
+        self.written.append(data)
+
+# Serial writer
+
+def test_writer_sends_in_order():
+    async def scenario():
+        port = FakePort()
+        writer = SerialWriter()
+        writer.start(port)
+        writer.send("SERVOS:90,90,90,90")
+        writer.send_raw(b"\xa5\x11")
+        await asyncio.sleep(0.05)
+        writer.stop()
+        return port, writer
+
+    port, writer = asyncio.run(scenario())
+    assert port.written == [b"SERVOS:90,90,90,90\n", b"\xa5\x11"]
+    assert writer.sent == 2 and writer.dropped == 0
+
+def test_writer_drops_oldest_when_full():
+    writer = SerialWriter(max_queue=2)
+    for command in ("A", "B", "C"):
+        writer.send(command)
+    assert [data for data, _ in writer.queue] == [b"B\n", b"C\n"]
+    assert writer.dropped == 1 and writer.max_depth == 2
+
+def test_writer_reports_errors():
+    async def scenario():
+        errors = []
+        writer = SerialWriter()
+        writer.on_error = errors.append
+        writer.start(FakePort(fail=True))
+        writer.send("A")
+        await asyncio.sleep(0.05)
+        writer.stop()
+        return writer, errors
+
+    writer, errors = asyncio.run(scenario())
+    assert writer.errors == 1 and writer.sent == 0
+    assert [str(e) for e in errors] == ["write failed"]
+
+# Joystick scheduler
+
+class ManualServer:
+    """Just what AngleScheduler uses: manual mode, a servo cache and the command it sends"""
+
+    baudrate = 9600
+
+    def __init__(self, clock=None):
+        self.current_mode = "manual"
+        self.servo_cache = ServoCommandCache(clock=clock or FakeClock())
+        self.target = (90, 90, 90, 90)
+        self.sent = []
+
+    def update_manual_control(self):
+        if self.current_mode == "manual" and self.servo_cache.should_send(self.target):
+            self.sent.append(self.target)
+
+def test_scheduler_paces_to_the_sketch():
+    scheduler = AngleScheduler(ManualServer())
+    # One command per 500 ms sketch loop on ASCII, not the 42 ms the wire allows
+    assert scheduler.tick == AngleScheduler.ASCII_MIN_INTERVAL
+    scheduler.set_link(115200, binary=True)
+    assert scheduler.tick == AngleScheduler.BINARY_MIN_INTERVAL
+    scheduler.set_link(2400, binary=True)
+    assert scheduler.tick == 7 * 10 / 2400
+    scheduler.set_link(9600)
+    assert scheduler.tick == AngleScheduler.ASCII_MIN_INTERVAL
+    assert AngleScheduler(ManualServer(), tick=0.1).tick == 0.1
+
+def test_scheduler_coalesces_bursts():
+    async def scenario():
+        server = ManualServer()
+        scheduler = AngleScheduler(server, tick=0.05)
+        scheduler.start()
+        for i in range(20):
+            server.target = (90 + i * 2, 90, 90, 90)
+            scheduler.request()
+        await asyncio.sleep(0.02)
+        scheduler.stop()
+        return server, scheduler
+
+    server, scheduler = asyncio.run(scenario())
+    # The first request goes out at once and the rest wait for the tick, latest wins
+    assert server.sent == [(128, 90, 90, 90)]
+    assert scheduler.requested == 20 and scheduler.coalesced == 19
+
+def test_scheduler_emits_latest_after_tick():
+    async def scenario():
+        server = ManualServer()
+        scheduler = AngleScheduler(server, tick=0.03)
+        scheduler.start()
+        scheduler.request()
+        await asyncio.sleep(0.01)
+        for i in range(5):
+            server.target = (100 + i * 5, 90, 90, 90)
+            scheduler.request()
+        await asyncio.sleep(0.06)
+        scheduler.stop()
+        return server
+
+    assert asyncio.run(scenario()).sent == [(90, 90, 90, 90), (120, 90, 90, 90)]
+
+def test_scheduler_resends_lost_manual_target():
+    async def scenario():
+        clock = FakeClock()
+        server = ManualServer(clock)
+        scheduler = AngleScheduler(server, tick=0.01, recheck_interval=0.02)
+        server.target = (120, 90, 90, 90)
+        server.update_manual_control()
+        # The command never arrived: the servos report their old position
+        server.servo_cache.report((90, 90, 90, 90))
+        scheduler.start()
+        await asyncio.sleep(0.05)
+        assert server.sent == [(120, 90, 90, 90)]
+        clock.now += server.servo_cache.settle_time + 1
+        await asyncio.sleep(0.05)
+        scheduler.stop()
+        return server, scheduler
+
+    server, scheduler = asyncio.run(scenario())
+    assert server.sent == [(120, 90, 90, 90)] * 2
+    assert scheduler.rechecks == 1
+
+def test_scheduler_recheck_ignores_other_modes():
+    clock = FakeClock()
+    server = ManualServer(clock)
+    scheduler = AngleScheduler(server)
+    server.servo_cache.should_send((120, 90, 90, 90))
+    server.servo_cache.report((90, 90, 90, 90))
+    clock.now += 10
+    server.current_mode = "auto"
+    scheduler.recheck()
+    assert scheduler.rechecks == 0 and server.sent == []
+
+# Sun path
+
+BEIRUT = ("Beirut", "Lebanon", "Asia/Beirut", 33.8938, 35.5018)
+
+def angle_error(a, b):
+    """Difference between two angles in degrees, the short way round"""
+    return abs((a - b + 180) % 360 - 180)
+
+def test_ephemeris_matches_astral():
+    from astral import LocationInfo
+    from astral.sun import azimuth, elevation
+
+    location = LocationInfo(*BEIRUT)
+    ephemeris = SolarEphemeris(location, resolution=10)
+    day = datetime(2025, 6, 21, 12, tzinfo=timezone.utc).timestamp()
+    ephemeris.install(SolarEphemeris.compute_day(location, day, 10))
+    assert ephemeris.day_end - ephemeris.day_start == 86400
+
+    rng = random.Random(4)
+    start, end = int(ephemeris.day_start), int(ephemeris.day_end)
+    # Whole seconds, as astral truncates; includes the midnight azimuth wrap through north
+    for timestamp in [start + 3, end - 5] + [rng.randrange(start, end) for _ in range(300)]:
+        sun_elevation, sun_azimuth = ephemeris.position(timestamp)
+        when = datetime.fromtimestamp(timestamp, timezone.utc)
+        assert abs(sun_elevation - elevation(location.observer, when)) < 0.01
+        assert angle_error(sun_azimuth, azimuth(location.observer, when)) < 0.01
+
+def test_ephemeris_outside_day_is_none():
+    from astral import LocationInfo
+
+    location = LocationInfo(*BEIRUT)
+    ephemeris = SolarEphemeris(location)
+    assert ephemeris.position(time.time()) is None
+    ephemeris.install(SolarEphemeris.compute_day(location, 1750507200, 60))
+    assert ephemeris.position(ephemeris.day_end) is None
+    assert ephemeris.position(ephemeris.day_start) is not None
+
+def test_sun_path_matches_astral():
+    from astral import LocationInfo
+    from astral.sun import azimuth, elevation
+
+    sites = [LocationInfo(*BEIRUT), LocationInfo("Tromso", "Norway", "Europe/Oslo", 69.6492, 18.9553),
+             LocationInfo("Santiago", "Chile", "America/Santiago", -33.4489, -70.6693)]
+    rng = random.Random(5)
+    # Whole seconds across a year
+    timestamps = [rng.randrange(1735689600, 1767225600) for _ in range(200)]
+    path = compute_sun_path(timestamps, sites)
+    assert path["elevation"].shape == (3, 200) and path["servos"].shape == (3, 200, 4)
+
+    for s, site in enumerate(sites):
+        for t, timestamp in enumerate(timestamps):
+            when = datetime.fromtimestamp(timestamp, timezone.utc)
+            sun_elevation = elevation(site.observer, when)
+            sun_azimuth = azimuth(site.observer, when)
+            assert abs(path["elevation"][s, t] - sun_elevation) < 1e-9
+            assert angle_error(path["azimuth"][s, t], sun_azimuth) < 1e-9
+            expected = angles_to_servo_positions(*sun_to_panel_angles(sun_elevation, sun_azimuth))
+            assert tuple(path["servos"][s, t]) == expected
+
+def test_sun_path_accepts_datetime64():
+    import numpy as np
+    from astral import LocationInfo
+
+    site = LocationInfo(*BEIRUT)
+    seconds = [1750507200, 1750510800]
+    by_seconds = compute_sun_path(seconds, site)
+    by_datetime = compute_sun_path(np.array(seconds, dtype="datetime64[s]"), site)
+    assert (by_seconds["elevation"] == by_datetime["elevation"]).all()
+    assert by_seconds["elevation"].shape == (1, 2)
+
+# Status snapshots
+
+def make_server():
+    server = PergolaServer()
+    server.clock = FakeClock(1750507200.0)
+    return server
+
+def test_status_serialized_once_per_version():
+    server = make_server()
+    first = json.loads(server.status_message())
+    cached = server.status_cache
+    server.clock.now += 10
+    second = json.loads(server.status_message())
+    assert server.status_cache is cached
+    assert second["version"] == first["version"]
+    # Send time moves, the change time doesn't
+    assert second["changedAt"] == first["changedAt"]
+    assert second["timestamp"] != first["timestamp"]
+    assert second["timestamp"] == datetime.fromtimestamp(server.clock.now).isoformat()
+
+def test_status_rebuilt_on_change():
+    server = make_server()
+    before = json.loads(server.status_message())
+    server.clock.now += 5
+    server.current_mode = "manual"
+    server.touch_state()
+    after = json.loads(server.status_message())
+    assert after["version"] == before["version"] + 1
+    assert after["mode"] == "manual"
+    assert after["changedAt"] == after["timestamp"] == datetime.fromtimestamp(server.clock.now).isoformat()
+
+# Delta telemetry
+
+class FakeWebSocket:
+    remote_address = ("127.0.0.1", 50000)
+
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+
+    async def send(self, message):
+        self.sent.append(message)
+
+    async def close(self, code=1000, reason=""):
+        self.closed = (code, reason)
+
+def connect(server):
+    """A connected client whose queued frames can be inspected (sender task not started)"""
+    websocket = FakeWebSocket()
+    session = ClientSession(websocket)
+    server.clients[websocket] = session
+    return websocket, session
+
+def queued(session):
+    frames = [json.loads(message) for message, _, _ in session.queue]
+    session.queue.clear()
+    return frames
+
+def test_delta_subscription_and_resync():
+    async def scenario():
+        server = make_server()
+        websocket, session = connect(server)
+        await server.process_message(websocket, json.dumps({"cmd": "SUBSCRIBE", "delta": True}))
+        snapshot, = queued(session)
+        assert snapshot["type"] == "snapshot" and snapshot["seq"] == 1 and snapshot["mode"] == "auto"
+
+        server.ldr_readings = [100, 200, 300, 400]
+        server.touch_state()
+        await server.broadcast_status()
+        delta, = queued(session)
+        assert delta["type"] == "delta" and delta["seq"] == 2
+        assert delta["changes"] == {"data": {"ldrReadings": [100, 200, 300, 400]}}
+        assert delta["version"] == server.state_version
+
+        # Nothing changed: no frame, or a heartbeat when one is due
+        await server.broadcast_status()
+        assert queued(session) == []
+        await server.broadcast_status(heartbeat=True)
+        assert queued(session)[0]["type"] == "heartbeat"
+
+        await server.process_message(websocket, json.dumps({"cmd": "RESYNC"}))
+        resync, = queued(session)
+        assert resync["type"] == "snapshot" and resync["seq"] == 3
+        assert resync["data"]["ldrReadings"] == [100, 200, 300, 400]
+
+    asyncio.run(scenario())
+
+def test_full_status_without_subscription():
+    async def scenario():
+        server = make_server()
+        websocket, session = connect(server)
+        server.current_mode = "manual"
+        server.touch_state()
+        await server.broadcast_status()
+        status, = queued(session)
+        assert "type" not in status and status["mode"] == "manual"
+
+    asyncio.run(scenario())
+
+def test_status_changes_one_level_deep():
+    previous = {"mode": "auto", "data": {"a": 1, "b": 2}, "version": 1, "changedAt": "x"}
+    current = {"mode": "auto", "data": {"a": 1, "b": 3}, "version": 2, "changedAt": "y"}
+    assert PergolaServer.status_changes(previous, current) == {"data": {"b": 3}}
+
+# Per-client send queues
+
+def test_session_drops_oldest_telemetry():
+    session = ClientSession(FakeWebSocket(), max_queue=3)
+    session.send_reply("reply")
+    for i in range(4):
+        assert session.send_telemetry(f"t{i}")
+    assert [message for message, _, _ in session.queue] == ["reply", "t2", "t3"]
+    assert session.dropped == 2
+
+def test_session_never_drops_replies():
+    session = ClientSession(FakeWebSocket(), max_queue=2)
+    session.send_reply("r1")
+    session.send_reply("r2")
+    assert session.send_telemetry("t")
+    session.send_reply("r3")
+    assert [message for message, _, _ in session.queue] == ["r1", "r2", "r3"]
+    assert session.dropped == 1
+
+def test_session_delivers_in_order():
+    async def scenario():
+        websocket = FakeWebSocket()
+        session = ClientSession(websocket)
+        session.start()
+        session.send_telemetry("a")
+        session.send_reply("b")
+        await asyncio.sleep(0.01)
+        session.stop()
+        return websocket, session
+
+    websocket, session = asyncio.run(scenario())
+    assert websocket.sent == ["a", "b"] and session.sent == 2
+
+def test_lagging_client_is_evicted():
+    async def scenario():
+        server = make_server()
+        websocket, session = connect(server)
+        session.max_lag = 10.0
+        session.send_telemetry("old")
+        message, telemetry, _ = session.queue[0]
+        session.queue[0] = (message, telemetry, time.monotonic() - 11)
+        server.touch_state()
+        await server.broadcast_status()
+        await asyncio.sleep(0)
+        return server, websocket, session
+
+    server, websocket, session = asyncio.run(scenario())
+    assert session.evicted and not session.queue
+    assert websocket not in server.clients and server.clients_evicted == 1
+    assert websocket.closed == (1013, "Client too slow")
+    assert not session.send_telemetry("late")
+
+# Change-driven broadcasts
+
+def test_engine_pushes_changes_at_capped_rate():
+    async def scenario():
+        server = make_server()
+        server.broadcast_max_rate = 20
+        server.heartbeat_interval = 60
+        websocket, session = connect(server)
+        engine = asyncio.create_task(server.broadcast_engine())
+        await asyncio.sleep(0.01)
+        queued(session)
+        # A burst of changes folds into at most one push per 50 ms
+        for lux in range(10):
+            server.light_sensor_lux = lux
+            server.touch_state()
+            await asyncio.sleep(0.005)
+        await asyncio.sleep(0.1)
+        engine.cancel()
+        return server, queued(session)
+
+    server, frames = asyncio.run(scenario())
+    assert 1 <= len(frames) <= 3
+    assert frames[-1]["data"]["lightSensorReading"] == 9
+    assert server.broadcast_coalesced >= 7 and server.broadcast_heartbeats == 0
+
+def test_engine_sends_heartbeat_when_idle():
+    async def scenario():
+        server = make_server()
+        server.heartbeat_interval = 0.03
+        websocket, session = connect(server)
+        session.delta = True
+        engine = asyncio.create_task(server.broadcast_engine())
+        await asyncio.sleep(0.01)
+        await server.send_status(websocket)
+        queued(session)
+        await asyncio.sleep(0.05)
+        engine.cancel()
+        return server, queued(session)
+
+    server, frames = asyncio.run(scenario())
+    assert frames and {frame["type"] for frame in frames} == {"heartbeat"}
+    assert server.broadcast_heartbeats >= 1
+
+# Binary protocol
+
+class PipePort:
+    """Serial port stand-in: read_sensors() reads what feed() writes"""
+
+    def __init__(self, baudrate=9600):
+        self.baudrate = baudrate
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+        self.written = bytearray()
+
+    def fileno(self):
+        return self.read_fd
+
+    def feed(self, data):
+        os.write(self.write_fd, data)
+
+    def write(self, data):
+        self.written += data
+        return len(data)
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+def attach(server, binary=False):
+    port = PipePort()
+    server.arduino = port
+    server.binary_mode = binary
+    server.link_state = "connected"
+    return port
+
+def test_protocol_ack_switches_to_binary():
+    server = make_server()
+    port = attach(server)
+    port.feed(b"LDR:500,500,500,500\r\nPROTO_OK:BIN1,115200\r\n" + encode_ldr(1, 2, 3, 4))
+    server.read_sensors()
+    assert server.binary_mode and port.baudrate == 115200
+    assert server.angle_scheduler.tick == AngleScheduler.BINARY_MIN_INTERVAL
+    # Bytes after the ack were sent at the new baud rate and are discarded
+    assert server.ldr_filter.raw == [500, 500, 500, 500]
+
+    port.feed(encode_ldr(600, 600, 600, 600) + encode_servos(100, 90, 90, 80, FRAME_SERVO_POS))
+    server.read_sensors()
+    assert server.ldr_filter.raw == [600, 600, 600, 600]
+    assert server.servo_positions == [100, 90, 90, 80]
+
+def test_protocol_ack_rejects_other_versions():
+    server = make_server()
+    attach(server)
+    server.on_protocol_ack("BIN9,115200")
+    assert not server.binary_mode
+    assert server.angle_scheduler.tick == AngleScheduler.ASCII_MIN_INTERVAL
+
+def test_detach_falls_back_to_ascii():
+    server = make_server()
+    attach(server)
+    server.on_protocol_ack("BIN1,115200")
+    server.detach_arduino("test")
+    assert not server.binary_mode and server.arduino is None
+    assert server.angle_scheduler.tick == AngleScheduler.ASCII_MIN_INTERVAL
+    assert server.link_state == "disconnected" and server.link_losses == 1
+
+def test_servo_commands_use_active_protocol():
+    server = make_server()
+    attach(server)
+    server.send_servos(90, 91, 92, 93)
+    server.on_protocol_ack("BIN1,115200")
+    server.servo_cache.reset()
+    server.send_servos(90, 91, 92, 93)
+    assert [data for data, _ in server.serial_writer.queue] == [b"SERVOS:90,91,92,93\n",
+                                                                encode_servos(90, 91, 92, 93)]
+
+# Telemetry history
+
+def record_samples(history, start, seconds, period=0.5):
+    for i in range(int(seconds / period)):
+        timestamp = start + i * period
+        history.record(timestamp, [i] + [0] * (len(TelemetryHistory.FIELDS) - 1))
+
+def test_history_picks_raw_for_short_ranges():
+    history = TelemetryHistory(max_points=2000)
+    record_samples(history, 3600.0, 600)
+    reply = history.query(3600.0, 4200.0)
+    assert reply["resolution"] == "raw"
+    assert len(reply["t"]) == 1200
+    assert reply["series"]["lux"][:3] == [0.0, 1.0, 2.0]
+
+def test_history_falls_back_to_coarser_tier():
+    history = TelemetryHistory(max_points=100)
+    record_samples(history, 3600.0, 600)
+    reply = history.query(3600.0, 4200.0)
+    assert reply["resolution"] == "10s"
+    assert len(reply["t"]) == 60
+    # Bucket means: samples 0..19 average to 9.5
+    assert reply["series"]["lux"][0] == 9.5
+
+def test_history_skips_overwritten_tier():
+    history = TelemetryHistory(tiers={"raw": (0, 100), "10s": (10, 1000)})
+    record_samples(history, 0.0, 100)
+    assert history.rings["raw"].count == 100
+    assert history.query(0.0, 100.0)["resolution"] == "10s"
+    assert history.query(60.0, 100.0)["resolution"] == "raw"
+
+def test_history_explicit_resolution_decimates():
+    history = TelemetryHistory(max_points=50)
+    record_samples(history, 0.0, 100)
+    reply = history.query(0.0, 100.0, "raw")
+    assert reply["resolution"] == "raw"
+    assert len(reply["t"]) == 50
+
+def history_command(server, **request):
+    async def scenario():
+        websocket, session = connect(server)
+        await server.process_message(websocket, json.dumps({"cmd": "HISTORY", **request}))
+        reply, = queued(session)
+        return reply
+    return asyncio.run(scenario())
+
+def test_history_command_accepts_zero_bounds():
+    server = make_server()
+    record_samples(server.history, 0.0, 10)
+    reply = history_command(server, since=0, until=5, resolution="raw")
+    assert (reply["since"], reply["until"]) == (0.0, 5.0)
+    assert reply["t"][0] == 0.0 and reply["t"][-1] == 5.0
+    # Defaults: the last hour up to now
+    reply = history_command(server)
+    assert reply["until"] == server.clock.now and reply["since"] == server.clock.now - 3600
+
+def test_history_command_rejects_non_numeric_range():
+    server = make_server()
+    for request in ({"since": "yesterday"}, {"until": [1]}, {"seconds": "NaN"}):
+        reply = history_command(server, **request)
+        assert reply["type"] == "error" and reply["cmd"] == "HISTORY"
+
+# LDR filter
+
+def test_filter_passes_first_sample():
+    assert LdrFilter().update([500, 510, 520, 530]) == [500, 510, 520, 530]
+
+def test_filter_suppresses_small_noise():
+    ldr_filter = LdrFilter()
+    first = ldr_filter.update([500, 500, 500, 500])
+    assert ldr_filter.update([501, 499, 501, 500]) is first
+    assert ldr_filter.suppressed == 1
+
+def test_filter_rejects_single_outlier():
+    ldr_filter = LdrFilter()
+    ldr_filter.update([500, 500, 500, 500])
+    assert ldr_filter.update([1000, 500, 500, 500]) == [500, 500, 500, 500]
+    assert ldr_filter.rejected == 1
+
+def test_filter_accepts_step_after_outlier_limit():
+    ldr_filter = LdrFilter(outlier_limit=3)
+    ldr_filter.update([500, 500, 500, 500])
+    for _ in range(2):
+        assert ldr_filter.update([100, 500, 500, 500])[0] == 500
+    assert ldr_filter.update([100, 500, 500, 500])[0] == 100
+
+def test_noise_does_not_bump_state_version():
+    server = make_server()
+    server.on_ldr_sample([500, 500, 500, 500])
+    version = server.state_version
+    for noise in ([501, 499, 500, 502], [499, 500, 501, 500]):
+        server.on_ldr_sample(noise)
+    assert server.state_version == version and server.ldr_readings == [500, 500, 500, 500]
+    assert server.ldr_filter.raw == [499, 500, 501, 500]
+
+# Servo command cache
+
+def test_cache_skips_duplicates_and_deadband():
+    cache = ServoCommandCache(deadband=1, clock=FakeClock())
+    assert cache.should_send((90, 90, 90, 90))
+    assert not cache.should_send((90, 90, 90, 90))
+    assert not cache.should_send((91, 89, 90, 90))
+    assert cache.should_send((92, 90, 90, 90))
+    assert cache.should_send((92, 90, 90, 90), force=True)
+    assert (cache.sent, cache.duplicates, cache.within_deadband) == (3, 1, 1)
+
+def test_cache_resends_when_servos_diverge():
+    clock = FakeClock()
+    cache = ServoCommandCache(deadband=1, settle_time=3.0, clock=clock)
+    cache.should_send((120, 90, 90, 90))
+    cache.report((90, 90, 90, 90))
+    # Still moving: not diverged yet
+    clock.now += 1.0
+    assert not cache.should_send((120, 90, 90, 90))
+    # Settled away from the target
+    clock.now += 5.0
+    assert cache.should_send((120, 90, 90, 90))
+    assert cache.resent == 1
+
+def test_cache_reset_forgets_target():
+    cache = ServoCommandCache(clock=FakeClock())
+    cache.should_send((90, 90, 90, 90))
+    cache.reset()
+    assert cache.should_send((90, 90, 90, 90))
+
+def test_server_writes_each_target_once():
+    server = make_server()
+    attach(server)
+    assert server.send_servos(90, 90, 90, 90)
+    assert not server.send_servos(90, 90, 90, 90)
+    assert server.send_servos(90, 90, 90, 90, force=True)
+    assert len(server.serial_writer.queue) == 2
+    server.detach_arduino("test")
+    # Without a link nothing is sent but the target is remembered
+    assert not server.send_servos(100, 90, 90, 90)
+    assert server.last_servos == (100, 90, 90, 90)
+
+# Fleet
+
+def make_fleet(*ports):
+    fleet = PergolaFleet()
+    for port in ports:
+        fleet.add_device(port).clock = FakeClock(1750507200.0)
+    return fleet
+
+def fleet_command(fleet, websocket, **command):
+    asyncio.run(fleet.process_message(websocket, json.dumps(command)))
+
+def test_fleet_routes_commands_by_device():
+    fleet = make_fleet("/dev/ttyACM0", "/dev/ttyACM1")
+    websocket, session = connect(fleet)
+    fleet_command(fleet, websocket, cmd="MODE", mode="manual", device="ttyACM1")
+    assert [device.current_mode for device in fleet.devices.values()] == ["auto", "manual"]
+    # Without a device id every device gets the command
+    fleet_command(fleet, websocket, cmd="GET_STATUS")
+    assert [frame["device"] for frame in queued(session)] == ["ttyACM0", "ttyACM1"]
+    # Unknown devices are ignored
+    fleet_command(fleet, websocket, cmd="MODE", mode="off", device="ttyUSB9")
+    assert [device.current_mode for device in fleet.devices.values()] == ["auto", "manual"]
+    assert queued(session) == []
+
+def test_fleet_lists_devices():
+    fleet = make_fleet("/dev/ttyACM0", "/dev/ttyUSB0")
+    websocket, session = connect(fleet)
+    fleet_command(fleet, websocket, cmd="LIST_DEVICES")
+    reply, = queued(session)
+    assert reply["type"] == "devices"
+    assert [(device["device"], device["port"], device["connected"]) for device in reply["devices"]] == [
+        ("ttyACM0", "/dev/ttyACM0", False), ("ttyUSB0", "/dev/ttyUSB0", False)]
+
+def test_fleet_pushes_only_changed_devices():
+    async def scenario():
+        fleet = make_fleet("/dev/ttyACM0", "/dev/ttyACM1", "/dev/ttyACM2")
+        fleet.broadcast_max_rate = 100
+        fleet.heartbeat_interval = 60
+        websocket, session = connect(fleet)
+        engine = asyncio.create_task(fleet.broadcast_engine())
+        await asyncio.sleep(0.01)
+        queued(session)
+        fleet.devices["ttyACM1"].touch_state()
+        await asyncio.sleep(0.05)
+        engine.cancel()
+        return fleet, queued(session)
+
+    fleet, frames = asyncio.run(scenario())
+    assert [frame["device"] for frame in frames] == ["ttyACM1"]
+    assert fleet.broadcast_pushes == 1
+    assert [device.broadcast_pushes for device in fleet.devices.values()] == [0, 1, 0]
+
+def test_fleet_sends_one_heartbeat_for_all_devices():
+    async def scenario():
+        fleet = make_fleet("/dev/ttyACM0", "/dev/ttyACM1", "/dev/ttyACM2")
+        fleet.heartbeat_interval = 0.03
+        websocket, session = connect(fleet)
+        engine = asyncio.create_task(fleet.broadcast_engine())
+        await asyncio.sleep(0.05)
+        engine.cancel()
+        return fleet, queued(session)
+
+    fleet, frames = asyncio.run(scenario())
+    assert len(frames) == fleet.broadcast_heartbeats == 1
+    assert frames[0] == {"type": "heartbeat", "devices": {"ttyACM0": 0, "ttyACM1": 0, "ttyACM2": 0}}
+
+# Port discovery
+
+def probe_pty(*chunks, timeout=1.0):
+    """probe_port() on a pseudo-terminal, with chunks written by the "Arduino" as it boots"""
+    async def scenario():
+        master, slave = os.openpty()
+        port = os.ttyname(slave)
+        loop = asyncio.get_running_loop()
+        for delay, chunk in enumerate(chunks):
+            loop.call_later(0.02 * (delay + 1), os.write, master, chunk)
+        try:
+            probed = await probe_port(port, 9600, timeout=timeout)
+            if probed:
+                probed[0].close()
+                return probed[1]
+            return probed
+        finally:
+            os.close(master)
+            os.close(slave)
+    return asyncio.run(scenario())
+
+def test_probe_waits_for_banner():
+    pending = probe_pty(b"\x00garbage\r\n", b"Pergola Maquette Ready\r\nLDR:1,2,", b"3,4\r\n")
+    assert pending.startswith(b"LDR:1,2,")
+
+def test_probe_accepts_board_that_did_not_reset():
+    assert probe_pty(b"3,4\r\nLDR:5,6,7,8\r\nLDR:9,") == b"LDR:9,"
+
+def test_probe_gives_up_on_silent_or_missing_port():
+    assert probe_pty(b"hello\r\n", timeout=0.1) is None
+    assert asyncio.run(probe_port("/dev/does-not-exist", 9600, timeout=0.1)) is None
+
+def test_fleet_probes_ports_in_parallel(monkeypatch):
+    async def slow_probe(port, baudrate):
+        await asyncio.sleep(0.1)
+        return None
+
+    fleet = PergolaFleet()
+    ports = [f"/dev/ttyUSB{i}" for i in range(5)]
+    monkeypatch.setattr(pergola_server_complete, "probe_port", slow_probe)
+    monkeypatch.setattr(fleet, "discover_ports", lambda: ports)
+    started = time.perf_counter()
+    assert asyncio.run(fleet.probe_new_ports()) == 0
+    assert time.perf_counter() - started < 0.3
+    assert sorted(fleet.failed_ports) == ports
+
+def test_fleet_backs_off_silent_ports(monkeypatch):
+    probed = []
+
+    async def no_answer(port, baudrate):
+        probed.append(port)
+        return None
+
+    fleet = PergolaFleet()
+    fleet.rescan_interval, fleet.rescan_max_delay = 10.0, 30.0
+    discovered = ["/dev/ttyUSB0"]
+    monkeypatch.setattr(pergola_server_complete, "probe_port", no_answer)
+    monkeypatch.setattr(fleet, "discover_ports", lambda: discovered)
+    delays = []
+    for _ in range(4):
+        asyncio.run(fleet.probe_new_ports())
+        # Not probed again before its delay is up
+        asyncio.run(fleet.probe_new_ports())
+        delays.append(fleet.failed_ports["/dev/ttyUSB0"][1])
+        fleet.failed_ports["/dev/ttyUSB0"] = (0.0, delays[-1])
+    assert delays == [10.0, 20.0, 30.0, 30.0] and len(probed) == 4
+    # An unplugged port is forgotten and starts over
+    discovered.clear()
+    asyncio.run(fleet.probe_new_ports())
+    assert fleet.failed_ports == {}
+
+# Serial supervisor
+
+def test_supervisor_backs_off_then_reattaches(monkeypatch):
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def record_sleep(delay):
+        delays.append(delay)
+        await real_sleep(0)
+
+    async def wait_for(condition):
+        for _ in range(200):
+            if condition():
+                return
+            await real_sleep(0.005)
+        raise AssertionError("timed out")
+
+    async def scenario():
+        server = make_server()
+        server.reconnect_max_delay = 4.0
+        server.current_mode = "manual"
+        server.last_servos = (100, 90, 90, 80)
+        port = PipePort()
+
+        async def connect_arduino():
+            return None if len(delays) < 5 else (port, b"LDR:500,500,500,500\r\n")
+
+        server.connect_arduino = connect_arduino
+        monkeypatch.setattr(asyncio, "sleep", record_sleep)
+        supervisor = asyncio.create_task(server.serial_supervisor())
+        await wait_for(lambda: server.link_state == "connected")
+        assert server.ldr_filter.raw == [500, 500, 500, 500]
+        # The sketch acknowledges the handshake, then gets the last target back
+        port.feed(b"PROTO_OK:BIN1,115200\r\n")
+        await wait_for(lambda: port.written.endswith(encode_servos(100, 90, 90, 80)))
+        supervisor.cancel()
+        server.detach_arduino("test")
+        return server
+
+    server = asyncio.run(scenario())
+    assert delays == [0.5, 1.0, 2.0, 4.0, 4.0]
+    assert server.link_losses == 1 and server.link_reconnects == 0
+
+def test_supervisor_detaches_silent_link():
+    async def scenario():
+        server = make_server()
+        server.link_timeout = 0.05
+        port = attach(server)
+        server.last_rx = time.monotonic()
+        attempts = []
+
+        async def connect_arduino():
+            attempts.append(server.link_state)
+            return None
+
+        server.connect_arduino = connect_arduino
+        supervisor = asyncio.create_task(server.serial_supervisor())
+        # Bytes that are not a valid sample don't keep the link alive
+        port.feed(b"noise\r\n")
+        await asyncio.sleep(0.1)
+        supervisor.cancel()
+        return server, attempts
+
+    server, attempts = asyncio.run(scenario())
+    assert server.arduino is None and server.link_losses == 1
+    assert attempts == ["connecting"] and server.link_state == "disconnected"
+
+def test_binary_link_lost_after_garbage():
+    server = make_server()
+    server.current_mode = "manual"
+    port = attach(server, binary=True)
+    # A chunk with a valid frame counts as alive
+    port.feed(b"\x00" * 100 + encode_ldr(500, 500, 500, 500))
+    server.read_sensors()
+    port.feed(b"\x00" * 100)
+    server.read_sensors()
+    assert server.arduino is port and server.rx_garbage == 100
+    port.feed(b"\x00" * 40)
+    server.read_sensors()
+    assert server.arduino is None and server.link_losses == 1
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Unit tests for pergola_storage: the write-behind logger, its spill file,
+rejected rows and rollups
+
+    python -m pytest -q test_pergola_storage.py
+"""
+
+import sqlite3
+
+import pytest
+
+from pergola_storage import LogWriter, RollupAggregator, SqliteSink
+
+# Write-behind logger
+
+class DownSink:
+    """Database that cannot be reached"""
+
+    def insert(self, table, rows):
+        raise sqlite3.OperationalError("connection refused")
+
+@pytest.fixture
+def paths(tmp_path):
+    return tmp_path / "logs.db", tmp_path / "spill.db"
+
+def log_rows(writer, modes):
+    for mode in modes:
+        writer.log(mode, 10.0, -5.0, 4500, False, timestamp=1700000000)
+    batch = list(writer.queues["pergola_logs"])
+    writer.queues["pergola_logs"].clear()
+    return batch
+
+def test_writer_flushes_batch(paths):
+    writer = LogWriter(SqliteSink(str(paths[0])), spill_path=str(paths[1]))
+    writer.flush("pergola_logs", log_rows(writer, ["auto", "manual", "off"]))
+    assert writer.sink.count() == 3
+    assert (writer.written, writer.batches, writer.failures) == (3, 1, 0)
+
+def test_writer_rejects_only_the_bad_row(paths):
+    writer = LogWriter(SqliteSink(str(paths[0])), spill_path=str(paths[1]))
+    writer.flush("pergola_logs", log_rows(writer, ["auto", "banana", "manual"]))
+    assert writer.sink.count() == 2
+    assert writer.db_up
+    assert (writer.written, writer.rejected, writer.dropped, writer.failures) == (2, 1, 0, 0)
+    rejected = writer.spill.connect().execute("SELECT table_name, row FROM pergola_rejected").fetchall()
+    assert len(rejected) == 1 and rejected[0][0] == "pergola_logs" and '"banana"' in rejected[0][1]
+
+def test_writer_spills_and_replays(paths):
+    writer = LogWriter(DownSink(), spill_path=str(paths[1]))
+    writer.flush("pergola_logs", log_rows(writer, ["auto", "manual"]))
+    assert not writer.db_up
+    assert writer.spill.count() == 2
+    assert (writer.spilled, writer.failures) == (2, 1)
+    # While down, batches go straight to the spill file
+    writer.flush("pergola_logs", log_rows(writer, ["off"]))
+    assert writer.spill.count() == 3 and writer.failures == 1
+
+    writer.sink = SqliteSink(str(paths[0]))
+    writer.replay()
+    assert writer.db_up
+    assert writer.sink.count() == 3 and writer.spill.count() == 0
+    modes = [row[0] for row in writer.sink.connect().execute("SELECT mode FROM pergola_logs ORDER BY id")]
+    assert modes == ["auto", "manual", "off"]
+    assert writer.replayed == 3
+
+def test_writer_spill_keeps_valid_rows(paths):
+    writer = LogWriter(DownSink(), spill_path=str(paths[1]))
+    writer.flush("pergola_logs", log_rows(writer, ["auto", "banana", "manual"]))
+    assert writer.spill.count() == 2
+    assert (writer.spilled, writer.rejected, writer.dropped) == (2, 1, 0)
+
+def test_writer_replay_rejects_bad_spilled_row(paths):
+    spill = SqliteSink(str(paths[1]))
+    # A spill file written before its CHECK existed
+    spill.connect().executescript("DROP TABLE pergola_logs; CREATE TABLE pergola_logs (id INTEGER PRIMARY KEY "
+                                  "AUTOINCREMENT, user_id TEXT, mode TEXT, horizontal_angle NUMERIC, vertical_angle "
+                                  "NUMERIC, light_sensor_value INTEGER, night_mode BOOLEAN, created_at TEXT);")
+    spill.close()
+    writer = LogWriter(SqliteSink(str(paths[0])), spill_path=str(paths[1]))
+    writer.spill_rows("pergola_logs", log_rows(writer, ["auto", "banana", "manual"]))
+    writer.replay()
+    assert writer.sink.count() == 2 and writer.spill.count() == 0
+    assert (writer.replayed, writer.rejected, writer.failures) == (2, 1, 0)
+    assert writer.db_up
+
+# Rollups
+
+def test_rollup_minute_and_hour_boundaries():
+    closed = []
+    aggregator = RollupAggregator(lambda period, rollup: closed.append((period, rollup)))
+    hour = 7200.0
+    for offset in (3540.0, 3570.0, 3599.5):
+        aggregator.add(hour - 3600 + offset, 100, "auto", False, (90, 90, 90, 90))
+    assert closed == []
+    aggregator.add(hour, 300, "manual", False, (100, 90, 90, 90))
+    assert [period for period, _ in closed] == ["minute", "hour"]
+    minute, whole_hour = closed[0][1], closed[1][1]
+    assert minute.start == hour - 60 and minute.samples == 3
+    assert whole_hour.start == hour - 3600 and whole_hour.samples == 3
+    # The sample at the boundary opens the next minute
+    assert aggregator.minute.start == hour and aggregator.minute.samples == 1
+    assert aggregator.minute.servo_travel == 10
+
+def test_rollup_credits_time_to_previous_mode():
+    closed = []
+    aggregator = RollupAggregator(lambda period, rollup: closed.append(rollup), max_gap=5.0)
+    aggregator.add(0.0, 100, "auto", False, (90, 90, 90, 90))
+    aggregator.add(2.0, 100, "off", True, (90, 90, 90, 90))
+    aggregator.add(30.0, 100, "off", True, (90, 90, 90, 90))
+    aggregator.add(60.0, 100, "off", True, (90, 90, 90, 90))
+    row = closed[0].row("minute")
+    # auto for 2 s, then off/night capped at max_gap per gap
+    assert row[8:12] == (2.0, 0.0, 5.0, 5.0)
+    assert row[5:8] == (100, 100, 100.0)
+
+def test_rollup_rows_land_and_minutes_expire(paths):
+    writer = LogWriter(SqliteSink(str(paths[0])), spill_path=str(paths[1]))
+    aggregator = RollupAggregator(writer.log_rollup)
+    for timestamp in range(0, 3601, 30):
+        aggregator.add(float(timestamp), 100, "auto", False, (90, 90, 90, 90))
+    rows = list(writer.queues["pergola_rollups"])
+    writer.queues["pergola_rollups"].clear()
+    writer.flush("pergola_rollups", rows)
+    assert writer.sink.count("pergola_rollups") == 61
+    # Minute rows older than the cutoff go, hour rows stay
+    assert writer.sink.prune("1970-01-01T00:30:00+00:00") == 30
+    periods = writer.sink.connect().execute("SELECT period, COUNT(*) FROM pergola_rollups GROUP BY period")
+    assert dict(periods.fetchall()) == {"hour": 1, "minute": 30}
+
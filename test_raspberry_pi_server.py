@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the Modbus controller in raspberry-pi-server.py, against a fake
+Modbus client
+
+    python -m pytest -q test_raspberry_pi_server.py
+"""
+
+import asyncio
+import importlib.util
+import json
+from pathlib import Path
+
+spec = importlib.util.spec_from_file_location("raspberry_pi_server", Path(__file__).with_name("raspberry-pi-server.py"))
+server_module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(server_module)
+
+class Result:
+    def __init__(self, registers=None):
+        self.registers = registers
+
+    def isError(self):
+        return False
+
+class FakeModbusClient:
+    """Registers in memory; counts transactions"""
+
+    def __init__(self):
+        self.connected = True
+        self.registers = [0] * 13
+        self.reads = 0
+        self.writes = []
+
+    async def read_holding_registers(self, address, count, device_id):
+        self.reads += 1
+        return Result(self.registers[address:address + count])
+
+    async def write_registers(self, address, values, device_id):
+        self.writes.append(list(values))
+        self.registers[address:address + len(values)] = values
+        return Result()
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+def make_controller(poll_interval=0.02):
+    controller = server_module.PergolaController()
+    controller.modbus_client = FakeModbusClient()
+    controller.sensor_poll_interval = poll_interval
+    return controller
+
+def test_io_loop_polls_sensors():
+    async def scenario():
+        controller = make_controller()
+        controller.io_task = asyncio.create_task(controller.modbus_io_loop())
+        await asyncio.sleep(0.01)
+        controller.modbus_client.registers[0:3] = [server_module.to_register(12.5), 0, 400]
+        await asyncio.sleep(0.05)
+        controller.io_task.cancel()
+        return controller
+
+    controller = asyncio.run(scenario())
+    assert controller.current_state["horizontal_angle"] == 12.5
+    assert controller.current_state["light_sensor"] == 400
+    assert controller.state_changed.is_set()
+    assert controller.modbus_client.reads >= 3
+
+def test_io_loop_does_not_poll_while_disconnected():
+    async def scenario():
+        controller = make_controller()
+        controller.modbus_client.connected = False
+        controller.io_task = asyncio.create_task(controller.modbus_io_loop())
+        await asyncio.sleep(0.05)
+        controller.io_task.cancel()
+        return controller
+
+    assert asyncio.run(scenario()).modbus_client.reads == 0
+
+def test_sensor_change_is_pushed_without_a_request():
+    async def scenario():
+        controller = make_controller()
+        controller.heartbeat_interval = 60
+        controller.broadcast_max_rate = 100
+        websocket = FakeWebSocket()
+        controller.connected_clients.add(websocket)
+        controller.io_task = asyncio.create_task(controller.modbus_io_loop())
+        engine = asyncio.create_task(controller.broadcast_engine())
+        await asyncio.sleep(0.05)
+        websocket.sent.clear()
+        controller.modbus_client.registers[2] = 30
+        await asyncio.sleep(0.1)
+        engine.cancel()
+        controller.io_task.cancel()
+        return websocket
+
+    sent = asyncio.run(scenario()).sent
+    assert len(sent) == 1
+    assert sent[0]["light_sensor"] == 30 and sent[0]["night_mode"] is True
+
+def test_commands_are_coalesced():
+    async def scenario():
+        controller = make_controller(poll_interval=60)
+        controller.io_task = asyncio.create_task(controller.modbus_io_loop())
+        await asyncio.sleep(0.01)
+        results = await asyncio.gather(*(controller.write_actuator_commands(h, -h) for h in (1.0, 2.0, 3.0)))
+        controller.io_task.cancel()
+        return controller, results
+
+    controller, results = asyncio.run(scenario())
+    assert results == [True, True, True]
+    assert controller.modbus_client.writes == [[300, server_module.to_register(-3.0), 0]]